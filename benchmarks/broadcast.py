@@ -0,0 +1,119 @@
+"""Measures the cost of broadcasting a packet to every player in a room.
+
+Compares serializing the batch record of the packet once per recipient against
+serializing it once and sharing the same buffer with every recipient, which is
+what `Room.forward_packet` does.
+
+Usage:
+    python benchmarks/broadcast.py [players]
+"""
+
+# Copyright (C) 2025  Stefano Cuizza
+
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from collections.abc import Callable
+import sys
+from timeit import repeat
+from uuid import UUID, uuid4
+
+from squared.app.net.connection import Connection, OutboundQueue
+from squared.app.net.packet import BatchPacket, Capability, Packet, PositionPacket
+from squared.app.net.room import Room
+
+
+def per_recipient_broadcast(room: Room, source: UUID, packet: Packet) -> None:
+    """Sends the same records as `Room.forward_packet`, serialized once for every recipient."""
+
+    with room._lock:
+        for identity, connection in room._connections.items():
+            if identity != source:
+                connection.send(BatchPacket.record(room._sessions[source], packet))
+
+
+def measure(
+        function: Callable[[], None],
+        setup: Callable[[], object] = lambda: None,
+        number: int = 200,
+) -> float:
+    """Returns the best time per call of a function, in seconds."""
+
+    return min(repeat(function, setup, number=number, repeat=5)) / number
+
+
+def main(players: int) -> None:
+    """Runs the benchmark."""
+
+    room = Room(0)
+    for _ in range(players):
+        identity = uuid4()
+        queue = OutboundQueue(sys.maxsize)
+        room._connections[identity] = Connection(
+            identity, lambda: None, queue, capabilities=Capability.COMPACT_ENCODING
+        )
+        room._open_session(identity)
+
+    source: UUID = next(iter(room._connections))
+    session: int = room._sessions[source]
+    recipients: list[UUID] = [identity for identity in room._connections if identity != source]
+
+    def new_packet() -> Packet:
+        return PositionPacket.from_coordinates(1, 2)
+
+    def drain() -> list[bytes]:
+        return [
+            data
+            for connection in room._connections.values()
+            for data in connection.queue.pop_all()
+        ]
+
+    def serialize_per_recipient() -> None:
+        packet = new_packet()
+        for _ in recipients:
+            _ = BatchPacket.record(session, packet)
+
+    def serialize_once() -> None:
+        data = BatchPacket.record(session, new_packet())
+        for _ in recipients:
+            _ = data
+
+    def broadcast_per_recipient() -> None:
+        per_recipient_broadcast(room, source, new_packet())
+
+    def broadcast_once() -> None:
+        room.forward_packet(source, new_packet())
+
+    # both sides have to send every recipient the same bytes.
+    broadcast_per_recipient()
+    expected: list[bytes] = drain()
+    broadcast_once()
+    assert drain() == expected
+
+    results: dict[str, tuple[float, float]] = {
+        'serialization': (measure(serialize_per_recipient), measure(serialize_once)),
+        'broadcast': (measure(broadcast_per_recipient, drain), measure(broadcast_once, drain)),
+    }
+
+    print(f'broadcasting a position update to {players} players:')
+    print(f'  {"":<14} {"per-recipient":>16} {"encode-once":>16} {"speedup":>8}')
+    for name, (per_recipient, encode_once) in results.items():
+        print(
+            f'  {name:<14} {per_recipient * 1e6:13.1f} us {encode_once * 1e6:13.1f} us '
+            f'{per_recipient / encode_once:7.2f}x'
+        )
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,122 @@
+"""Contains the inbox that hands the updates received by the network thread to the game loop."""
+
+# Copyright (C) 2025  Stefano Cuizza
+
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+from collections.abc import Callable, Mapping
+from threading import Lock
+from time import monotonic
+from typing import Optional
+from uuid import UUID
+
+from .sprites.player import PlayerAttributes, PlayerPosition
+
+
+class Inbox:
+    """Collects the updates received by the network thread until the game loop drains them.
+
+    Joins and leaves are kept in the order they were received, while the position updates
+    of a player get coalesced, so that every player is moved at most once per drain,
+    however fast the updates arrive. A player that joins or leaves drops its pending
+    position update, as the join carries the position of the player anyway.
+
+    Only the latest move ack of the local player is kept, as it supersedes the older ones.
+
+    Moves are timestamped when they are received, rather than when they are drained,
+    so that the game loop can tell exactly when every position was current.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+
+        self._events: list[tuple[UUID, Optional[PlayerAttributes]]] = []
+        self._moves: dict[UUID, tuple[PlayerPosition, float]] = {}
+        self._move_ack: Optional[tuple[int, PlayerPosition]] = None
+
+    def join(self, identity: UUID, attributes: PlayerAttributes) -> None:
+        """Registers a player join."""
+
+        with self._lock:
+            self._moves.pop(identity, None)
+            self._events.append((identity, attributes))
+
+    def leave(self, identity: UUID) -> None:
+        """Registers a player leave."""
+
+        with self._lock:
+            self._moves.pop(identity, None)
+            self._events.append((identity, None))
+
+    def move(self, identity: UUID, position: PlayerPosition) -> None:
+        """Registers a player move, replacing the pending move of the player."""
+
+        with self._lock:
+            self._moves[identity] = (position, monotonic())
+
+    def move_all(self, moves: Mapping[UUID, PlayerPosition]) -> None:
+        """Registers the moves of many players at once."""
+
+        time: float = monotonic()
+
+        with self._lock:
+            self._moves.update(
+                (identity, (position, time)) for identity, position in moves.items()
+            )
+
+    def acknowledge(self, sequence: int, position: PlayerPosition) -> None:
+        """Registers a move ack of the local player, replacing the pending one."""
+
+        with self._lock:
+            self._move_ack = (sequence, position)
+
+    def drain(
+            self,
+            join_action: Callable[[UUID, PlayerAttributes], None],
+            leave_action: Callable[[UUID], None],
+            move_action: Callable[[UUID, PlayerPosition, float], None],
+            move_ack_action: Optional[Callable[[int, PlayerPosition], None]] = None,
+    ) -> None:
+        """Runs the actions of every update registered since the last drain, on the calling thread.
+
+        Args:
+            join_action:
+                the function to run on player join.
+            leave_action:
+                the function to run on player leave.
+            move_action:
+                the function to run on player move, which also gets the monotonic time
+                the move was received at.
+            move_ack_action:
+                the function to run on move ack of the local player.
+        """
+
+        with self._lock:
+            events, self._events = self._events, []
+            moves, self._moves = self._moves, {}
+            move_ack, self._move_ack = self._move_ack, None
+
+        for identity, attributes in events:
+            if attributes is None:
+                leave_action(identity)
+            else:
+                join_action(identity, attributes)
+
+        if move_ack is not None and move_ack_action is not None:
+            move_ack_action(*move_ack)
+
+        for identity, (position, time) in moves.items():
+            move_action(identity, position, time)
@@ -0,0 +1,119 @@
+"""Contains the buffer used to interpolate the positions of remote players."""
+
+# Copyright (C) 2025  Stefano Cuizza
+
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+from array import array
+from typing import Optional
+
+
+type Position = tuple[float, float]
+
+
+INTERPOLATION_DELAY: float = 0.1
+"""How far in the past remote players are rendered by default, in seconds."""
+
+MAX_EXTRAPOLATION: float = 0.1
+"""How long remote players keep moving by default after their last position, in seconds."""
+
+
+class PositionBuffer:
+    """A ring buffer of the timestamped positions of a player.
+
+    The samples are stored in fixed size arrays, and the oldest sample gets overwritten
+    once the buffer is full. Samples must be pushed in chronological order.
+    """
+
+    def __init__(self, capacity: int = 32, max_extrapolation: float = MAX_EXTRAPOLATION):
+        """Args:
+            capacity:
+                the number of samples kept.
+            max_extrapolation:
+                how long the position keeps following the last known velocity, in seconds,
+                when sampled after the newest sample.
+        """
+
+        self._times = array('d', bytes(8 * capacity))
+        self._xs = array('d', bytes(8 * capacity))
+        self._ys = array('d', bytes(8 * capacity))
+
+        self._capacity: int = capacity
+        self._max_extrapolation: float = max_extrapolation
+
+        self._start: int = 0
+        self._count: int = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def push(self, time: float, position: Position) -> None:
+        """Adds the position of the player at a given time."""
+
+        if self._count == self._capacity:
+            index = self._start
+            self._start = (self._start + 1) % self._capacity
+        else:
+            index = (self._start + self._count) % self._capacity
+            self._count += 1
+
+        self._times[index] = time
+        self._xs[index], self._ys[index] = position
+
+    def sample(self, time: float) -> Optional[Position]:
+        """Returns the position of the player at a given time.
+
+        Positions between two samples get interpolated linearly, positions after the
+        newest sample get extrapolated from the two newest samples, for a bounded time.
+        Players only send their position when it changes, so past that bound the position
+        eases back to the newest sample, where a player that stopped actually is.
+
+        Returns:
+            the position of the player, or None if the buffer is empty.
+        """
+
+        if not self._count:
+            return None
+
+        newest = (self._start + self._count - 1) % self._capacity
+
+        # the newest samples are the ones usually needed, so the search starts from them.
+        for offset in range(self._count - 1, -1, -1):
+            index = (self._start + offset) % self._capacity
+
+            if self._times[index] <= time:
+                break
+        else:
+            return self._xs[self._start], self._ys[self._start]
+
+        if index == newest:
+            if self._count == 1:
+                return self._xs[index], self._ys[index]
+
+            previous = (index - 1) % self._capacity
+            elapsed = time - self._times[index]
+            extrapolated = max(0.0, min(elapsed, 2 * self._max_extrapolation - elapsed))
+            time = self._times[index] + extrapolated
+        else:
+            previous, index = index, (index + 1) % self._capacity
+
+        span = self._times[index] - self._times[previous]
+        t = (time - self._times[previous]) / span if span > 0 else 1.0
+
+        return (
+            self._xs[previous] + (self._xs[index] - self._xs[previous]) * t,
+            self._ys[previous] + (self._ys[index] - self._ys[previous]) * t,
+        )
@@ -16,6 +16,7 @@
 #     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+from functools import partial
 import logging
 from typing import Final
 from uuid import UUID
@@ -25,7 +26,9 @@ from pygame import Surface
 
 from ...modules import metadata
 from ..net.client import TCPClient
-from ..net.callbacks import on_player_join, on_player_leave, on_player_move
+from ..net.callbacks import on_move_ack, on_player_join, on_player_leave, on_player_move
+from .inbox import Inbox
+from .interpolation import INTERPOLATION_DELAY
 from .sprites.player import MainPlayer, PLAYERS, PlayerAttributes, PlayerPosition, RemotePlayer
 
 
@@ -40,13 +43,19 @@ def get_main_player() -> MainPlayer:
     return PLAYERS[UUID(int=0)]
 
 
-def on_player_join_action(identity: UUID, attributes: PlayerAttributes) -> None:
+def on_player_join_action(
+        identity: UUID,
+        attributes: PlayerAttributes,
+        interpolation_delay: float = INTERPOLATION_DELAY,
+) -> None:
     """Function that gets called on player join."""
 
     if int(identity) == 0:
         PLAYERS[identity].set_attributes(attributes)
     else:
-        PLAYERS[identity] = RemotePlayer(identity, (0, 0, *BOUNDS), **attributes)
+        PLAYERS[identity] = RemotePlayer(
+            identity, (0, 0, *BOUNDS), **attributes, delay=interpolation_delay
+        )
 
 
 def on_player_leave_action(identity: UUID) -> None:
@@ -58,14 +67,20 @@ def on_player_leave_action(identity: UUID) -> None:
     PLAYERS.pop(identity, None)
 
 
-def on_player_move_action(identity: UUID, position: PlayerPosition) -> None:
+def on_player_move_action(identity: UUID, position: PlayerPosition, time: float) -> None:
     """Function that gets called on player move."""
 
     if int(identity) == 0:
         return
 
     if player := PLAYERS.get(identity):
-        player.set_position(*position)
+        player.set_position(*position, time=time)
+
+
+def on_move_ack_action(sequence: int, position: PlayerPosition) -> None:
+    """Function that gets called when the server acknowledges a move of the local player."""
+
+    get_main_player().reconcile(sequence, position)
 
 
 def init(title: str, size: tuple[int, int]) -> Surface:
@@ -82,10 +97,27 @@ def init(title: str, size: tuple[int, int]) -> Surface:
     return pygame.display.set_mode(size)
 
 
-def main(screen: Surface, fps: int) -> None:
-    """Starts the game."""
+def main(
+        screen: Surface,
+        fps: int,
+        inbox: Inbox,
+        interpolation_delay: float = INTERPOLATION_DELAY,
+) -> None:
+    """Starts the game.
+
+    Args:
+        screen:
+            the surface the game is drawn on.
+        fps:
+            the maximum frame rate.
+        inbox:
+            the inbox of the updates received from the game server, drained once per frame.
+        interpolation_delay:
+            how far in the past remote players are rendered, in seconds.
+    """
 
     clock = pygame.time.Clock()
+    join_action = partial(on_player_join_action, interpolation_delay=interpolation_delay)
 
     running = True
     while running:
@@ -93,6 +125,8 @@ def main(screen: Surface, fps: int) -> None:
 
         screen.fill((0, 0, 0))
 
+        inbox.drain(join_action, on_player_leave_action, on_player_move_action, on_move_ack_action)
+
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
@@ -120,23 +154,30 @@ def main(screen: Surface, fps: int) -> None:
         pygame.display.update()
 
 
-def run(client: TCPClient) -> None:
+def run(client: TCPClient, interpolation_delay: float = INTERPOLATION_DELAY) -> None:
     """Runs the game.
 
     Args:
         client:
             the TCP client used to communicate with the game server.
+        interpolation_delay:
+            how far in the past remote players are rendered, in seconds.
     """
 
     PLAYERS[UUID(int=0)] = MainPlayer(UUID(int=0), (0, 0, *BOUNDS), client)
 
-    client.add_callback(on_player_join(on_player_join_action))
-    client.add_callback(on_player_leave(on_player_leave_action))
-    client.add_callback(on_player_move(on_player_move_action))
+    # the players only ever get touched by the game loop, the client thread just fills the inbox.
+    inbox = Inbox()
+
+    client.add_callback(on_player_join(inbox.join))
+    client.add_callback(on_player_leave(inbox.leave))
+    client.add_callback(on_player_move(inbox.move))
+    client.add_callback(on_move_ack(inbox.acknowledge))
+    client.snapshot_callback = inbox.move_all
 
     client.start()
 
     window_title: str = f'{metadata.package().capitalize()} - v{metadata.version()}'
     screen = init(window_title, BOUNDS)
 
-    main(screen, 60)
+    main(screen, 60, inbox, interpolation_delay)
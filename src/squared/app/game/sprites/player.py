@@ -16,12 +16,15 @@
 #     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+from collections import deque
+from time import monotonic
 from typing import TypedDict, Optional, Union
 from uuid import UUID
 
 from pygame import Surface, Rect
 
 from . import BaseSprite
+from ..interpolation import INTERPOLATION_DELAY, PositionBuffer
 
 
 type PlayerBounds = tuple[int, int, int, int]
@@ -92,9 +95,21 @@ class BasePlayer(BaseSprite):
 
 
 class RemotePlayer(BasePlayer):
-    """Represents a remote player."""
-
-    def __init__(self, identity: UUID, bounds: PlayerBounds, color: PlayerColor, position: PlayerPosition, size: PlayerSize):
+    """Represents a remote player.
+
+    Remote players are rendered a fixed delay in the past, interpolating between the
+    positions received, so that network jitter does not make them stutter.
+    """
+
+    def __init__(
+            self,
+            identity: UUID,
+            bounds: PlayerBounds,
+            color: PlayerColor,
+            position: PlayerPosition,
+            size: PlayerSize,
+            delay: float = INTERPOLATION_DELAY,
+    ):
         """Args:
             identity:
                 the UUID identifying the player.
@@ -106,11 +121,16 @@ class RemotePlayer(BasePlayer):
                 the position of the player.
             size:
                 the size of the player.
+            delay:
+                how far in the past the player is rendered, in seconds.
         """
 
         super().__init__(identity, bounds)
 
         self._position: PlayerPosition = position
+        self._positions = PositionBuffer()
+        self._positions.push(monotonic(), position)
+        self._delay: float = delay
 
         self._surface = Surface(size)
         self._surface.fill(color)
@@ -123,10 +143,26 @@ class RemotePlayer(BasePlayer):
 
         super().update(*args, **kwargs)
 
-        self._rect.move_ip(self._position[0] - self.x, self._position[1] - self.y)
-
-    def set_position(self, x: Optional[float] = None, y: Optional[float] = None) -> None:
-        """Sets the player's location."""
+        x, y = self._positions.sample(monotonic() - self._delay)
+
+        self._rect.move_ip(x - self.x, y - self.y)
+
+    def set_position(
+            self,
+            x: Optional[float] = None,
+            y: Optional[float] = None,
+            time: Optional[float] = None,
+    ) -> None:
+        """Sets the player's location.
+
+        Args:
+            x:
+                the new x coordinate of the player.
+            y:
+                the new y coordinate of the player.
+            time:
+                when the position was received, now by default.
+        """
 
         if x is not None and y is not None:
             new_position = (x, y)
@@ -137,20 +173,23 @@ class RemotePlayer(BasePlayer):
         else:
             new_position = self._position
 
-        new_rect = Rect(*new_position, *self._surface.get_size())
-        if self._bounds.contains(new_rect):
-            for identity, player in PLAYERS.items():
-                if identity == self._identity:
-                    continue
-
-                if new_rect.colliderect(player.rect):
-                    break
-            else:
-                self._position = new_position
+        # collisions are left to the server: the other players are rendered in the past, so
+        # checking against them would reject positions that were valid when they were sent.
+        if self._bounds.contains(Rect(*new_position, *self._surface.get_size())):
+            self._position = new_position
+            self._positions.push(monotonic() if time is None else time, new_position)
 
 
 class MainPlayer(BasePlayer):
-    """Represents the local player."""
+    """Represents the local player.
+
+    The player moves as soon as it is told to, predicting that the server accepts the
+    move. The moves the server has not acknowledged yet are kept, so that when the server
+    disagrees with a prediction, they get replayed on top of the position of the player
+    on the server.
+    """
+
+    MAX_PENDING_MOVES: int = 128
 
     def __init__(self, identity: UUID, bounds: PlayerBounds, client):
         """Args:
@@ -168,6 +207,9 @@ class MainPlayer(BasePlayer):
 
         self._prev_position = (0.0, 0.0)
         self._velocity: PlayerVelocity = (0.0, 0.0)
+        self._pending_moves: deque[tuple[int, PlayerPosition]] = deque(
+            maxlen=self.MAX_PENDING_MOVES
+        )
 
     def update(self, *args, **kwargs) -> None:
         """Updates the player's position."""
@@ -186,10 +228,37 @@ class MainPlayer(BasePlayer):
                 self._rect.move_ip(*self._velocity)
 
                 if self._prev_position != (self.x, self.y):
-                    self._client.update_position(self.x, self.y)
+                    if (sequence := self._client.update_position(self.x, self.y)) is not None:
+                        self._pending_moves.append((sequence, (self.x, self.y)))
 
                     self._prev_position = (self.x, self.y)
 
+    def reconcile(self, sequence: int, position: PlayerPosition) -> None:
+        """Corrects the predicted position of the player with the one acknowledged by the server.
+
+        Args:
+            sequence:
+                the sequence number of the latest move the server went through.
+            position:
+                the position of the player on the server after that move.
+        """
+
+        # acks of moves that are not pending any more are older than the ones already applied.
+        if all(pending_sequence != sequence for pending_sequence, _ in self._pending_moves):
+            return
+
+        while self._pending_moves.popleft()[0] != sequence:
+            pass
+
+        # moves carry absolute positions, which the server applies on their own: replaying the
+        # moves still in flight on top of the acknowledged position ends where the latest one
+        # does, so the player only gets corrected once none is left.
+        if self._pending_moves or (self.x, self.y) == position:
+            return
+
+        self._rect.move_ip(position[0] - self.x, position[1] - self.y)
+        self._prev_position = (self.x, self.y)
+
     def set_attributes(self, attributes: PlayerAttributes) -> None:
         """Sets the player's attributes."""
 
@@ -199,6 +268,7 @@ class MainPlayer(BasePlayer):
         self._rect = self._surface.get_rect()
         self._rect.update(*attributes['position'], *attributes['size'])
         self._prev_position = (self._rect.x, self._rect.y)
+        self._pending_moves.clear()
 
         self.__blit__ = [self._surface, self._rect]
 
@@ -18,14 +18,43 @@
 
 
 from collections.abc import Callable
+from typing import Optional
 from uuid import UUID
 
-from .packet import Packet, JoinPacket, LeavePacket, PositionPacket
+from .packet import JoinPacket, LeavePacket, MoveAckPacket, Packet, PacketType, PositionPacket
 from ..game.sprites.player import PlayerAttributes, PlayerPosition
 
 
 type ClientCallback = Callable[[UUID, Packet], Packet | None]
 
+type SnapshotCallback = Callable[[dict[UUID, PlayerPosition]], None]
+"""A callback that gets every player that moved in a snapshot at once."""
+
+
+def handles(packet_type: PacketType) -> Callable[[ClientCallback], ClientCallback]:
+    """Returns a decorator that restricts a client callback to a packet type.
+
+    The client only ever runs a restricted callback on packets of that type, callbacks
+    that are not restricted run on every packet.
+
+    Args:
+        packet_type:
+            the type of the packets handled by the callback.
+    """
+
+    def decorator(callback: ClientCallback) -> ClientCallback:
+        callback.packet_type = packet_type
+
+        return callback
+
+    return decorator
+
+
+def handled_packet_type(callback: ClientCallback) -> Optional[PacketType]:
+    """Returns the packet type a client callback is restricted to, if any."""
+
+    return getattr(callback, 'packet_type', None)
+
 
 def on_player_join(action: Callable[[UUID, PlayerAttributes], None]) -> ClientCallback:
     """Returns a client callback that runs on player join.
@@ -35,10 +64,8 @@ def on_player_join(action: Callable[[UUID, PlayerAttributes], None]) -> ClientCa
             the function to run on player join.
     """
 
-    def callback(identity: UUID, packet: Packet) -> Packet | None:
-        if not isinstance(packet, JoinPacket):
-            return packet
-
+    @handles(PacketType.JOIN)
+    def callback(identity: UUID, packet: JoinPacket) -> Packet | None:
         return action(identity, packet.attributes)
 
     return callback
@@ -52,10 +79,8 @@ def on_player_leave(action: Callable[[UUID], None]) -> ClientCallback:
             the function to run on player leave.
     """
 
-    def callback(identity: UUID, packet: Packet) -> Packet | None:
-        if not isinstance(packet, LeavePacket):
-            return packet
-
+    @handles(PacketType.LEAVE)
+    def callback(identity: UUID, packet: LeavePacket) -> Packet | None:
         return action(identity)
 
     return callback
@@ -69,10 +94,24 @@ def on_player_move(action: Callable[[UUID, PlayerPosition], None]) -> ClientCall
             the function to run on player move.
     """
 
-    def callback(identity: UUID, packet: Packet) -> Packet | None:
-        if not isinstance(packet, PositionPacket):
-            return packet
-
+    @handles(PacketType.POSITION)
+    def callback(identity: UUID, packet: PositionPacket) -> Packet | None:
         return action(identity, (packet.x, packet.y))
 
     return callback
+
+
+def on_move_ack(action: Callable[[int, PlayerPosition], None]) -> ClientCallback:
+    """Returns a client callback that runs when the server acknowledges a move of the local player.
+
+    Args:
+        action:
+            the function to run on move ack, with the sequence number of the move and
+            the authoritative position of the player.
+    """
+
+    @handles(PacketType.MOVE_ACK)
+    def callback(_identity: UUID, packet: MoveAckPacket) -> Packet | None:
+        return action(packet.sequence, (packet.x, packet.y))
+
+    return callback
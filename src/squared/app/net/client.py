@@ -16,16 +16,27 @@
 #     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+from collections.abc import Hashable
 from dataclasses import dataclass, field
 import logging
-from queue import Queue
-from socket import AF_INET, SOCK_STREAM, socket
+from socket import AF_INET, error as socket_error, SHUT_RDWR, SOCK_DGRAM, SOCK_STREAM, socket
 import struct
-from threading import Thread
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Optional
 from uuid import UUID
 
-from .callbacks import ClientCallback
-from .packet import Packet, EmbeddedPacket, PositionPacket
+from .callbacks import ClientCallback, handled_packet_type, SnapshotCallback
+from .connection import OutboundQueue
+from .datagram import is_newer
+from .packet import (
+    ALL_CAPABILITIES, POSITION_ENCODING, WORLD_SESSION, AckPacket, BatchPacket, Capability,
+    ChannelPacket, DatagramPacket, EmbeddedPacket, HelloPacket, LeavePacket, MovePacket, Packet,
+    PacketType, PositionPacket, RejectPacket, SessionPacket, Snapshot, SnapshotPacket,
+    WelcomePacket, WorldPacket,
+)
+from .stream import PacketReader
+from ..game.sprites.player import PlayerPosition
 
 
 logger = logging.getLogger(__name__)
@@ -35,9 +46,28 @@ logger = logging.getLogger(__name__)
 class TCPClient:
     """TCP client used to communicate with the game server."""
 
-    _outbound_packets_queue: Queue = field(init=False, default=Queue())
+    _outbound_packets_queue: OutboundQueue = field(default_factory=OutboundQueue, init=False)
+    _lock: Lock = field(default_factory=Lock, init=False)
+    _channel: Optional[socket] = field(default=None, init=False)
+    _channel_token: int = field(default=0, init=False)
+    _channel_sequence: int = field(default=0, init=False)
+    _move_sequence: int = field(default=0, init=False)
+    _sessions: dict[int, UUID] = field(default_factory=lambda: {}, init=False)
+    _snapshots: dict[int, Snapshot] = field(default_factory=lambda: {}, init=False)
+    _snapshot: Snapshot = field(default_factory=lambda: {}, init=False)
+    _dispatch: dict[PacketType, list[ClientCallback]] = field(
+        default_factory=lambda: {}, init=False
+    )
+    _moves: Optional[dict[UUID, PlayerPosition]] = field(default=None, init=False)
     address: tuple[str, int]
     callbacks: list[ClientCallback] = field(default_factory=lambda: [])
+    room: int = 0
+    capabilities: Capability = ALL_CAPABILITIES
+    send_rate: int = 30
+    snapshot_callback: Optional[SnapshotCallback] = None
+
+    def __post_init__(self):
+        self._update_dispatch()
 
     def start(self) -> None:
         """Starts the client."""
@@ -45,31 +75,64 @@ class TCPClient:
         thread = Thread(target=TCPClient._handle_client, args=(self,))
         thread.start()
 
-    def send_packet(self, packet: Packet) -> None:
+    def send_packet(self, packet: Packet, key: Optional[Hashable] = None) -> None:
         """Sends a packet to the game server.
 
+        Packets are sent at most `send_rate` times per second, however often the game
+        produces them, and in order.
+
         Args:
             packet:
                 the packet to send.
+            key:
+                the latest-wins key of the packet, if any: a packet with the same key
+                waiting to be sent gets replaced.
         """
 
-        self._outbound_packets_queue.put(packet)
+        if not self._outbound_packets_queue.put(packet.to_bytes(), key):
+            logger.warning('outbound queue full, packet dropped %r.', packet)
 
-    def update_position(self, x: int, y: int) -> None:
+    def update_position(self, x: int, y: int) -> Optional[int]:
         """Updates the local player's position.
 
+        When the server supports prediction, the position is sent as a move with a
+        sequence number, which the server acknowledges with the authoritative position
+        of the player.
+
         Args:
             x:
                 the x coordinate of the player.
             y:
                 the y coordinate of the player.
+
+        Returns:
+            the sequence number of the move, if the server acknowledges moves.
         """
 
-        self.send_packet(PositionPacket.from_coordinates(x, y))
+        if Capability.PREDICTION not in self.capabilities:
+            packet = PositionPacket.from_coordinates(x, y).for_encoding(
+                Capability.COMPACT_ENCODING not in self.capabilities
+            )
+            self.send_packet(packet, key=PacketType.POSITION)
+
+            return None
+
+        # a move replacing an unsent one still acknowledges it, as its sequence number is newer.
+        self._move_sequence = sequence = (self._move_sequence + 1) & 0xFFFFFFFF
+        self.send_packet(MovePacket.from_coordinates(sequence, x, y), key=PacketType.POSITION)
+
+        return sequence
 
     def _handle_client(self) -> None:
+        """Connects to the server and offers it the client's capabilities.
+
+        The server picks the ones it supports as well, which replace them once the
+        client is welcomed.
+        """
+
         with socket(AF_INET, SOCK_STREAM) as s:
             s.connect(self.address)
+            s.sendall(HelloPacket.from_capabilities(self.room, self.capabilities).to_bytes())
 
             thread = Thread(target=TCPClient._handle_outbound_packets, args=(self, s))
             thread.start()
@@ -78,53 +141,307 @@ class TCPClient:
 
     def _handle_inbound_packets(self, sock: socket) -> None:
         try:
-            while True:
+            for blob in PacketReader(sock):
                 try:
-                    packet = Packet.from_socket(sock).parse()
+                    packet = Packet.from_bytes(blob).parse()
                 except (struct.error, ValueError):
                     logger.warning('discarding malformed packet.')
 
                     continue
 
-                if not isinstance(packet, EmbeddedPacket):
+                match packet:
+                    case RejectPacket():
+                        logger.error('connection rejected by the server: %s.', packet.reason)
+
+                        break
+                    case BatchPacket():
+                        self._handle_batch(packet)
+                    case WelcomePacket():
+                        with self._lock:
+                            self._handle_record(WORLD_SESSION, packet)
+                    case EmbeddedPacket():
+                        self._handle_packet(packet.identity, packet.embed, legacy=True)
+
+        finally:
+            logger.info('connection closed.')
+            sock.close()
+
+            self._outbound_packets_queue.close()
+            self._close_channel()
+
+    def _handle_batch(self, packet: BatchPacket) -> None:
+        # batches come from both the stream and the datagram channel.
+        with self._lock:
+            if self.snapshot_callback is not None:
+                self._moves = {}
+
+            try:
+                for session, record in packet.records():
+                    self._handle_record(session, record)
+            except (struct.error, ValueError):
+                logger.warning('discarding the rest of a malformed batch.')
+            finally:
+                moves, self._moves = self._moves, None
+
+            if moves:
+                self.snapshot_callback(moves)
+
+    def _open_channel(self, token: int) -> None:
+        """Opens the datagram channel offered by the server.
+
+        Position updates are then sent and received over UDP as well, everything else
+        keeps going over TCP.
+        """
+
+        sock = socket(AF_INET, SOCK_DGRAM)
+        sock.connect(self.address)
+
+        self._channel, self._channel_token = sock, token
+
+        # an empty datagram lets the server learn where to send its own datagrams.
+        try:
+            sock.send(DatagramPacket.from_packet(token, self._channel_sequence).to_bytes())
+        except socket_error as e:
+            logger.debug('datagram dropped: %s.', e)
+
+        thread = Thread(target=TCPClient._handle_datagrams, args=(self, sock))
+        thread.start()
+
+    def _close_channel(self) -> None:
+        if (sock := self._channel) is None:
+            return
+
+        self._channel = None
+
+        try:
+            sock.shutdown(SHUT_RDWR)
+        except socket_error:
+            pass
+
+    def _handle_datagrams(self, sock: socket) -> None:
+        received: Optional[int] = None
+
+        with sock:
+            while self._channel is sock:
+                try:
+                    data: bytes = sock.recv(0x10000)
+                except ConnectionRefusedError:
                     continue
+                except socket_error:
+                    break
 
-                source_identity: UUID = packet.identity
+                # the socket got shut down.
+                if not data:
+                    continue
 
                 try:
-                    packet: Packet = packet.embed.parse()
+                    packet = Packet.from_bytes(data).parse()
+
+                    if not isinstance(packet, DatagramPacket):
+                        continue
+
+                    if packet.token != self._channel_token:
+                        continue
+
+                    # the datagrams of the same update share a sequence number.
+                    if received is not None and is_newer(received, packet.sequence):
+                        logger.debug('discarding stale datagram %d.', packet.sequence)
+
+                        continue
+
+                    received = packet.sequence
+
+                    if (embed := packet.embed) is None:
+                        continue
+
+                    if isinstance(embed.parse(), BatchPacket):
+                        self._handle_batch(embed)
                 except (struct.error, ValueError):
-                    logger.warning('discarding malformed packet from (%s).', source_identity)
+                    logger.warning('discarding malformed datagram.')
 
-                    continue
+    def _handle_record(self, session: int, packet: Packet) -> None:
+        packet = packet.parse()
 
-                logger.debug('received packet from (%s) %r.', source_identity, packet)
+        if isinstance(packet, WelcomePacket):
+            logger.info(
+                'welcomed by the server: version %d, capabilities %r.',
+                packet.version, packet.capabilities,
+            )
 
-                for callback in self.callbacks:
-                    if (packet := callback(source_identity, packet)) is None:
-                        break
+            self.capabilities = packet.capabilities
 
-        finally:
-            logger.info('connection closed.')
-            sock.close()
+            return
+
+        if isinstance(packet, ChannelPacket):
+            self._open_channel(packet.token)
+
+            return
+
+        if isinstance(packet, SnapshotPacket):
+            self._handle_snapshot(packet)
+
+            return
+
+        if isinstance(packet, WorldPacket):
+            for player_session, identity, join_packet in packet.players():
+                self._sessions[player_session] = identity
+                self._snapshot.pop(player_session, None)
+
+                self._handle_packet(identity, join_packet)
+
+            return
+
+        if isinstance(packet, SessionPacket):
+            self._sessions[session] = packet.identity
+
+            # the player gets announced with its current position, which may not match the
+            # latest snapshot: the next snapshot moves it wherever it is.
+            self._snapshot.pop(session, None)
+
+            return
+
+        if (source_identity := self._sessions.get(session)) is None:
+            logger.warning('discarding packet from unknown session %d.', session)
+
+            return
+
+        if isinstance(packet, LeavePacket):
+            del self._sessions[session]
+            self._snapshot.pop(session, None)
+
+            if self._moves is not None:
+                self._moves.pop(source_identity, None)
+
+        if self._moves is not None and isinstance(packet, PositionPacket):
+            self._moves[source_identity] = (packet.x, packet.y)
+
+            return
+
+        self._handle_packet(source_identity, packet)
+
+    def _handle_snapshot(self, packet: SnapshotPacket) -> None:
+        """Rebuilds a snapshot of the room from its baseline, moves the players that changed
+        and acknowledges the snapshot.
+        """
+
+        baseline_sequence: Optional[int] = packet.baseline
+
+        if baseline_sequence is not None and baseline_sequence not in self._snapshots:
+            logger.warning(
+                'discarding snapshot %d with unknown baseline %d.',
+                packet.sequence, baseline_sequence,
+            )
+
+            return
+
+        snapshot: Snapshot = packet.apply(self._snapshots.get(baseline_sequence))
+
+        # acks only ever move forward, so older snapshots are never used as baselines again.
+        for sequence in list(self._snapshots):
+            if sequence == baseline_sequence:
+                break
+
+            del self._snapshots[sequence]
+
+        for session, fields in snapshot.items():
+            if self._snapshot.get(session) == fields:
+                continue
+
+            if (identity := self._sessions.get(session)) is None:
+                continue
+
+            x, y = map(POSITION_ENCODING.decode, fields)
+
+            if self._moves is not None:
+                self._moves[identity] = (x, y)
+            else:
+                self._handle_packet(identity, PositionPacket.from_coordinates(x, y))
+
+        # the players that get announced are dropped from the positions dispatched, which
+        # must not change the baseline the server refers to.
+        self._snapshots[packet.sequence] = snapshot
+        self._snapshot = dict(snapshot)
+
+        # the server only cares about the latest snapshot acknowledged.
+        self.send_packet(AckPacket.from_sequence(packet.sequence), key=PacketType.ACK)
+
+    def _handle_packet(self, source_identity: UUID, packet: Packet, legacy: bool = False) -> None:
+        try:
+            packet = packet.parse(legacy)
+        except (struct.error, ValueError):
+            logger.warning('discarding malformed packet from (%s).', source_identity)
+
+            return
+
+        logger.debug('received packet from (%s) %r.', source_identity, packet)
+
+        for callback in self._dispatch.get(packet.type, ()):
+            if (packet := callback(source_identity, packet)) is None:
+                break
 
     def _handle_outbound_packets(self, sock: socket) -> None:
-        while True:
-            outbound_pkt: Packet = self._outbound_packets_queue.get()
+        interval: float = 1 / self.send_rate
+        next_send: float = monotonic()
+
+        try:
+            while frames := self._outbound_packets_queue.get():
+                if (channel := self._channel) is not None:
+                    frames = self._send_datagrams(channel, frames)
 
-            logger.debug('sent packet %r.', outbound_pkt)
+                if frames:
+                    sock.sendall(b''.join(frames))
 
-            sock.sendall(outbound_pkt.to_bytes())
+                logger.debug('sent %d packets.', len(frames))
+
+                # packets produced in the meantime get coalesced until the next send.
+                next_send = max(next_send + interval, monotonic())
+                sleep(max(0.0, next_send - monotonic()))
+        except socket_error:
+            logger.info('connection lost while sending.')
+
+    def _send_datagrams(self, channel: socket, frames: list[bytes]) -> list[bytes]:
+        """Sends the position update or move among the outbound packets over the datagram channel.
+
+        Returns:
+            the packets left to send over the stream.
+        """
+
+        stream_frames: list[bytes] = []
+
+        for frame in frames:
+            packet_type: int = int.from_bytes(frame[:2], byteorder='big')
+
+            if packet_type not in (PacketType.POSITION, PacketType.MOVE):
+                stream_frames.append(frame)
+
+                continue
+
+            self._channel_sequence = (self._channel_sequence + 1) & 0xFFFFFFFF
+            datagram = DatagramPacket.from_packet(
+                self._channel_token, self._channel_sequence, frame
+            )
+
+            try:
+                channel.send(datagram.to_bytes())
+            except socket_error as e:
+                logger.debug('datagram dropped: %s.', e)
+
+        return stream_frames
 
     def add_callback(self, callback: ClientCallback) -> None:
         """Adds a callback function to the client.
 
+        Each inbound packet only goes through the callbacks that handle its type. When
+        a snapshot callback is set, it gets every position update of a batch in one
+        call, in place of the move callbacks.
+
         Args:
             callback:
                 the callback function to add.
         """
 
         self.callbacks.append(callback)
+        self._update_dispatch()
 
     def remove_callback(self, callback: ClientCallback) -> None:
         """Removes a callback function from the client.
@@ -135,3 +452,14 @@ class TCPClient:
         """
 
         self.callbacks.remove(callback)
+        self._update_dispatch()
+
+    def _update_dispatch(self) -> None:
+        # the table gets replaced as a whole, so that the reader never sees it half updated.
+        self._dispatch = {
+            packet_type: [
+                callback for callback in self.callbacks
+                if handled_packet_type(callback) in (None, packet_type)
+            ]
+            for packet_type in PacketType
+        }
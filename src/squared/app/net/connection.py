@@ -0,0 +1,273 @@
+"""Contains the server-side representation of a client connection."""
+
+# Copyright (C) 2025  Stefano Cuizza
+
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from collections import deque
+from collections.abc import Callable, Hashable, Sequence
+from dataclasses import dataclass, field
+import logging
+from threading import Condition
+from time import monotonic
+from typing import Optional
+from uuid import UUID
+
+from .datagram import DatagramChannel
+from .packet import BatchPacket, Capability, Snapshot
+
+
+logger = logging.getLogger(__name__)
+
+_COMPACT_ENCODING: int = Capability.COMPACT_ENCODING.value
+
+
+class OutboundQueue:
+    """Bounded, thread-safe queue of serialized packets waiting to be sent to a peer.
+
+    Packets enqueued with a key are latest-wins: a newer packet with the same key
+    replaces the queued one, and they are the first to be dropped when the queue is full.
+    Packets without a key are never dropped.
+
+    Latest-wins packets keep the queue from filling up, so a stalled writer is told
+    apart by how long packets have been waiting to be drained, rather than by how full
+    the queue is.
+    """
+
+    def __init__(self, max_depth: int = 1024, notify: Optional[Callable[[], None]] = None):
+        """Args:
+            max_depth:
+                the maximum number of packets the queue can hold.
+            notify:
+                function called whenever the queue gets flushed, used to wake up
+                writers that do not block on the queue itself.
+        """
+
+        self._condition = Condition()
+        self._entries: deque[list] = deque()
+        self._keyed_entries: dict[Hashable, list] = {}
+
+        self._closed: bool = False
+        self._pending_since: Optional[float] = None
+        self._max_depth: int = max_depth
+        self._notify = notify
+
+    def put(self, data: bytes, key: Optional[Hashable] = None, flush: bool = True) -> bool:
+        """Enqueues a packet.
+
+        Args:
+            data:
+                the serialized packet.
+            key:
+                the latest-wins key of the packet, if any.
+            flush:
+                whether to wake up the writer right away.
+
+        Returns:
+            False if the queue is full of packets that cannot be dropped.
+        """
+
+        with self._condition:
+            if self._closed:
+                return True
+
+            if self._pending_since is None:
+                self._pending_since = monotonic()
+
+            if key is not None and (entry := self._keyed_entries.get(key)):
+                entry[1] = data
+            else:
+                if len(self._entries) >= self._max_depth and not self._drop_oldest():
+                    return False
+
+                entry = [key, data]
+                self._entries.append(entry)
+
+                if key is not None:
+                    self._keyed_entries[key] = entry
+
+            if flush:
+                self._flush()
+
+        return True
+
+    def flush(self) -> None:
+        """Wakes up the writer."""
+
+        with self._condition:
+            self._flush()
+
+    def get(self) -> list[bytes]:
+        """Waits for packets and dequeues all of them.
+
+        Returns:
+            the dequeued packets, or an empty list if the queue has been closed.
+        """
+
+        with self._condition:
+            self._condition.wait_for(lambda: self._entries or self._closed)
+
+            return self.pop_all()
+
+    def pop_all(self) -> list[bytes]:
+        """Dequeues all packets without waiting."""
+
+        with self._condition:
+            packets = [data for _, data in self._entries]
+
+            self._entries.clear()
+            self._keyed_entries.clear()
+            self._pending_since = None
+
+            return packets
+
+    def close(self) -> None:
+        """Closes the queue, discarding every packet still in it."""
+
+        with self._condition:
+            self._closed = True
+            self._entries.clear()
+            self._keyed_entries.clear()
+            self._pending_since = None
+
+            self._flush()
+
+    def stalled_for(self) -> float:
+        """How many seconds the oldest packet in the queue has been waiting for the writer."""
+
+        if (pending_since := self._pending_since) is None:
+            return 0.0
+
+        return monotonic() - pending_since
+
+    def _drop_oldest(self) -> bool:
+        for entry in self._entries:
+            if entry[0] is not None:
+                self._entries.remove(entry)
+                del self._keyed_entries[entry[0]]
+
+                return True
+
+        return False
+
+    def _flush(self) -> None:
+        # only the writer of the connection ever waits on the queue.
+        self._condition.notify()
+
+        if self._notify:
+            self._notify()
+
+    @property
+    def closed(self) -> bool:
+        """Whether the queue has been closed."""
+
+        return self._closed
+
+    @property
+    def depth(self) -> int:
+        """The number of packets in the queue."""
+
+        return len(self._entries)
+
+
+@dataclass(eq=False)
+class Connection:
+    """A client connection, as seen by the game logic.
+
+    Once the client has a datagram channel, latest-wins packets are sent over it
+    instead of the outbound queue, since losing one only delays the state until the
+    next one arrives.
+    """
+
+    identity: UUID
+    close: Callable[[], None]
+    queue: OutboundQueue = field(default_factory=OutboundQueue)
+    visible: set[UUID] = field(default_factory=set)
+    acked: Optional[int] = None
+    snapshots: dict[int, Snapshot] = field(default_factory=lambda: {})
+    moved: Optional[int] = None
+    capabilities: Capability = Capability(0)
+    channel: Optional[DatagramChannel] = None
+    _datagrams: dict[Hashable, bytes] = field(default_factory=lambda: {}, init=False)
+
+    def send(self, data: bytes, key: Optional[Hashable] = None, flush: bool = True) -> None:
+        """Enqueues a packet to be sent to the client.
+
+        The client gets evicted if its outbound queue is full of packets that cannot be dropped.
+
+        Args:
+            data:
+                the serialized packet.
+            key:
+                the latest-wins key of the packet, if any.
+            flush:
+                whether to wake up the writer right away.
+        """
+
+        if key is not None and self.channel is not None and self.channel.address is not None:
+            self._datagrams[key] = data
+
+            if flush:
+                self.flush()
+
+            return
+
+        self._enqueue(data, key, flush)
+
+    def frame(self, packets: Sequence[bytes]) -> bytes:
+        """Frames packets dequeued from the outbound queue into a single write.
+
+        The packets are batch records with the compact encoding, and whole packets without it.
+        """
+
+        if self.legacy:
+            return b''.join(packets)
+
+        return BatchPacket.frame_records(packets)
+
+    def _enqueue(self, data: bytes, key: Optional[Hashable], flush: bool) -> None:
+        if not self.queue.put(data, key, flush):
+            logger.warning('evicting (%s): outbound queue overflow.', self.identity)
+
+            self.evict()
+
+    def flush(self) -> None:
+        """Sends the pending datagrams and wakes up the writer.
+
+        Packets too large for a datagram are sent through the outbound queue instead.
+        """
+
+        if self._datagrams:
+            datagrams, self._datagrams = self._datagrams, {}
+            unsent: set[bytes] = set(self.channel.send(datagrams.values()))
+
+            for key, data in datagrams.items():
+                if data in unsent:
+                    self._enqueue(data, key, flush=False)
+
+        self.queue.flush()
+
+    def evict(self) -> None:
+        """Drops the connection."""
+
+        self.queue.close()
+        self.close()
+
+    @property
+    def legacy(self) -> bool:
+        """Whether the client did not negotiate the compact encoding."""
+
+        # flag membership tests are slow enough to show when broadcasting to large rooms.
+        return not int(self.capabilities) & _COMPACT_ENCODING
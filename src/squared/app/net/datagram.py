@@ -0,0 +1,134 @@
+"""Contains the unreliable datagram channels that run beside client connections."""
+
+# Copyright (C) 2025  Stefano Cuizza
+
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from collections.abc import Callable, Iterable
+import logging
+import secrets
+from typing import Optional
+
+from .packet import BatchPacket, DatagramPacket
+
+
+logger = logging.getLogger(__name__)
+
+type Address = tuple[str, int]
+
+MAX_DATAGRAM_SIZE: int = 1200
+"""The size of the largest datagram sent, small enough to never get fragmented."""
+
+_SEQUENCES: int = 1 << 32
+
+# the header of a datagram packet, its token and sequence number, and the header of the
+# batch packet it carries.
+_OVERHEAD: int = 6 + 12 + 8
+
+
+def is_newer(sequence: int, other: int) -> bool:
+    """Tells whether a datagram sequence number comes after another one, wrapping around."""
+
+    return 0 < (sequence - other) % _SEQUENCES < _SEQUENCES // 2
+
+
+class DatagramChannel:
+    """The datagram channel of a client, used to send it the packets that can get lost.
+
+    The server learns the address of the client from the datagrams the client sends,
+    so nothing gets sent before the client sent its first datagram.
+
+    Every batch record sent in the same call shares a sequence number, so that the
+    client drops the ones that arrive after newer ones.
+    """
+
+    def __init__(self, sendto: Callable[[bytes, Address], None], token: Optional[int] = None):
+        """Args:
+            sendto:
+                function that sends a datagram to an address, without blocking.
+            token:
+                the token of the channel, random by default.
+        """
+
+        self.token: int = secrets.randbits(64) if token is None else token
+        self.address: Optional[Address] = None
+
+        self._sendto = sendto
+        self._sent: int = 0
+        self._received: Optional[int] = None
+
+    def receive(self, sequence: int, address: Address) -> bool:
+        """Registers a datagram received from the client.
+
+        Returns:
+            whether the datagram is newer than every datagram received before.
+        """
+
+        if self._received is not None and not is_newer(sequence, self._received):
+            return False
+
+        if address != self.address:
+            logger.debug(
+                'datagram channel %016x bound to %s.', self.token, '{}:{}'.format(*address)
+            )
+
+        self._received, self.address = sequence, address
+
+        return True
+
+    def send(self, records: Iterable[bytes]) -> list[bytes]:
+        """Sends batch records in as few datagrams as possible.
+
+        Returns:
+            the records that could not be sent, because they are too large for a datagram
+            or because the address of the client is not known yet.
+        """
+
+        if self.address is None:
+            return list(records)
+
+        self._sent = (self._sent + 1) % _SEQUENCES
+
+        unsent: list[bytes] = []
+        chunk: list[bytes] = []
+        size: int = 0
+
+        for data in records:
+            if _OVERHEAD + len(data) > MAX_DATAGRAM_SIZE:
+                unsent.append(data)
+
+                continue
+
+            if _OVERHEAD + size + len(data) > MAX_DATAGRAM_SIZE:
+                self._send_chunk(chunk)
+                chunk, size = [], 0
+
+            chunk.append(data)
+            size += len(data)
+
+        if chunk:
+            self._send_chunk(chunk)
+
+        return unsent
+
+    def _send_chunk(self, chunk: list[bytes]) -> None:
+        data: bytes = BatchPacket.frame_records(chunk)
+        datagram = DatagramPacket.from_packet(self.token, self._sent, data)
+
+        try:
+            self._sendto(datagram.to_bytes(), self.address)
+        except OSError as e:
+            # datagrams can get lost anyway, a full socket buffer only loses a few more.
+            logger.debug('datagram to %s dropped: %s.', '{}:{}'.format(*self.address), e)
@@ -25,6 +25,7 @@ from pygame import Rect
 
 from ..game.sprites.player import PLAYER_SIZE, PlayerAttributes
 from .packet import Packet, PacketType
+from .state import WorldState
 
 type PacketFilter = Callable[[UUID, Packet, Optional[dict[UUID, PlayerAttributes]]], bool]
 
@@ -74,7 +75,11 @@ def position_filter(left: int, top: int, w: int, h: int) -> PacketFilter:
 
 
 def player_collision_filter() -> PacketFilter:
-    """Returns a packet filter that allows blocks position packets that would leed to overlapped players."""
+    """Returns a packet filter that blocks position packets that would lead to overlapped
+    players.
+
+    When the state is a `WorldState`, only the players close to the new position are checked.
+    """
 
     def packet_filter(identity: UUID, pkt: Packet, state: Optional[dict[UUID, PlayerAttributes]] = None) -> bool:
         if pkt.type != PacketType.POSITION:
@@ -87,6 +92,13 @@ def player_collision_filter() -> PacketFilter:
             return False
         this_player_new_rect = Rect(pkt.x, pkt.y, *this_player_attributes['size'])
 
+        if isinstance(state, WorldState):
+            for other_player_identity in state.colliding(this_player_new_rect):
+                if identity != other_player_identity:
+                    return False
+
+            return True
+
         for other_player_identity, other_player_attributes in state.items():
             if identity == other_player_identity:
                 continue
@@ -16,15 +16,44 @@
 #     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
-from enum import auto, IntEnum
-from socket import error as socket_error, socket
+from asyncio import get_running_loop, IncompleteReadError, StreamReader, wait_for
+from collections.abc import Buffer, Callable, Iterable, Iterator, Sequence
+from dataclasses import dataclass
+from enum import auto, IntEnum, IntFlag
+from socket import error as socket_error
 import struct
-from typing import Self
+from typing import Any, ClassVar, Optional, Self
 from uuid import UUID
+import zlib
 
 from ..game.sprites.player import PlayerAttributes
 
 
+_HEADER: struct.Struct = struct.Struct('>HI')
+_BATCH_HEADER: struct.Struct = struct.Struct('>HIH')
+_RECORD_HEADER: struct.Struct = struct.Struct('>HBH')
+_SNAPSHOT_HEADER: struct.Struct = struct.Struct('>IIH')
+_SNAPSHOT_ENTITY: struct.Struct = struct.Struct('>HB')
+_WORLD_HEADER: struct.Struct = struct.Struct('>BH')
+_WORLD_PLAYER: struct.Struct = struct.Struct('>H16s')
+_DATAGRAM_HEADER: struct.Struct = struct.Struct('>QI')
+
+PROTOCOL_VERSION: int = 1
+"""The version of the protocol spoken by this implementation, sent in the handshake."""
+
+MAX_PACKET_SIZE: int = 1 << 20
+"""The size of the largest packet read from a stream, header included."""
+
+WORLD_SESSION: int = 0xFFFF
+"""The session id of the batch records that are not about a player."""
+
+NO_BASELINE: int = 0xFFFFFFFF
+"""The baseline of a full snapshot."""
+
+type Snapshot = dict[int, tuple[int, ...]]
+"""The encoded fields of every player in a room, by session id."""
+
+
 class PacketType(IntEnum):
     """Enum containing all possible packet types."""
 
@@ -32,12 +61,197 @@ class PacketType(IntEnum):
     JOIN = auto()
     LEAVE = auto()
     POSITION = auto()
+    REJECT = auto()
+    ROOM = auto()
+    BATCH = auto()
+    SESSION = auto()
+    SNAPSHOT = auto()
+    ACK = auto()
+    WORLD = auto()
+    CHANNEL = auto()
+    DATAGRAM = auto()
+    HELLO = auto()
+    WELCOME = auto()
+    MOVE = auto()
+    MOVE_ACK = auto()
+
+
+class Capability(IntFlag):
+    """The optional parts of the protocol, negotiated in the handshake.
+
+    Clients that do not shake hands get none of them, and the legacy encoding: whole
+    packets about players embedded with their identity, with float coordinates. The
+    other capabilities are carried in batch records, so they come with the compact
+    encoding only.
+    """
+
+    WORLD_PAGES = auto()
+    """Joining players get the state of the room as world packets."""
+
+    COMPRESSED_WORLD = auto()
+    """World packets can be compressed."""
+
+    DELTA_SNAPSHOTS = auto()
+    """Position updates are replaced by delta snapshots."""
+
+    DATAGRAMS = auto()
+    """Latest-wins packets go over a datagram channel."""
+
+    PREDICTION = auto()
+    """Position updates are sequence numbered and acknowledged with the authoritative position."""
+
+    COMPACT_ENCODING = auto()
+    """Packets about players are batch records referring to them by session id, and
+    coordinates are encoded with `POSITION_ENCODING`.
+    """
+
+
+ALL_CAPABILITIES: Capability = ~Capability(0)
+"""Every capability supported by this implementation."""
+
+
+_PACKET_TYPES: dict[int, PacketType] = {
+    packet_type.value: packet_type for packet_type in PacketType
+}
+
+
+def _packet_type(value: int) -> PacketType:
+    if (packet_type := _PACKET_TYPES.get(value)) is None:
+        raise ValueError(f'unknown packet type ({value})')
+
+    return packet_type
+
+
+@dataclass(frozen=True)
+class PacketCodec:
+    """Precompiled layout of the data of a fixed-size packet type."""
+
+    data: struct.Struct
+    frame: struct.Struct
+
+    @classmethod
+    def from_format(cls, format: str) -> Self:
+        """Compiles the layout of a packet's data.
+
+        Args:
+            format:
+                the big-endian struct format of the packet's data, without byte order character.
+        """
+
+        return cls(struct.Struct(f'>{format}'), struct.Struct(f'>HI{format}'))
+
+    def encode(self, packet_type: PacketType, *values) -> bytes:
+        """Serializes a whole packet, header included, in a single call."""
+
+        return self.frame.pack(packet_type, self.data.size, *values)
+
+    def decode(self, data: Buffer) -> tuple:
+        """Deserializes the data of a packet in a single call."""
+
+        return self.data.unpack_from(data)
+
+    @property
+    def size(self) -> int:
+        """The length of the packet's data."""
+
+        return self.data.size
+
+
+@dataclass(frozen=True)
+class FixedPoint:
+    """Unsigned 16-bit fixed-point encoding of a coordinate.
+
+    A coordinate is stored as a multiple of `1 / 2 ** fraction_bits` pixels. The more
+    fraction bits, the finer the precision and the smaller the largest coordinate that
+    can be encoded: with 6 fraction bits, the default, coordinates go from 0 to 1023.98
+    with a precision of 1/64 of a pixel.
+    """
+
+    fraction_bits: int = 6
+
+    def encode(self, value: float) -> int:
+        """Encodes a coordinate, clamping it to the encodable range."""
+
+        return min(max(round(value * self.scale), 0), 0xFFFF)
+
+    def decode(self, value: int) -> float:
+        """Decodes a coordinate."""
+
+        return value / self.scale
+
+    @property
+    def scale(self) -> int:
+        """The number of steps in a pixel."""
+
+        return 1 << self.fraction_bits
+
+    @property
+    def max_value(self) -> float:
+        """The largest coordinate that can be encoded."""
+
+        return 0xFFFF / self.scale
+
+
+POSITION_ENCODING: FixedPoint = FixedPoint()
+"""The encoding of every coordinate sent on the wire."""
+
+
+_PACKET_CLASSES: dict[PacketType, type['Packet']] = {}
+_LEGACY_PACKET_CLASSES: dict[PacketType, type['Packet']] = {}
+
+
+def register_packet(
+        packet_type: PacketType,
+        format: Optional[str] = None,
+        legacy: bool = False,
+) -> Callable[[type['Packet']], type['Packet']]:
+    """Returns a class decorator that registers a packet class for a packet type.
+
+    `Packet.parse()` turns every packet of that type into the registered class.
+
+    Args:
+        packet_type:
+            the packet type.
+        format:
+            the struct format of the packet's data, if the packet has a fixed size.
+        legacy:
+            whether the class is the legacy encoding of the packet type, used by
+            `Packet.parse(legacy=True)` instead of the class registered without it.
+    """
+
+    classes: dict[PacketType, type[Packet]] = _LEGACY_PACKET_CLASSES if legacy else _PACKET_CLASSES
+
+    def decorator(cls: type[Packet]) -> type[Packet]:
+        if packet_type in classes:
+            raise ValueError(f'packet type {packet_type.name} already registered')
+
+        cls._packet_type = packet_type
+        cls._codec = PacketCodec.from_format(format) if format is not None else None
+
+        classes[packet_type] = cls
+
+        return cls
+
+    return decorator
 
 
 class Packet:
-    """A generic packet."""
+    """A generic packet.
+
+    The data of a packet can be any bytes-like object, including a memoryview into a
+    receive buffer, so that received packets are never copied. Such a packet is only valid
+    until the buffer gets reused, see `detach()`.
+
+    Every packet class shares the same slots, so that `parse()` can turn a generic packet
+    into a specific one in place. The fields of a specific packet are decoded on access.
+    """
 
-    def __init__(self, type: PacketType, length: int, data: bytes):
+    __slots__ = ('_type', '_length', '_data', '_bytes', '_fields')
+
+    _packet_type: ClassVar[Optional[PacketType]] = None
+    _codec: ClassVar[Optional[PacketCodec]] = None
+
+    def __init__(self, type: PacketType, length: int, data: Buffer):
         """Args:
             type:
                 the packet type
@@ -52,70 +266,167 @@ class Packet:
                 f'packet length mismatch ({length} != {actual_length})'
             )
 
+        self._validate(data)
+
         self._type: PacketType = type
         self._length: int = length
-        self._data: bytes = data
+        self._data: Buffer = data
+
+        self._bytes: Optional[bytes] = None
+        self._fields: Any = None
 
     @classmethod
-    def from_socket(cls, stream: socket):
-        """Builds a packet by reading a socket."""
+    async def from_stream(
+            cls,
+            stream: StreamReader,
+            timeout: Optional[float] = None,
+            max_packet_size: int = MAX_PACKET_SIZE,
+    ):
+        """Builds a packet by reading an asyncio stream.
+
+        Args:
+            stream:
+                the stream to read.
+            timeout:
+                how many seconds to wait for the whole packet, forever by default.
+                Nothing is consumed from the stream when it expires before the packet
+                starts arriving.
+            max_packet_size:
+                the size of the largest packet accepted, header included.
+
+        Raises:
+            TimeoutError:
+                the packet did not start arriving in time.
+            socket.error:
+                the stream has been closed, the packet is larger than the maximum
+                packet size, or it started arriving but did not finish in time.
+        """
 
-        blob: bytes = stream.recv(2)
-        if not blob:
-            raise socket_error
+        loop = get_running_loop()
+        deadline: Optional[float] = None if timeout is None else loop.time() + timeout
 
-        packet_type = PacketType.from_bytes(blob, byteorder='big')
+        try:
+            header: bytes = await wait_for(stream.readexactly(_HEADER.size), timeout)
+        except IncompleteReadError as e:
+            raise socket_error from e
 
-        blob: bytes = stream.recv(4)
-        if not blob:
-            raise socket_error
+        packet_type, packet_length = _HEADER.unpack(header)
 
-        packet_length: int = struct.unpack('>I', blob)[0]
+        # the length is checked before reading, so that a peer cannot make us buffer it.
+        if (size := _HEADER.size + packet_length) > max_packet_size:
+            raise socket_error(f'packet too large ({size} bytes)')
 
-        packet_data = stream.recv(packet_length)
-        if not packet_data or len(packet_data) != packet_length:
-            raise socket_error
+        try:
+            packet_data: bytes = await wait_for(
+                stream.readexactly(packet_length),
+                None if deadline is None else deadline - loop.time(),
+            )
+        except IncompleteReadError as e:
+            raise socket_error from e
+        except TimeoutError as e:
+            # the header has been consumed, so the stream cannot be read any further.
+            raise socket_error('packet timed out') from e
 
-        return cls(packet_type, packet_length, packet_data)
+        return cls(_packet_type(packet_type), packet_length, packet_data)
 
     @classmethod
-    def from_bytes(cls, bytes: bytes):
-        """Builds a packet by reading a bytearray."""
+    def from_bytes(cls, bytes: Buffer):
+        """Builds a packet by reading a bytes-like object, without copying its data."""
 
-        if len(bytes) < 6:
+        if len(bytes) < _HEADER.size:
             raise ValueError('packet too short')
 
-        packet_type = PacketType.from_bytes(bytes[:2], byteorder='big')
-        packet_length: int = struct.unpack('>I', bytes[2:6])[0]
-        packet_data = bytes[6:]
+        packet_type, packet_length = _HEADER.unpack_from(bytes)
+        packet_data = memoryview(bytes)[_HEADER.size:]
+
+        return cls(_packet_type(packet_type), packet_length, packet_data)
 
-        return cls(packet_type, packet_length, packet_data)
+    @classmethod
+    def _from_values(cls, *values) -> Self:
+        """Builds a fixed-size packet of the class's type from the values of its data."""
+
+        codec: PacketCodec = cls._codec
+        frame: bytes = codec.encode(cls._packet_type, *values)
+
+        # the data comes from the codec itself, so it does not need to be validated.
+        packet: Self = cls.__new__(cls)
+        packet._type = cls._packet_type
+        packet._length = codec.size
+        packet._data = memoryview(frame)[_HEADER.size:]
+        packet._bytes = frame
+        packet._fields = None
+
+        return packet
 
     def to_bytes(self) -> bytes:
-        """Serializes a packet to bytes."""
+        """Serializes a packet to bytes.
 
-        return (
-            self.type.to_bytes(2, byteorder='big') +
-            self.length.to_bytes(4, byteorder='big') +
-            self.data
-        )
+        Packets are immutable, so the serialized packet is cached and shared by every caller.
+        """
+
+        if self._bytes is None:
+            self._bytes = _HEADER.pack(self._type, self._length) + self._data
+
+        return self._bytes
+
+    def detach(self) -> Self:
+        """Makes the packet own its data, so that it outlives the buffer it was read from."""
+
+        if isinstance(self._data, memoryview) and not isinstance(self._data.obj, bytes):
+            self._data = bytes(self._data)
+
+        return self
+
+    def parse(self, legacy: bool = False) -> Self:
+        """Parse a generic packet into the class registered for its type.
+
+        The packet is turned into the specific type in place, and returned. Parsing a
+        packet that has already been parsed does nothing.
+
+        Args:
+            legacy:
+                whether the packet comes from a peer that uses the legacy encoding.
+
+        Raises:
+            ValueError:
+                the packet data does not fit the packet type.
+        """
+
+        con: type[Packet] = _PACKET_CLASSES.get(self._type, Packet)
+
+        if legacy:
+            con = _LEGACY_PACKET_CLASSES.get(self._type, con)
+
+        if not isinstance(self, con):
+            con._validate(self._data)
+            self.__class__ = con
+
+        return self
+
+    def for_encoding(self, legacy: bool) -> Optional['Packet']:
+        """Returns the packet in the legacy or in the current encoding.
+
+        Packets whose encoding never changed are returned as they are.
+
+        Args:
+            legacy:
+                whether to return the packet in the legacy encoding.
+        """
 
-    def parse(self) -> Self:
-        """Parse a generic packet into a specific type."""
+        return self
 
-        match self.type:
-            case PacketType.EMBEDDED:
-                con = EmbeddedPacket
-            case PacketType.JOIN:
-                con = JoinPacket
-            case PacketType.LEAVE:
-                con = LeavePacket
-            case PacketType.POSITION:
-                con = PositionPacket
-            case _:
-                con = Packet
+    @classmethod
+    def _validate(cls, data: Buffer) -> None:
+        """Checks that the packet data can be decoded, raising a ValueError if it cannot."""
+
+        if cls._codec is not None and len(data) != cls._codec.size:
+            raise ValueError(f'{cls._packet_type.name.lower()} packet size mismatch')
 
-        return con(self.type, self.length, self.data)
+    def _decode(self) -> tuple:
+        if self._fields is None:
+            self._fields = self._codec.decode(self._data)
+
+        return self._fields
 
     @property
     def type(self) -> PacketType:
@@ -130,27 +441,24 @@ class Packet:
         return self._length
 
     @property
-    def data(self) -> bytes:
+    def data(self) -> Buffer:
         """Tha packet's data."""
 
         return self._data
 
     def __repr__(self):
-        return f'Packet(type={self.type.name}, length={self.length}, data={self.data})'
+        return f'Packet(type={self.type.name}, length={self.length}, data={bytes(self.data)})'
 
 
+@register_packet(PacketType.EMBEDDED)
 class EmbeddedPacket(Packet):
-    """A packet that contains another packet with an assigned identity."""
+    """A packet that contains another packet with an assigned identity.
 
-    def __init__(self, *args, **kwargs):
-        """"""
+    Only sent to clients that did not negotiate `Capability.COMPACT_ENCODING`, with the
+    embedded packet in the legacy encoding. The other clients get batch records instead.
+    """
 
-        super().__init__(*args, **kwargs)
-
-        self._id, self._embedded_packet = (
-            UUID(int=int.from_bytes(self.data[:16], byteorder='big')),
-            Packet.from_bytes(self.data[16:]),
-        )
+    __slots__ = ()
 
     @classmethod
     def from_packet(cls, identity: UUID, packet: Packet):
@@ -163,95 +471,786 @@ class EmbeddedPacket(Packet):
                 the packet to create the embedded packet from.
         """
 
-        packet_data: bytes = (
-                int(identity).to_bytes(16, byteorder='big') +
-                packet.to_bytes()
-        )
+        packet_data: bytes = identity.bytes + packet.to_bytes()
 
-        return cls(PacketType.EMBEDDED, len(packet_data), packet_data)
+        embedded_packet = cls(PacketType.EMBEDDED, len(packet_data), packet_data)
+        embedded_packet._fields = packet
+
+        return embedded_packet
+
+    @classmethod
+    def _validate(cls, data: Buffer) -> None:
+        if len(data) < 16:
+            raise ValueError('embedded packet too short')
 
     @property
     def identity(self) -> UUID:
         """The packet's identity."""
 
-        return self._id
+        return UUID(bytes=bytes(self._data[:16]))
 
     @property
     def embed(self) -> Packet:
         """The embedded packet."""
 
-        return self._embedded_packet
+        if self._fields is None:
+            self._fields = Packet.from_bytes(memoryview(self._data)[16:])
+
+        return self._fields
+
+    def detach(self) -> Self:
+        """"""
+
+        if self._fields is not None:
+            self._fields.detach()
+
+        return super().detach()
 
 
+@register_packet(PacketType.JOIN, '3B2H2B')
 class JoinPacket(Packet):
     """A packet that signals a player joining the server."""
 
-    def __init__(self, *args, **kwargs):
-        """"""
+    __slots__ = ()
+
+    @classmethod
+    def from_attributes(cls, attributes: PlayerAttributes):
+        """Creates a new join packet from a player's attributes."""
 
-        super().__init__(*args, **kwargs)
+        x, y = attributes['position']
+
+        return cls._from_values(
+            *attributes['color'],
+            POSITION_ENCODING.encode(x),
+            POSITION_ENCODING.encode(y),
+            *attributes['size'],
+        )
+
+    @property
+    def attributes(self) -> PlayerAttributes:
+        """The new player's attributes."""
 
-        r, g, b, x, y, width, height = struct.unpack('>3B2f2B', self.data[:13])
+        r, g, b, x, y, width, height = self._decode()
 
-        self._attributes: PlayerAttributes = {
+        return {
             'color': (r, g, b),
-            'position': (x, y),
+            'position': (POSITION_ENCODING.decode(x), POSITION_ENCODING.decode(y)),
             'size': (width, height),
         }
 
+    def for_encoding(self, legacy: bool) -> 'JoinPacket':
+        """"""
+
+        if isinstance(self, LegacyJoinPacket) == legacy:
+            return self
+
+        return (LegacyJoinPacket if legacy else JoinPacket).from_attributes(self.attributes)
+
+
+@register_packet(PacketType.JOIN, '3B2f2B', legacy=True)
+class LegacyJoinPacket(JoinPacket):
+    """A join packet with the float coordinates of the legacy encoding."""
+
+    __slots__ = ()
+
     @classmethod
     def from_attributes(cls, attributes: PlayerAttributes):
-        """Creates a new join packet from a player's attributes."""
+        """"""
 
-        packet_data: bytes = (
-            struct.pack('>3B', *attributes['color']) +
-            struct.pack('>2f', *attributes['position']) +
-            struct.pack('>2B', *attributes['size'])
+        return cls._from_values(
+            *attributes['color'], *attributes['position'], *attributes['size']
         )
 
-        return cls(PacketType.JOIN, len(packet_data), packet_data)
-
     @property
     def attributes(self) -> PlayerAttributes:
-        """The new player's attributes."""
+        """"""
+
+        r, g, b, x, y, width, height = self._decode()
 
-        return self._attributes
+        return {'color': (r, g, b), 'position': (x, y), 'size': (width, height)}
 
 
+@register_packet(PacketType.LEAVE, '')
 class LeavePacket(Packet):
     """A packet that signals a player leaving the server."""
 
+    __slots__ = ()
+
     @classmethod
     def new(cls):
         """Creates a new leave packet."""
 
-        return cls(PacketType.LEAVE, 0, b'')
+        return cls._from_values()
 
 
+@register_packet(PacketType.POSITION, '2H')
 class PositionPacket(Packet):
-    """A packet that contains a player's position."""
+    """A packet that contains a player's position, encoded with `POSITION_ENCODING`."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_coordinates(cls, x: float, y: float):
+        """Creates a new position packet given a pair of coordinates.
+
+        Coordinates are rounded to the precision of the encoding.
+        """
+
+        return cls._from_values(POSITION_ENCODING.encode(x), POSITION_ENCODING.encode(y))
+
+    @property
+    def x(self) -> float:
+        """The x coordinate contained inside the packet."""
+
+        return POSITION_ENCODING.decode(self._decode()[0])
 
-    def __init__(self, *args, **kwargs):
+    @property
+    def y(self) -> float:
+        """The y coordinate contained inside the packet."""
+
+        return POSITION_ENCODING.decode(self._decode()[1])
+
+    def for_encoding(self, legacy: bool) -> 'PositionPacket':
         """"""
 
-        super().__init__(*args, **kwargs)
+        if isinstance(self, LegacyPositionPacket) == legacy:
+            return self
+
+        return (LegacyPositionPacket if legacy else PositionPacket).from_coordinates(
+            self.x, self.y
+        )
 
-        self._x, self._y = struct.unpack('>2f', self.data)
+
+@register_packet(PacketType.POSITION, '2f', legacy=True)
+class LegacyPositionPacket(PositionPacket):
+    """A position packet with the float coordinates of the legacy encoding."""
+
+    __slots__ = ()
 
     @classmethod
     def from_coordinates(cls, x: float, y: float):
-        """Creates a new position packet given a pair of coordinates."""
+        """"""
 
-        return cls(PacketType.POSITION, 8, struct.pack('>2f', x, y))
+        return cls._from_values(x, y)
 
     @property
     def x(self) -> float:
-        """The x coordinate contained inside the packet."""
+        """"""
 
-        return self._x
+        return self._decode()[0]
 
     @property
     def y(self) -> float:
-        """The y coordinate contained inside the packet."""
+        """"""
+
+        return self._decode()[1]
+
+
+@register_packet(PacketType.REJECT)
+class RejectPacket(Packet):
+    """A packet that signals that the server refused a connection."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_reason(cls, reason: str):
+        """Creates a new reject packet given the reason of the rejection."""
+
+        packet_data: bytes = reason.encode()
+
+        return cls(PacketType.REJECT, len(packet_data), packet_data)
+
+    @property
+    def reason(self) -> str:
+        """The reason of the rejection."""
+
+        return str(self._data, errors='replace')
+
+
+@register_packet(PacketType.ROOM, 'I')
+class RoomPacket(Packet):
+    """A packet sent by a client right after connecting, to pick the room to join."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_room(cls, room: int):
+        """Creates a new room packet given the room identifier."""
+
+        return cls._from_values(room)
+
+    @property
+    def room(self) -> int:
+        """The identifier of the room to join."""
+
+        return self._decode()[0]
+
+
+@register_packet(PacketType.BATCH)
+class BatchPacket(Packet):
+    """A packet that carries many packets, each one about a player.
+
+    Its data is the number of records followed by the records, packed back to back.
+    A record is the session id of the player, the type and length of the packet as a
+    single byte and a short, and the data of the packet. Session ids are bound to the
+    identity of a player by a session packet, see `SessionPacket`.
+    """
+
+    __slots__ = ()
+
+    MAX_RECORDS: ClassVar[int] = 0xFFFF
+
+    @staticmethod
+    def record(session: int, packet: Packet) -> bytes:
+        """Serializes a packet about a player as a batch record.
+
+        Args:
+            session:
+                the session id of the player.
+            packet:
+                the packet.
+        """
+
+        return _RECORD_HEADER.pack(session, packet.type, packet.length) + packet.data
+
+    @classmethod
+    def frame_records(cls, records: Sequence[bytes]) -> bytes:
+        """Serializes records into as few batch packets as possible, ready to be sent.
+
+        Args:
+            records:
+                the serialized records.
+        """
+
+        frames: list[bytes] = []
+
+        for start in range(0, len(records), cls.MAX_RECORDS):
+            chunk: Sequence[bytes] = records[start:start + cls.MAX_RECORDS]
+            data: bytes = b''.join(chunk)
+
+            frames.append(_BATCH_HEADER.pack(PacketType.BATCH, 2 + len(data), len(chunk)))
+            frames.append(data)
+
+        return b''.join(frames)
+
+    @classmethod
+    def _validate(cls, data: Buffer) -> None:
+        if len(data) < 2:
+            raise ValueError('batch packet too short')
+
+    def records(self) -> Iterator[tuple[int, Packet]]:
+        """Yields the records of the batch in order, without copying their data.
+
+        Raises:
+            struct.error, ValueError:
+                the batch is malformed.
+        """
+
+        view = memoryview(self._data)
+        offset: int = 2
+
+        for _ in range(int.from_bytes(view[:2], byteorder='big')):
+            session, packet_type, packet_length = _RECORD_HEADER.unpack_from(view, offset)
+            offset += _RECORD_HEADER.size
+
+            packet_data = view[offset:offset + packet_length]
+            packet = Packet(_packet_type(packet_type), packet_length, packet_data)
+            offset += packet_length
+
+            yield session, packet
+
+
+@register_packet(PacketType.SESSION, '16s')
+class SessionPacket(Packet):
+    """A batch record that binds the session id of the record to the identity of a player.
+
+    The binding holds until the player leaves.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_identity(cls, identity: UUID):
+        """Creates a new session packet given the identity of the player."""
+
+        return cls._from_values(identity.bytes)
+
+    @property
+    def identity(self) -> UUID:
+        """The identity of the player."""
+
+        return UUID(bytes=self._decode()[0])
+
+    def for_encoding(self, legacy: bool) -> Optional['SessionPacket']:
+        """"""
+
+        # legacy packets carry the identity of the player themselves.
+        return None if legacy else self
+
+
+@register_packet(PacketType.SNAPSHOT)
+class SnapshotPacket(Packet):
+    """A batch record with the state of the players of a room, sent with the `WORLD_SESSION`.
+
+    A snapshot is a delta against an older snapshot, its baseline, which the client
+    acknowledged with an ack packet. Only the players whose fields changed since the
+    baseline are included, each one as its session id, a bitmask of the fields that
+    changed and the values of those fields. A full snapshot has no baseline and
+    includes every player.
+
+    The fields of a player are its coordinates, encoded with `POSITION_ENCODING`.
+    """
+
+    __slots__ = ()
+
+    FIELDS: ClassVar[int] = 2
+
+    @classmethod
+    def from_delta(
+            cls,
+            sequence: int,
+            snapshot: Snapshot,
+            baseline_sequence: Optional[int] = None,
+            baseline: Optional[Snapshot] = None,
+    ):
+        """Creates a new snapshot packet with the changes from a baseline to a snapshot.
+
+        Args:
+            sequence:
+                the sequence number of the snapshot.
+            snapshot:
+                the snapshot.
+            baseline_sequence:
+                the sequence number of the baseline, none for a full snapshot.
+            baseline:
+                the baseline, none for a full snapshot.
+        """
+
+        if baseline_sequence is None:
+            baseline_sequence, baseline = NO_BASELINE, {}
+
+        entities: list[bytes] = []
+
+        for session, fields in snapshot.items():
+            if (base := baseline.get(session)) == fields:
+                continue
+
+            mask: int = 0
+            changed: list[int] = []
+
+            for i, value in enumerate(fields):
+                if base is None or value != base[i]:
+                    mask |= 1 << i
+                    changed.append(value)
+
+            entities.append(_SNAPSHOT_ENTITY.pack(session, mask))
+            entities.append(struct.pack(f'>{len(changed)}H', *changed))
+
+        header: bytes = _SNAPSHOT_HEADER.pack(sequence, baseline_sequence, len(entities) // 2)
+        packet_data: bytes = header + b''.join(entities)
+
+        return cls(PacketType.SNAPSHOT, len(packet_data), packet_data)
+
+    @classmethod
+    def _validate(cls, data: Buffer) -> None:
+        if len(data) < _SNAPSHOT_HEADER.size:
+            raise ValueError('snapshot packet too short')
+
+    def apply(self, baseline: Optional[Snapshot] = None) -> Snapshot:
+        """Rebuilds the snapshot from its baseline.
+
+        Args:
+            baseline:
+                the baseline of the snapshot, ignored for a full snapshot.
+
+        Raises:
+            struct.error, ValueError:
+                the snapshot is malformed.
+        """
+
+        _, baseline_sequence, count = _SNAPSHOT_HEADER.unpack_from(self._data)
+        snapshot: Snapshot = {}
+
+        if baseline_sequence != NO_BASELINE and baseline:
+            snapshot = dict(baseline)
+
+        offset: int = _SNAPSHOT_HEADER.size
+
+        for _ in range(count):
+            session, mask = _SNAPSHOT_ENTITY.unpack_from(self._data, offset)
+            offset += _SNAPSHOT_ENTITY.size
+
+            if (fields := snapshot.get(session)) is None:
+                if mask != (1 << self.FIELDS) - 1:
+                    raise ValueError(f'snapshot of unknown session {session} is not full')
+
+                fields = (0,) * self.FIELDS
+
+            values: list[int] = list(fields)
+
+            for i in range(self.FIELDS):
+                if mask & (1 << i):
+                    values[i], = struct.unpack_from('>H', self._data, offset)
+                    offset += 2
+
+            snapshot[session] = tuple(values)
+
+        return snapshot
+
+    @property
+    def sequence(self) -> int:
+        """The sequence number of the snapshot."""
+
+        return _SNAPSHOT_HEADER.unpack_from(self._data)[0]
+
+    @property
+    def baseline(self) -> Optional[int]:
+        """The sequence number of the baseline of the snapshot, none for a full snapshot."""
+
+        if (baseline := _SNAPSHOT_HEADER.unpack_from(self._data)[1]) == NO_BASELINE:
+            return None
+
+        return baseline
+
+
+@register_packet(PacketType.ACK, 'I')
+class AckPacket(Packet):
+    """A packet sent by a client to acknowledge the latest snapshot it received."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_sequence(cls, sequence: int):
+        """Creates a new ack packet given the sequence number of the snapshot."""
+
+        return cls._from_values(sequence)
+
+    @property
+    def sequence(self) -> int:
+        """The sequence number of the acknowledged snapshot."""
+
+        return self._decode()[0]
+
+
+@register_packet(PacketType.WORLD)
+class WorldPacket(Packet):
+    """A batch record with a page of the players of a room, sent with the `WORLD_SESSION`
+    to a joining player in place of a session and a join record per player.
+
+    Its data is a flags byte, the number of players in the page and the players, each one
+    as its session id, its identity and the data of its join packet. With the `COMPRESSED`
+    flag, the players are compressed with zlib.
+    """
+
+    __slots__ = ()
+
+    COMPRESSED: ClassVar[int] = 1
+    PAGE_SIZE: ClassVar[int] = 1024
+
+    @classmethod
+    def pages(
+            cls,
+            players: Iterable[tuple[int, UUID, PlayerAttributes]],
+            compress: bool = False,
+    ) -> Iterator[Self]:
+        """Creates the world packets that announce the players of a room, `PAGE_SIZE` players each.
+
+        Args:
+            players:
+                the session id, identity and attributes of each player.
+            compress:
+                whether to compress the players.
+        """
+
+        page: list[bytes] = []
+
+        for session, identity, attributes in players:
+            page.append(_WORLD_PLAYER.pack(session, identity.bytes))
+            page.append(JoinPacket.from_attributes(attributes).data)
+
+            if len(page) == 2 * cls.PAGE_SIZE:
+                yield cls._from_page(page, compress)
+                page.clear()
+
+        if page:
+            yield cls._from_page(page, compress)
+
+    @classmethod
+    def _from_page(cls, page: list[bytes], compress: bool) -> Self:
+        body: bytes = b''.join(page)
+
+        if compress:
+            body = zlib.compress(body)
+
+        header: bytes = _WORLD_HEADER.pack(cls.COMPRESSED if compress else 0, len(page) // 2)
+        packet_data: bytes = header + body
+
+        return cls(PacketType.WORLD, len(packet_data), packet_data)
+
+    @classmethod
+    def _validate(cls, data: Buffer) -> None:
+        if len(data) < _WORLD_HEADER.size:
+            raise ValueError('world packet too short')
+
+    def players(self) -> Iterator[tuple[int, UUID, JoinPacket]]:
+        """Yields the session id, identity and join packet of each player in the page.
+
+        Raises:
+            struct.error, ValueError:
+                the page is malformed.
+        """
+
+        flags, count = _WORLD_HEADER.unpack_from(self._data)
+        player_size: int = _WORLD_PLAYER.size + JoinPacket._codec.size
+        body = memoryview(self._data)[_WORLD_HEADER.size:]
+
+        if flags & self.COMPRESSED:
+            # the size of the page is known, so a malicious page cannot inflate any further.
+            decompressor = zlib.decompressobj()
+
+            try:
+                body = memoryview(decompressor.decompress(body, count * player_size + 1))
+            except zlib.error as e:
+                raise ValueError('world packet corrupted') from e
+
+        if len(body) != count * player_size:
+            raise ValueError('world packet size mismatch')
+
+        for offset in range(0, len(body), player_size):
+            session, identity = _WORLD_PLAYER.unpack_from(body, offset)
+            join_data = body[offset + _WORLD_PLAYER.size:offset + player_size]
+
+            join_packet = JoinPacket(PacketType.JOIN, len(join_data), join_data)
+
+            yield session, UUID(bytes=identity), join_packet
+
+
+@register_packet(PacketType.CHANNEL, 'Q')
+class ChannelPacket(Packet):
+    """A batch record sent with the `WORLD_SESSION` to offer a client a datagram channel.
+
+    The channel is reached over UDP at the same address as the server, and the client
+    tells its datagrams apart with the token of the channel.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_token(cls, token: int):
+        """Creates a new channel packet given the token of the channel."""
+
+        return cls._from_values(token)
+
+    @property
+    def token(self) -> int:
+        """The token of the channel."""
+
+        return self._decode()[0]
+
+
+@register_packet(PacketType.DATAGRAM)
+class DatagramPacket(Packet):
+    """A packet sent over a datagram channel, carrying another packet.
+
+    Its data is the token of the channel, a sequence number used to drop the datagrams
+    that arrive after a newer one, and the carried packet, if any. A datagram without
+    a packet only lets the server learn the address of the client.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_packet(cls, token: int, sequence: int, packet: Optional[Packet | bytes] = None):
+        """Creates a new datagram packet.
+
+        Args:
+            token:
+                the token of the channel.
+            sequence:
+                the sequence number of the datagram.
+            packet:
+                the packet to carry, or its serialized frames.
+        """
+
+        if isinstance(packet, Packet):
+            packet = packet.to_bytes()
+
+        packet_data: bytes = _DATAGRAM_HEADER.pack(token, sequence) + (packet or b'')
+
+        return cls(PacketType.DATAGRAM, len(packet_data), packet_data)
+
+    @classmethod
+    def _validate(cls, data: Buffer) -> None:
+        if len(data) < _DATAGRAM_HEADER.size:
+            raise ValueError('datagram packet too short')
+
+    @property
+    def token(self) -> int:
+        """The token of the channel."""
+
+        return _DATAGRAM_HEADER.unpack_from(self._data)[0]
+
+    @property
+    def sequence(self) -> int:
+        """The sequence number of the datagram."""
+
+        return _DATAGRAM_HEADER.unpack_from(self._data)[1]
+
+    @property
+    def embed(self) -> Optional[Packet]:
+        """The carried packet, if any."""
+
+        if len(self._data) == _DATAGRAM_HEADER.size:
+            return None
+
+        return Packet.from_bytes(memoryview(self._data)[_DATAGRAM_HEADER.size:])
+
+
+@register_packet(PacketType.HELLO, 'IHI')
+class HelloPacket(Packet):
+    """A packet sent by a client right after connecting, in place of a room packet,
+    with the room to join, the protocol version and the capabilities of the client.
+
+    The room comes first, at the same offset as in a room packet.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_capabilities(
+            cls,
+            room: int,
+            capabilities: Capability,
+            version: int = PROTOCOL_VERSION,
+    ):
+        """Creates a new hello packet.
+
+        Args:
+            room:
+                the identifier of the room to join.
+            capabilities:
+                the capabilities supported by the client.
+            version:
+                the protocol version spoken by the client.
+        """
+
+        return cls._from_values(room, version, capabilities)
+
+    @property
+    def room(self) -> int:
+        """The identifier of the room to join."""
+
+        return self._decode()[0]
+
+    @property
+    def version(self) -> int:
+        """The protocol version spoken by the client."""
+
+        return self._decode()[1]
+
+    @property
+    def capabilities(self) -> Capability:
+        """The capabilities supported by the client, unknown ones excluded."""
+
+        return Capability(self._decode()[2]) & ALL_CAPABILITIES
+
+
+@register_packet(PacketType.WELCOME, 'HI')
+class WelcomePacket(Packet):
+    """A batch record sent with the `WORLD_SESSION` in reply to a hello packet, before
+    anything else, with the protocol version and the capabilities chosen by the server.
+
+    Clients that did not negotiate the compact encoding get it as a packet on its own.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_capabilities(cls, capabilities: Capability, version: int = PROTOCOL_VERSION):
+        """Creates a new welcome packet.
+
+        Args:
+            capabilities:
+                the capabilities chosen by the server.
+            version:
+                the protocol version chosen by the server.
+        """
+
+        return cls._from_values(version, capabilities)
+
+    @property
+    def version(self) -> int:
+        """The protocol version chosen by the server."""
+
+        return self._decode()[0]
+
+    @property
+    def capabilities(self) -> Capability:
+        """The capabilities chosen by the server, unknown ones excluded."""
+
+        return Capability(self._decode()[1]) & ALL_CAPABILITIES
+
+
+@register_packet(PacketType.MOVE, 'I2H')
+class MovePacket(Packet):
+    """A position update with a sequence number, sent in place of a position packet by
+    the clients that predict their own movement.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_coordinates(cls, sequence: int, x: float, y: float):
+        """Creates a new move packet given its sequence number and a pair of coordinates.
+
+        Coordinates are rounded to the precision of the encoding.
+        """
+
+        return cls._from_values(sequence, POSITION_ENCODING.encode(x), POSITION_ENCODING.encode(y))
+
+    @property
+    def sequence(self) -> int:
+        """The sequence number of the move."""
+
+        return self._decode()[0]
+
+    def position(self) -> PositionPacket:
+        """Returns the position update carried by the move."""
+
+        return PositionPacket._from_values(*self._decode()[1:])
+
+
+@register_packet(PacketType.MOVE_ACK, 'I2H')
+class MoveAckPacket(Packet):
+    """A batch record sent to a player with its own session, with the sequence number of
+    its latest move the server went through and its authoritative position afterwards,
+    whether the move got accepted or not.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_coordinates(cls, sequence: int, x: float, y: float):
+        """Creates a new move ack packet given the sequence number of the move and the
+        position of the player.
+        """
+
+        return cls._from_values(sequence, POSITION_ENCODING.encode(x), POSITION_ENCODING.encode(y))
+
+    @property
+    def sequence(self) -> int:
+        """The sequence number of the acknowledged move."""
+
+        return self._decode()[0]
+
+    @property
+    def x(self) -> float:
+        """The authoritative x coordinate of the player."""
+
+        return POSITION_ENCODING.decode(self._decode()[1])
+
+    @property
+    def y(self) -> float:
+        """The authoritative y coordinate of the player."""
 
-        return self._y
+        return POSITION_ENCODING.decode(self._decode()[2])
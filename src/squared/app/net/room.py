@@ -0,0 +1,552 @@
+"""Contains the game rooms hosted by the game server."""
+
+# Copyright (C) 2025  Stefano Cuizza
+
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from collections.abc import Hashable
+from dataclasses import dataclass, field
+import logging
+from queue import Empty, SimpleQueue
+from random import randint
+from threading import RLock
+from typing import Optional
+from uuid import UUID
+
+from pygame import Rect
+
+from .connection import Connection
+from .filters import PacketFilter, player_collision_filter, position_filter, whitelist_packets
+from .packet import (
+    NO_BASELINE, POSITION_ENCODING, WORLD_SESSION, BatchPacket, Capability, EmbeddedPacket,
+    JoinPacket, LeavePacket, MoveAckPacket, Packet, PacketType, PositionPacket, SessionPacket,
+    Snapshot, SnapshotPacket, WorldPacket,
+)
+from .state import WorldState
+from ..game.main import BOUNDS
+from ..game.sprites.player import PLAYER_SIZE, PlayerAttributes, PlayerPosition
+
+
+logger = logging.getLogger(__name__)
+
+MAX_SESSIONS: int = WORLD_SESSION
+SNAPSHOT_HISTORY: int = 32
+"""The number of past snapshots kept by a room as baselines for delta snapshots."""
+
+
+class RoomFullError(Exception):
+    """Raised when there is no space left in the world for a new player."""
+
+
+def default_filters() -> list[PacketFilter]:
+    """Returns the packet filters used by a room if none are specified."""
+
+    return [
+        player_collision_filter(),
+        position_filter(0, 0, *BOUNDS),
+        whitelist_packets(PacketType.POSITION),
+    ]
+
+
+@dataclass
+class _Record:
+    """A packet about a player, serialized at most once for each encoding.
+
+    Clients with the compact encoding get it as a batch record, the others as an
+    embedded packet in the legacy encoding.
+    """
+
+    session: int
+    identity: UUID
+    packet: Packet
+    _encoded: dict[bool, Optional[bytes]] = field(default_factory=lambda: {}, init=False)
+
+    def send(
+            self,
+            connection: Connection,
+            key: Optional[Hashable] = None,
+            flush: bool = True,
+    ) -> None:
+        """Enqueues the packet for a client, unless its encoding has no such packet."""
+
+        if (legacy := connection.legacy) not in self._encoded:
+            self._encoded[legacy] = self._encode(legacy)
+
+        if (data := self._encoded[legacy]) is not None:
+            connection.send(data, key, flush)
+
+    def _encode(self, legacy: bool) -> Optional[bytes]:
+        if (packet := self.packet.for_encoding(legacy)) is None:
+            return None
+
+        if legacy:
+            return EmbeddedPacket.from_packet(self.identity, packet).to_bytes()
+
+        return BatchPacket.record(self.session, packet)
+
+
+@dataclass
+class Room:
+    """An independent game world, with its own players, filters and tick loop.
+
+    A room never writes to a socket directly, but enqueues batch records on the
+    outbound queue of each connection, or whole packets for the clients that did not
+    negotiate the compact encoding.
+
+    The state of a room is only ever changed while holding the room lock. Reader threads
+    do not take it: they post the packets they receive to the room inbox, which gets
+    drained by the tick. Only joins and leaves contend with the tick for the lock, and
+    every room has its own lock, so rooms never block each other.
+
+    Players are referred to on the wire by a session id, unique within the room.
+    Clients learn which player a session id belongs to when the player gets announced.
+
+    With delta snapshots, position updates are replaced by a snapshot of the room per
+    tick, sent as the difference from the latest snapshot each client acknowledged.
+    A client gets a full snapshot when it joins, or when its baseline is older than
+    the last `SNAPSHOT_HISTORY` snapshots.
+
+    Clients that predict their own movement send their moves with a sequence number,
+    and get the sequence number of their latest move the room went through, with their
+    authoritative position, once per tick.
+
+    The optional parts of the protocol enabled on a room are only used with the
+    clients that negotiated them, see `Capability`.
+    """
+
+    _connections: dict[UUID, Connection] = field(default_factory=lambda: {}, init=False)
+    _inbox: SimpleQueue[tuple[UUID, Packet]] = field(default_factory=SimpleQueue, init=False)
+    _lock: RLock = field(default_factory=RLock, init=False)
+    _closed: bool = field(default=False, init=False)
+    _next_session: int = field(default=0, init=False)
+    _sessions: dict[UUID, int] = field(default_factory=lambda: {}, init=False)
+    _session_ids: set[int] = field(default_factory=set, init=False)
+    _state: WorldState = field(default_factory=WorldState, init=False)
+    _snapshots: dict[int, Snapshot] = field(default_factory=lambda: {}, init=False)
+    _snapshot_sequence: int = field(default=0, init=False)
+    identifier: int
+    filters: list[PacketFilter] = field(default_factory=default_filters)
+    tick_rate: int = 30
+    evict_after: float = 5.0
+    interest_radius: Optional[int] = None
+    delta_snapshots: bool = False
+    compress_world: bool = False
+
+    def queue_depths(self) -> dict[UUID, int]:
+        """Returns the number of packets waiting to be sent to each client."""
+
+        with self._lock:
+            return {
+                identity: connection.queue.depth
+                for identity, connection in self._connections.items()
+            }
+
+    def forward_packet(self, source: UUID, packet: Packet) -> None:
+        """Sends a packet about a player to every player in the room except that one."""
+
+        with self._lock:
+            record = _Record(self._sessions[source], source, packet)
+
+            for identity, connection in self._connections.items():
+                if identity != source:
+                    record.send(connection)
+
+    def tick(self) -> None:
+        """Applies the packets received since the last tick and broadcasts the position updates.
+
+        Only the latest position of each player is kept. Each client receives
+        all the updates of a tick in a single write.
+        """
+
+        with self._lock:
+            self._tick()
+
+    def _tick(self) -> None:
+        pending: dict[UUID, PositionPacket] = self._drain_inbox()
+
+        connections: list[Connection] = list(self._connections.values())
+        snapshot_connections: list[Connection] = [
+            connection for connection in connections if self._uses_snapshots(connection)
+        ]
+        updates: dict[UUID, _Record] = {} if len(snapshot_connections) == len(connections) else {
+            identity: _Record(self._sessions[identity], identity, packet)
+            for identity, packet in pending.items()
+            if identity in self._state
+        }
+
+        if self.interest_radius is None:
+            for identity, record in updates.items():
+                for connection in connections:
+                    if connection.identity != identity and not self._uses_snapshots(connection):
+                        record.send(connection, key=identity, flush=False)
+        else:
+            self._send_interest_updates(connections, updates)
+
+        if snapshot_connections:
+            self._send_snapshots(snapshot_connections)
+
+        self._acknowledge_moves(connections)
+
+        for connection in connections:
+            if connection.queue.stalled_for() > self.evict_after:
+                logger.warning('evicting (%s): client is not reading.', connection.identity)
+
+                connection.evict()
+            else:
+                connection.flush()
+
+    def _send_interest_updates(
+            self,
+            connections: list[Connection],
+            updates: dict[UUID, _Record],
+    ) -> None:
+        """Sends each client the updates of the players inside its area of interest.
+
+        Players entering the area are announced with a join packet, players leaving it
+        with a leave packet. Every packet is serialized at most once per tick and encoding.
+        """
+
+        joins: dict[UUID, tuple[_Record, _Record]] = {}
+        leaves: dict[UUID, _Record] = {}
+
+        for connection in connections:
+            if (attributes := self._state.get(connection.identity)) is None:
+                continue
+
+            visible: set[UUID] = self._interest_area(connection.identity, attributes)
+
+            for other_identity in visible - connection.visible:
+                if (introduction := joins.get(other_identity)) is None:
+                    introduction = joins[other_identity] = self._introduction(other_identity)
+
+                for record in introduction:
+                    record.send(connection, flush=False)
+
+            for other_identity in connection.visible - visible:
+                if (record := leaves.get(other_identity)) is None:
+                    record = leaves[other_identity] = _Record(
+                        self._sessions[other_identity], other_identity, LeavePacket.new()
+                    )
+
+                record.send(connection, flush=False)
+
+            if not self._uses_snapshots(connection):
+                for other_identity in visible & connection.visible:
+                    if (record := updates.get(other_identity)) is not None:
+                        record.send(connection, key=other_identity, flush=False)
+
+            connection.visible = visible
+
+    def _uses_snapshots(self, connection: Connection) -> bool:
+        return self.delta_snapshots and Capability.DELTA_SNAPSHOTS in connection.capabilities
+
+    def _send_snapshots(self, connections: list[Connection]) -> None:
+        """Takes a snapshot of the room and sends each client its changes from its baseline.
+
+        Clients that share a baseline share the serialized snapshot, unless interest
+        management restricts it to the players each client can see. In that case, every
+        client gets deltas against the snapshots it was sent rather than the snapshots of
+        the whole room, since those are the only baselines it has.
+        """
+
+        self._snapshot_sequence = sequence = (self._snapshot_sequence + 1) % NO_BASELINE
+        snapshot: Snapshot = {
+            self._sessions[identity]: tuple(map(POSITION_ENCODING.encode, attributes['position']))
+            for identity, attributes in self._state.items()
+        }
+
+        self._snapshots[sequence] = snapshot
+        self._snapshots.pop((sequence - SNAPSHOT_HISTORY) % NO_BASELINE, None)
+
+        records: dict[Optional[int], bytes] = {}
+
+        for connection in connections:
+            history: dict[int, Snapshot] = (
+                self._snapshots if self.interest_radius is None else connection.snapshots
+            )
+
+            if (baseline := history.get(connection.acked)) is None:
+                connection.acked = None
+
+            if self.interest_radius is None:
+                if (data := records.get(connection.acked)) is None:
+                    packet = SnapshotPacket.from_delta(
+                        sequence, snapshot, connection.acked, baseline
+                    )
+                    data = records[connection.acked] = BatchPacket.record(WORLD_SESSION, packet)
+            else:
+                sessions: list[int] = [
+                    self._sessions[identity]
+                    for identity in connection.visible | {connection.identity}
+                ]
+                visible: Snapshot = {session: snapshot[session] for session in sessions}
+
+                packet = SnapshotPacket.from_delta(sequence, visible, connection.acked, baseline)
+                data = BatchPacket.record(WORLD_SESSION, packet)
+
+                # the client keeps the players of its baseline that left its area, as deltas
+                # never remove players.
+                connection.snapshots[sequence] = (baseline or {}) | visible
+                connection.snapshots.pop((sequence - SNAPSHOT_HISTORY) % NO_BASELINE, None)
+
+            # snapshots only depend on acknowledged baselines, so only the latest is worth sending.
+            connection.send(data, key=WORLD_SESSION, flush=False)
+
+    def _acknowledge(self, identity: UUID, sequence: int) -> None:
+        """Makes a snapshot the baseline of a client, unless it already has a newer one."""
+
+        connection: Optional[Connection] = self._connections.get(identity)
+
+        if connection is not None and sequence in self._snapshots:
+            if connection.acked is None:
+                connection.acked = sequence
+            elif (sequence - connection.acked) % NO_BASELINE < SNAPSHOT_HISTORY:
+                connection.acked = sequence
+
+    def _acknowledge_moves(self, connections: list[Connection]) -> None:
+        """Sends each client that moved since the last tick its latest move and its position."""
+
+        for connection in connections:
+            if connection.moved is None:
+                continue
+
+            identity: UUID = connection.identity
+            position: PlayerPosition = self._state[identity]['position']
+            ack = MoveAckPacket.from_coordinates(connection.moved, *position)
+            data: bytes = BatchPacket.record(self._sessions[identity], ack)
+
+            # only the latest ack matters, so it can replace an unsent one.
+            connection.send(data, key=PacketType.MOVE_ACK, flush=False)
+            connection.moved = None
+
+    def _introduction(self, identity: UUID) -> tuple[_Record, _Record]:
+        """Returns the records that announce a player: its session binding and its join."""
+
+        session: int = self._sessions[identity]
+
+        return (
+            _Record(session, identity, SessionPacket.from_identity(identity)),
+            _Record(session, identity, JoinPacket.from_attributes(self._state[identity])),
+        )
+
+    def _open_session(self, identity: UUID) -> int:
+        """Assigns a session id to a player.
+
+        Session ids are handed out in a round-robin fashion, so that a freed session id
+        does not get reused while packets about its previous player may still be queued.
+        """
+
+        for _ in range(MAX_SESSIONS):
+            session = self._next_session
+            self._next_session = (session + 1) % MAX_SESSIONS
+
+            if session not in self._session_ids:
+                self._sessions[identity] = session
+                self._session_ids.add(session)
+
+                return session
+
+        raise RoomFullError('room full')
+
+    def _close_session(self, identity: UUID) -> None:
+        self._session_ids.remove(self._sessions.pop(identity))
+
+    def _interest_area(self, identity: UUID, attributes: PlayerAttributes) -> set[UUID]:
+        radius: int = self.interest_radius
+        area = Rect(*attributes['position'], *attributes['size']).inflate(2 * radius, 2 * radius)
+
+        return set(self._state.colliding(area)) - {identity}
+
+    def _init_player_attributes(self, identity: UUID) -> None:
+        if (new_player_position := self._state.free_position(PLAYER_SIZE, BOUNDS)) is None:
+            raise RoomFullError('room full')
+
+        self._state[identity] = PlayerAttributes(**{
+            'color': tuple(randint(64, 255) for _ in range(3)),
+            'position': new_player_position,
+            'size': PLAYER_SIZE,
+        })
+
+    def handle_packet(self, identity: UUID, packet: Packet) -> None:
+        """Posts a packet to the room inbox, to be applied on the next tick.
+
+        Safe to call from any thread. The packet gets detached from its receive buffer.
+        """
+
+        logger.debug('received packet from (%s) %r.', identity, packet)
+
+        self._inbox.put((identity, packet.detach()))
+
+    def _drain_inbox(self) -> dict[UUID, PositionPacket]:
+        """Runs the packets in the inbox through the room filters and applies the accepted ones.
+
+        Every accepted packet other than a position update is forwarded to the other players.
+
+        Returns:
+            the latest accepted position update of each player.
+        """
+
+        positions: dict[UUID, PositionPacket] = {}
+
+        while True:
+            try:
+                identity, packet = self._inbox.get_nowait()
+            except Empty:
+                return positions
+
+            # the player may have left after sending the packet.
+            if identity not in self._state:
+                continue
+
+            # acks are part of the protocol rather than the game, so filters do not apply.
+            if packet.type == PacketType.ACK:
+                self._acknowledge(identity, packet.sequence)
+
+                continue
+
+            # moves get acknowledged whether the filters accept them or not.
+            if packet.type == PacketType.MOVE:
+                if (connection := self._connections.get(identity)) is not None:
+                    connection.moved = packet.sequence
+
+                packet = packet.position()
+
+            if not self._accepts(identity, packet):
+                continue
+
+            match packet.type:
+                case PacketType.POSITION:
+                    logger.debug(
+                        'update player (%s) position (%.2f, %.2f) -> (%.2f, %.2f).',
+                        identity, *self._state[identity]['position'], packet.x, packet.y
+                    )
+
+                    self._state.move(identity, (packet.x, packet.y))
+                    positions[identity] = packet
+                case _:
+                    self.forward_packet(identity, packet)
+
+    def _accepts(self, identity: UUID, packet: Packet) -> bool:
+        for packet_filter in self.filters:
+            if not packet_filter(identity, packet, self._state):
+                logger.debug('packet filtered (%s) %r.', identity, packet)
+
+                return False
+
+        return True
+
+    def join(self, connection: Connection) -> None:
+        """Spawns a new player in the room and sends it the state of the world.
+
+        Raises:
+            RoomFullError:
+                there is no space left in the world for the new player.
+        """
+
+        with self._lock:
+            self._join(connection)
+
+    def _join(self, connection: Connection) -> None:
+        identity: UUID = connection.identity
+
+        logger.debug('player (%s) has joined room %d.', identity, self.identifier)
+
+        session: int = self._open_session(identity)
+
+        try:
+            self._init_player_attributes(identity)
+        except RoomFullError:
+            self._close_session(identity)
+
+            raise
+
+        join_packet = JoinPacket.from_attributes(self._state[identity])
+
+        # the local player is always known to its client by the null identity.
+        local_identity = UUID(int=0)
+
+        for packet in (SessionPacket.from_identity(local_identity), join_packet):
+            _Record(session, local_identity, packet).send(connection, flush=False)
+
+        # with interest management, players get announced on the next tick instead.
+        if self.interest_radius is None:
+            self.forward_packet(identity, SessionPacket.from_identity(identity))
+            self.forward_packet(identity, join_packet)
+
+            if Capability.WORLD_PAGES in connection.capabilities:
+                self._send_world(connection)
+            else:
+                for other_identity in self._state:
+                    if other_identity != identity:
+                        for record in self._introduction(other_identity):
+                            record.send(connection, flush=False)
+
+        self._connections[identity] = connection
+        connection.flush()
+
+    def _send_world(self, connection: Connection) -> None:
+        players = (
+            (self._sessions[other_identity], other_identity, attributes)
+            for other_identity, attributes in self._state.items()
+            if other_identity != connection.identity
+        )
+        compress: bool = (
+            self.compress_world and Capability.COMPRESSED_WORLD in connection.capabilities
+        )
+
+        # pages get flushed as soon as they are ready, so the first ones are on their
+        # way while the rest of a large room is being serialized.
+        for page in WorldPacket.pages(players, compress):
+            connection.send(BatchPacket.record(WORLD_SESSION, page))
+
+    def leave(self, identity: UUID) -> None:
+        """Removes a player from the room and tells the other players about it."""
+
+        with self._lock:
+            connection: Connection = self._connections.pop(identity)
+            connection.queue.close()
+
+            record = _Record(self._sessions[identity], identity, LeavePacket.new())
+
+            self._state.pop(identity)
+            self._close_session(identity)
+
+            for other_connection in self._connections.values():
+                if self.interest_radius is None or identity in other_connection.visible:
+                    other_connection.visible.discard(identity)
+                    record.send(other_connection)
+
+    def add_filter(self, packet_filter: PacketFilter) -> None:
+        """Adds a packet filter to the room."""
+
+        with self._lock:
+            self.filters.append(packet_filter)
+
+    def close(self) -> None:
+        """Closes the room, stopping its tick loop."""
+
+        self._closed = True
+
+    @property
+    def closed(self) -> bool:
+        """Whether the room has been closed."""
+
+        return self._closed
+
+    @property
+    def players(self) -> int:
+        """The number of players in the room."""
+
+        return len(self._connections)
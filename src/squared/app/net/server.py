@@ -16,39 +16,260 @@
 #     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+from abc import ABC, abstractmethod
+import asyncio
+from asyncio import StreamReader, StreamWriter
+from collections.abc import Buffer, Callable, Iterator
 from dataclasses import dataclass, field
 import logging
-from random import randint, random
-from socket import AF_INET, error as socket_error, SOCK_STREAM, socket
+import socket as socket_module
+from socket import AF_INET, error as socket_error, SHUT_RDWR, SOCK_DGRAM, SOCK_STREAM, socket
 import struct
-from threading import Thread
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Optional
 from uuid import UUID, uuid4
 
-from pygame import Rect
-
-from .filters import PacketFilter, player_collision_filter, position_filter, whitelist_packets
-from .packet import Packet, PacketType, EmbeddedPacket, LeavePacket, JoinPacket
-from ..game.main import BOUNDS
-from ..game.sprites.player import PLAYER_SIZE, PlayerAttributes, PlayerPosition
+from .connection import Connection, OutboundQueue
+from .datagram import Address, DatagramChannel
+from .filters import PacketFilter
+from .packet import (
+    PROTOCOL_VERSION, WORLD_SESSION, BatchPacket, Capability, ChannelPacket, DatagramPacket,
+    HelloPacket, Packet, RejectPacket, RoomPacket, WelcomePacket,
+)
+from .room import default_filters, Room, RoomFullError
+from .stream import PacketReader
 
 logger = logging.getLogger(__name__)
 
+HANDSHAKE_TIMEOUT: float = 1.0
+"""How many seconds a client has to send its first packet before joining room 0."""
+
+# sending a datagram never waits for the socket buffer, where the platform allows it.
+_DATAGRAM_FLAGS: int = getattr(socket_module, 'MSG_DONTWAIT', 0)
+
+
+class ServerFullError(Exception):
+    """Raised when the server cannot host any more rooms."""
+
 
 @dataclass
-class TCPServer:
-    """TCP server that functions as the game server."""
+class BaseServer(ABC):
+    """Base class containing the logic shared by every game server.
+
+    A server hosts many independent rooms, created on demand. Clients pick the room
+    to join by sending a hello packet right after connecting, which also negotiates
+    the optional parts of the protocol. Older clients send a room packet instead, or
+    nothing at all for `HANDSHAKE_TIMEOUT` seconds to join room 0, and get none of the
+    optional parts. Subclasses
+    only deal with the transport.
+
+    With `udp` enabled, the server also listens for datagrams on the same port, and
+    offers every client a datagram channel for the packets that can get lost.
+    """
 
     _backlog: int = field(default_factory=lambda: 16, init=False)
-    _connections: dict[socket, UUID] = field(default_factory=lambda: {}, init=False)
-    _state: dict[UUID, PlayerAttributes] = field(default_factory=lambda: {}, init=False)
+    _rooms: dict[int, Room] = field(default_factory=lambda: {}, init=False)
+    _rooms_lock: Lock = field(default_factory=Lock, init=False)
+    _channels: dict[int, tuple[Room, Connection]] = field(default_factory=lambda: {}, init=False)
+    _sendto: Optional[Callable[[bytes, Address], None]] = field(default=None, init=False)
     address: (str, int)
-    filters: list[PacketFilter] = field(
-        default_factory=lambda: [
-            player_collision_filter(),
-            position_filter(0, 0, *BOUNDS),
-            whitelist_packets(PacketType.POSITION),
-        ],
-    )
+    filters: list[PacketFilter] = field(default_factory=default_filters)
+    tick_rate: int = 30
+    max_queue_depth: int = 1024
+    evict_after: float = 5.0
+    interest_radius: Optional[int] = None
+    max_rooms: int = 64
+    delta_snapshots: bool = False
+    compress_world: bool = False
+    udp: bool = False
+
+    @abstractmethod
+    def start(self) -> None:
+        """Starts the server."""
+
+    def queue_depths(self) -> dict[UUID, int]:
+        """Returns the number of packets waiting to be sent to each client."""
+
+        return {
+            identity: depth
+            for room in list(self._rooms.values())
+            for identity, depth in room.queue_depths().items()
+        }
+
+    def add_filter(self, packet_filter: PacketFilter) -> None:
+        """Adds a packet filter to the server and to every room it hosts."""
+
+        self.filters.append(packet_filter)
+
+        for room in list(self._rooms.values()):
+            room.add_filter(packet_filter)
+
+    @property
+    def capabilities(self) -> Capability:
+        """The optional parts of the protocol offered to clients."""
+
+        capabilities = (
+            Capability.COMPACT_ENCODING | Capability.WORLD_PAGES | Capability.PREDICTION
+        )
+
+        if self.compress_world:
+            capabilities |= Capability.COMPRESSED_WORLD
+
+        if self.delta_snapshots:
+            capabilities |= Capability.DELTA_SNAPSHOTS
+
+        if self.udp:
+            capabilities |= Capability.DATAGRAMS
+
+        return capabilities
+
+    @abstractmethod
+    def _start_room(self, room: Room) -> None:
+        """Starts ticking a room that has just been opened."""
+
+    def _shake_hands(self, hello: HelloPacket, connection: Connection) -> None:
+        """Picks the capabilities of a connection and welcomes the client."""
+
+        connection.capabilities = hello.capabilities & self.capabilities
+        version: int = min(hello.version, PROTOCOL_VERSION)
+
+        # every other capability is carried in batch records.
+        if connection.legacy:
+            connection.capabilities = Capability(0)
+
+        logger.debug(
+            'handshake with (%s): version %d, capabilities %r.',
+            connection.identity, version, connection.capabilities,
+        )
+
+        if self._sendto is not None and Capability.DATAGRAMS in connection.capabilities:
+            connection.channel = DatagramChannel(self._sendto)
+
+        # the welcome has to reach the client before any other packet.
+        welcome_packet = WelcomePacket.from_capabilities(connection.capabilities, version)
+
+        if connection.legacy:
+            connection.send(welcome_packet.to_bytes(), flush=False)
+        else:
+            connection.send(BatchPacket.record(WORLD_SESSION, welcome_packet), flush=False)
+
+    def _join(self, first_packet: Optional[Packet], connection: Connection) -> Room:
+        """Adds a new player to the room it asked for, creating the room if needed.
+
+        Raises:
+            RoomFullError:
+                there is no space left in the room for the new player.
+            ServerFullError:
+                the server cannot host any more rooms.
+        """
+
+        identifier: int = 0
+
+        match first_packet:
+            case HelloPacket():
+                identifier = first_packet.room
+
+                self._shake_hands(first_packet, connection)
+            case RoomPacket():
+                identifier = first_packet.room
+
+        with self._rooms_lock:
+            if (room := self._rooms.get(identifier)) is None:
+                if len(self._rooms) >= self.max_rooms:
+                    raise ServerFullError('server full')
+
+                room = Room(
+                    identifier,
+                    list(self.filters),
+                    self.tick_rate,
+                    self.evict_after,
+                    self.interest_radius,
+                    self.delta_snapshots,
+                    self.compress_world,
+                )
+
+                self._rooms[identifier] = room
+                self._start_room(room)
+
+                logger.info('opened room %d.', identifier)
+
+            try:
+                room.join(connection)
+            finally:
+                self._close_empty_room(room)
+
+        if first_packet is not None and not isinstance(first_packet, (HelloPacket, RoomPacket)):
+            room.handle_packet(connection.identity, first_packet)
+
+        if connection.channel is not None:
+            self._channels[connection.channel.token] = room, connection
+
+            channel_packet = ChannelPacket.from_token(connection.channel.token)
+
+            connection.send(BatchPacket.record(WORLD_SESSION, channel_packet))
+
+        return room
+
+    def _leave(self, room: Room, connection: Connection) -> None:
+        if connection.channel is not None:
+            del self._channels[connection.channel.token]
+
+        room.leave(connection.identity)
+
+        with self._rooms_lock:
+            self._close_empty_room(room)
+
+    def _close_empty_room(self, room: Room) -> None:
+        if room.players == 0 and self._rooms.get(room.identifier) is room:
+            del self._rooms[room.identifier]
+            room.close()
+
+            logger.info('closed room %d.', room.identifier)
+
+    def _new_connection(
+            self,
+            identity: UUID,
+            close: Callable[[], None],
+            notify: Optional[Callable[[], None]] = None,
+    ) -> Connection:
+        return Connection(identity, close, OutboundQueue(self.max_queue_depth, notify))
+
+    def _handle_datagram(self, data: Buffer, address: Address) -> None:
+        """Posts the packet carried by a datagram to the room of its client.
+
+        Datagrams that are malformed, belong to no channel or arrive after a newer one
+        get dropped.
+        """
+
+        try:
+            if not isinstance(packet := Packet.from_bytes(data).parse(), DatagramPacket):
+                raise ValueError('not a datagram packet')
+
+            if (embed := packet.embed) is not None:
+                embed.parse()
+        except (struct.error, ValueError):
+            logger.debug('discarding malformed datagram from %s.', '{}:{}'.format(*address))
+
+            return
+
+        if (entry := self._channels.get(packet.token)) is None:
+            logger.debug('discarding datagram from %s: unknown channel.', '{}:{}'.format(*address))
+
+            return
+
+        room, connection = entry
+
+        if connection.channel.receive(packet.sequence, address) and embed is not None:
+            room.handle_packet(connection.identity, embed)
+
+
+@dataclass
+class TCPServer(BaseServer):
+    """TCP server that functions as the game server.
+
+    Every client is served by its own reader and writer threads, every room by its own tick thread.
+    """
 
     def start(self) -> None:
         """Starts the server."""
@@ -56,34 +277,41 @@ class TCPServer:
         thread = Thread(target=TCPServer._handle_server, args=(self,))
         thread.start()
 
-    def _forward_packet(self, source: socket, packet: Packet) -> None:
-        for s in self._connections:
-            if s != source:
-                s.sendall(packet.to_bytes())
+    def _start_room(self, room: Room) -> None:
+        thread = Thread(target=TCPServer._handle_ticks, args=(room,))
+        thread.start()
 
-    def _init_player_attributes(self, identity: UUID) -> None:
-        new_player_position: PlayerPosition = (0.0, 0.0)
+    @staticmethod
+    def _handle_ticks(room: Room) -> None:
+        interval: float = 1 / room.tick_rate
+        next_tick: float = monotonic()
 
-        spawn_found: bool = False
-        while not spawn_found:
-            new_player_position = random() * (BOUNDS[0] - PLAYER_SIZE[0]), random() * (BOUNDS[1] - PLAYER_SIZE[1])
-            new_player_rect = Rect(*new_player_position, *PLAYER_SIZE)
+        while not room.closed:
+            next_tick += interval
+            sleep(max(0.0, next_tick - monotonic()))
 
-            for other_player in self._state.values():
-                other_player_rect = Rect(*other_player['position'], *other_player['size'])
+            room.tick()
 
-                if other_player_rect.colliderect(new_player_rect):
-                    break
-            else:
-                spawn_found = True
+    def _start_datagrams(self) -> None:
+        udp = socket(AF_INET, SOCK_DGRAM)
+        udp.bind(self.address)
 
-        self._state[identity] = PlayerAttributes(**{
-            'color': tuple(randint(64, 255) for _ in range(3)),
-            'position': new_player_position,
-            'size': PLAYER_SIZE,
-        })
+        self._sendto = lambda data, address: udp.sendto(data, _DATAGRAM_FLAGS, address)
+
+        thread = Thread(target=TCPServer._handle_datagrams, args=(self, udp))
+        thread.start()
+
+    def _handle_datagrams(self, udp: socket) -> None:
+        with udp:
+            while True:
+                data, address = udp.recvfrom(0x10000)
+
+                self._handle_datagram(data, address)
 
     def _handle_server(self) -> None:
+        if self.udp:
+            self._start_datagrams()
+
         with socket(AF_INET, SOCK_STREAM) as s:
             s.bind(self.address)
             s.listen(self._backlog)
@@ -99,81 +327,248 @@ class TCPServer:
                 while True:
                     sock, addr = s.accept()
                     new_identity: UUID = uuid4()
-                    self._connections[sock] = new_identity
                     logger.info(
                         'new connection from %s (%s).',
                         '{}:{}'.format(*addr), new_identity,
                     )
 
-                    thread = Thread(target=TCPServer._handle_client, args=(self, sock))
+                    thread = Thread(
+                        target=TCPServer._handle_client, args=(self, sock, new_identity)
+                    )
                     thread.start()
             finally:
                 logger.info('game server down.')
 
-    def _handle_client(self, sock: socket) -> None:
-        identity: UUID = self._connections[sock]
+    def _handle_client(self, sock: socket, identity: UUID) -> None:
+        def close() -> None:
+            try:
+                sock.shutdown(SHUT_RDWR)
+            except socket_error:
+                pass
 
-        logger.debug('player (%s) has joined the server.', identity)
+        reader = PacketReader(sock)
+        packets: Iterator[memoryview] = iter(reader)
 
-        self._init_player_attributes(identity)
-        join_packet = JoinPacket.from_attributes(self._state[identity])
+        sock.settimeout(HANDSHAKE_TIMEOUT)
 
-        self._forward_packet(
-            sock,
-            EmbeddedPacket.from_packet(identity, join_packet),
-        )
+        # only legacy clients start with anything but a hello packet.
+        try:
+            first_packet: Optional[Packet] = self._parse_packet(
+                next(packets), identity, legacy=True
+            )
+        except TimeoutError:
+            # the reader keeps what it received, but the iterator ended with the timeout.
+            first_packet, packets = None, iter(reader)
+        except socket_error:
+            sock.close()
+
+            return
 
-        sock.sendall(EmbeddedPacket.from_packet(UUID(int=0), join_packet).to_bytes())
+        sock.settimeout(None)
 
-        for other_identity, state in self._state.items():
-            if other_identity != identity:
-                join_packet = JoinPacket.from_attributes(state)
-                sock.sendall(EmbeddedPacket.from_packet(other_identity, join_packet).to_bytes())
+        connection: Connection = self._new_connection(identity, close)
 
         try:
-            while True:
-                try:
-                    packet = Packet.from_socket(sock).parse()
-                except (struct.error, ValueError):
-                    logger.warning('discarding malformed packet from (%s).', identity)
-                    continue
-
-                logger.debug('received packet from (%s) %r.', identity, packet)
-
-                for packet_filter in self.filters:
-                    if not packet_filter(identity, packet, self._state):
-                        logger.debug('packet filtered (%s) %r.', identity, packet)
-
-                        break
-                else:
-                    match packet.type:
-                        case PacketType.POSITION:
-                            logger.debug(
-                                'update player (%s) position (%.2f, %.2f) -> (%.2f, %.2f).',
-                                identity, *self._state[identity]['position'], packet.x, packet.y
-                            )
-
-                            self._state[identity]['position'] = (packet.x, packet.y)
-
-                    self._forward_packet(
-                        sock,
-                        EmbeddedPacket.from_packet(identity, packet),
-                    )
+            room: Room = self._join(first_packet, connection)
+        except (RoomFullError, ServerFullError) as e:
+            logger.warning('rejecting (%s): %s.', identity, e)
+
+            with sock:
+                sock.sendall(RejectPacket.from_reason(str(e)).to_bytes())
+
+            return
+
+        thread = Thread(target=TCPServer._handle_outbound_packets, args=(self, sock, connection))
+        thread.start()
+
+        try:
+            for blob in packets:
+                if (packet := self._parse_packet(blob, identity, connection.legacy)) is not None:
+                    room.handle_packet(identity, packet)
 
         except socket_error:
-            self._forward_packet(
-                sock,
-                EmbeddedPacket.from_packet(identity, LeavePacket.new()),
-            )
+            pass
 
         finally:
-            logger.info('connection closed (%d).', identity)
+            logger.info('connection closed (%s).', identity)
 
-            self._connections.pop(sock)
-            self._state.pop(identity)
+            self._leave(room, connection)
+            thread.join()
             sock.close()
 
-    def add_filter(self, packet_filter: PacketFilter) -> None:
-        """Adds a packet filter to the server."""
+    @staticmethod
+    def _parse_packet(blob: memoryview, identity: UUID, legacy: bool) -> Optional[Packet]:
+        try:
+            return Packet.from_bytes(blob).parse(legacy)
+        except (struct.error, ValueError):
+            logger.warning('discarding malformed packet from (%s).', identity)
 
-        self.filters.append(packet_filter)
+        return None
+
+    def _handle_outbound_packets(self, sock: socket, connection: Connection) -> None:
+        try:
+            while records := connection.queue.get():
+                sock.sendall(connection.frame(records))
+        except socket_error:
+            connection.evict()
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    """Hands the datagrams received by an asyncio endpoint to a server."""
+
+    def __init__(self, handle: Callable[[bytes, Address], None]):
+        self._handle = handle
+
+    def datagram_received(self, data: bytes, addr: Address) -> None:
+        self._handle(data, addr)
+
+
+@dataclass
+class AsyncTCPServer(BaseServer):
+    """TCP server that functions as the game server.
+
+    Every client and room is served by a single asyncio event loop.
+    """
+
+    _tasks: set[asyncio.Task] = field(default_factory=set, init=False)
+
+    def start(self) -> None:
+        """Starts the server."""
+
+        thread = Thread(target=asyncio.run, args=(self._handle_server(),))
+        thread.start()
+
+    def _start_room(self, room: Room) -> None:
+        task = asyncio.create_task(self._handle_ticks(room))
+
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _handle_ticks(room: Room) -> None:
+        interval: float = 1 / room.tick_rate
+        next_tick: float = monotonic()
+
+        while not room.closed:
+            next_tick += interval
+            await asyncio.sleep(max(0.0, next_tick - monotonic()))
+
+            room.tick()
+
+    async def _handle_server(self) -> None:
+        if self.udp:
+            transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _DatagramProtocol(self._handle_datagram),
+                local_addr=self.address,
+            )
+
+            self._sendto = transport.sendto
+
+        server = await asyncio.start_server(
+            self._handle_client,
+            *self.address,
+            backlog=self._backlog,
+        )
+
+        logger.info(
+            'binding on address %s (%d).',
+            '{}:{}'.format(*self.address), self._backlog
+        )
+
+        logging.info('game server started.')
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            logger.info('game server down.')
+
+    async def _handle_client(
+            self,
+            reader: StreamReader,
+            writer: StreamWriter,
+            handshake_timeout: float = HANDSHAKE_TIMEOUT,
+    ) -> None:
+        identity: UUID = uuid4()
+        logger.info(
+            'new connection from %s (%s).',
+            '{}:{}'.format(*writer.get_extra_info('peername')[:2]), identity,
+        )
+
+        # only legacy clients start with anything but a hello packet.
+        try:
+            first_packet: Optional[Packet] = await self._read_packet(
+                reader, identity, True, handshake_timeout
+            )
+        except TimeoutError:
+            first_packet = None
+        except socket_error:
+            writer.close()
+
+            return
+
+        flushed = asyncio.Event()
+        connection: Connection = self._new_connection(
+            identity, writer.transport.abort, flushed.set
+        )
+
+        try:
+            room: Room = self._join(first_packet, connection)
+        except (RoomFullError, ServerFullError) as e:
+            logger.warning('rejecting (%s): %s.', identity, e)
+
+            writer.write(RejectPacket.from_reason(str(e)).to_bytes())
+            await writer.drain()
+            writer.close()
+
+            return
+
+        outbound = asyncio.create_task(self._handle_outbound_packets(writer, connection, flushed))
+
+        try:
+            while True:
+                packet = await self._read_packet(reader, identity, connection.legacy)
+
+                if packet is not None:
+                    room.handle_packet(identity, packet)
+
+        except socket_error:
+            pass
+
+        finally:
+            logger.info('connection closed (%s).', identity)
+
+            self._leave(room, connection)
+            await outbound
+            writer.close()
+
+    @staticmethod
+    async def _read_packet(
+            reader: StreamReader,
+            identity: UUID,
+            legacy: bool,
+            timeout: Optional[float] = None,
+    ) -> Optional[Packet]:
+        try:
+            return (await Packet.from_stream(reader, timeout)).parse(legacy)
+        except (struct.error, ValueError):
+            logger.warning('discarding malformed packet from (%s).', identity)
+
+        return None
+
+    @staticmethod
+    async def _handle_outbound_packets(
+            writer: StreamWriter,
+            connection: Connection,
+            flushed: asyncio.Event,
+    ) -> None:
+        try:
+            while not connection.queue.closed:
+                await flushed.wait()
+                flushed.clear()
+
+                if records := connection.queue.pop_all():
+                    writer.write(connection.frame(records))
+                    await writer.drain()
+        except socket_error:
+            connection.evict()
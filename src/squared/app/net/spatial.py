@@ -0,0 +1,151 @@
+"""Contains spatial indexes used to speed up proximity queries."""
+
+# Copyright (C) 2025  Stefano Cuizza
+
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from collections.abc import Hashable, Iterator
+
+from pygame import Rect
+
+
+type Cell = tuple[int, int]
+type CellRange = tuple[int, int, int, int]
+
+
+class SpatialGrid:
+    """Uniform grid that indexes rectangles by the cells they overlap.
+
+    Two rectangles can only collide if they share at least one cell, so a query
+    only has to look at the rectangles in the cells overlapped by the queried area.
+    """
+
+    def __init__(self, cell_size: int):
+        """Args:
+            cell_size:
+                the side of a grid cell.
+        """
+
+        self._cell_size: int = cell_size
+        self._cells: dict[Cell, set[Hashable]] = {}
+        self._ranges: dict[Hashable, CellRange] = {}
+        self._rects: dict[Hashable, Rect] = {}
+
+    def insert(self, key: Hashable, rect: Rect) -> None:
+        """Inserts a rectangle in the grid, replacing the previous one with the same key.
+
+        Args:
+            key:
+                the key identifying the rectangle.
+            rect:
+                the rectangle to insert.
+        """
+
+        cell_range: CellRange = self._cell_range(rect)
+        self._rects[key] = Rect(rect)
+
+        if (previous_range := self._ranges.get(key)) == cell_range:
+            return
+
+        if previous_range is not None:
+            self._unlink(key, previous_range)
+
+        self._ranges[key] = cell_range
+        for cell in self._iter_cells(cell_range):
+            self._cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key: Hashable) -> None:
+        """Removes a rectangle from the grid.
+
+        Args:
+            key:
+                the key identifying the rectangle.
+        """
+
+        self._unlink(key, self._ranges.pop(key))
+        del self._rects[key]
+
+    def query(self, rect: Rect) -> set[Hashable]:
+        """Returns the keys of the rectangles that share at least one cell with an area.
+
+        The result is a superset of the rectangles that collide with the area.
+
+        Args:
+            rect:
+                the area to query.
+        """
+
+        keys: set[Hashable] = set()
+        for cell in self._iter_cells(self._cell_range(rect)):
+            if bucket := self._cells.get(cell):
+                keys.update(bucket)
+
+        return keys
+
+    def colliding(self, rect: Rect) -> Iterator[Hashable]:
+        """Yields the keys of the rectangles that collide with an area.
+
+        Args:
+            rect:
+                the area to check.
+        """
+
+        for key in self.query(rect):
+            if rect.colliderect(self._rects[key]):
+                yield key
+
+    def rect(self, key: Hashable) -> Rect:
+        """Returns the rectangle identified by a key."""
+
+        return self._rects[key]
+
+    def _cell_range(self, rect: Rect) -> CellRange:
+        if rect.width <= 0 or rect.height <= 0:
+            return 0, 0, -1, -1
+
+        return (
+            rect.left // self._cell_size,
+            rect.top // self._cell_size,
+            (rect.right - 1) // self._cell_size,
+            (rect.bottom - 1) // self._cell_size,
+        )
+
+    @staticmethod
+    def _iter_cells(cell_range: CellRange) -> Iterator[Cell]:
+        left, top, right, bottom = cell_range
+
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                yield x, y
+
+    def _unlink(self, key: Hashable, cell_range: CellRange) -> None:
+        for cell in self._iter_cells(cell_range):
+            bucket: set[Hashable] = self._cells[cell]
+            bucket.discard(key)
+
+            if not bucket:
+                del self._cells[cell]
+
+    @property
+    def cell_size(self) -> int:
+        """The side of a grid cell."""
+
+        return self._cell_size
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._rects
+
+    def __len__(self) -> int:
+        return len(self._rects)
@@ -0,0 +1,144 @@
+"""Contains the server-side representation of a game world."""
+
+# Copyright (C) 2025  Stefano Cuizza
+
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from collections.abc import Iterator, MutableMapping
+from random import Random
+from typing import Optional
+from uuid import UUID
+
+from pygame import Rect
+
+from ..game.sprites.player import PLAYER_SIZE, PlayerAttributes, PlayerPosition, PlayerSize
+from .spatial import SpatialGrid
+
+
+class WorldState(MutableMapping[UUID, PlayerAttributes]):
+    """The players of a game world, indexed by their position.
+
+    Positions must be updated through `move()`, so that the spatial index stays
+    in sync with the players' attributes.
+    """
+
+    def __init__(self, cell_size: int = max(PLAYER_SIZE)):
+        """Args:
+            cell_size:
+                the side of a cell of the spatial index.
+        """
+
+        self._grid = SpatialGrid(cell_size)
+        self._players: dict[UUID, PlayerAttributes] = {}
+
+    def move(self, identity: UUID, position: PlayerPosition) -> None:
+        """Updates a player's position.
+
+        Args:
+            identity:
+                the identity of the player.
+            position:
+                the new position of the player.
+        """
+
+        attributes: PlayerAttributes = self._players[identity]
+        attributes['position'] = position
+
+        self._grid.insert(identity, Rect(*position, *attributes['size']))
+
+    def free_position(
+            self,
+            size: PlayerSize,
+            bounds: tuple[int, int],
+            attempts: int = 8,
+            rng: Optional[Random] = None,
+    ) -> Optional[PlayerPosition]:
+        """Returns a random position where a player would not overlap any other player.
+
+        A few random positions are tried first. If all of them are taken, every slot of
+        a lattice with the same spacing as the player size is checked in random order,
+        so the search always ends in a bounded number of steps.
+
+        Args:
+            size:
+                the size of the player.
+            bounds:
+                the size of the world.
+            attempts:
+                how many random positions to try before checking the lattice.
+            rng:
+                the random number generator to use.
+
+        Returns:
+            the free position, or None if the world is full.
+        """
+
+        rng = rng or Random()
+        max_x, max_y = bounds[0] - size[0], bounds[1] - size[1]
+
+        for _ in range(attempts):
+            position: PlayerPosition = rng.random() * max_x, rng.random() * max_y
+
+            if self._is_free(position, size):
+                return position
+
+        slots: list[PlayerPosition] = [
+            (float(x), float(y))
+            for x in range(0, max_x + 1, size[0])
+            for y in range(0, max_y + 1, size[1])
+        ]
+        rng.shuffle(slots)
+
+        for position in slots:
+            if self._is_free(position, size):
+                return position
+
+        return None
+
+    def _is_free(self, position: PlayerPosition, size: PlayerSize) -> bool:
+        return next(self.colliding(Rect(*position, *size)), None) is None
+
+    def colliding(self, rect: Rect) -> Iterator[UUID]:
+        """Yields the identities of the players that collide with an area.
+
+        Args:
+            rect:
+                the area to check.
+        """
+
+        return self._grid.colliding(rect)
+
+    @property
+    def grid(self) -> SpatialGrid:
+        """The spatial index of the world."""
+
+        return self._grid
+
+    def __getitem__(self, identity: UUID) -> PlayerAttributes:
+        return self._players[identity]
+
+    def __setitem__(self, identity: UUID, attributes: PlayerAttributes) -> None:
+        self._players[identity] = attributes
+        self._grid.insert(identity, Rect(*attributes['position'], *attributes['size']))
+
+    def __delitem__(self, identity: UUID) -> None:
+        del self._players[identity]
+        self._grid.remove(identity)
+
+    def __iter__(self) -> Iterator[UUID]:
+        return iter(self._players)
+
+    def __len__(self) -> int:
+        return len(self._players)
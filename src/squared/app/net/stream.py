@@ -0,0 +1,130 @@
+"""Contains the buffered reader used to split a TCP stream into packets."""
+
+# Copyright (C) 2025  Stefano Cuizza
+
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from collections.abc import Iterator
+from socket import error as socket_error, socket
+import struct
+
+from .packet import MAX_PACKET_SIZE
+
+
+_HEADER_SIZE: int = 6
+_LENGTH: struct.Struct = struct.Struct('>I')
+
+
+class PacketReader:
+    """Splits the stream of a socket into packets, however the stream got segmented.
+
+    Data is received with `recv_into` straight into a reusable buffer, as much as
+    the socket has available, and every whole packet in the buffer is returned before
+    reading again. A packet split across reads is kept in the buffer until the rest
+    of it arrives.
+
+    Packets are returned as views into the buffer, which are only valid until the
+    next packet is requested.
+
+    Packets are never split around the end of the buffer: when the next packet does not
+    fit, the bytes received so far are moved back to the start of the buffer, and the
+    buffer only grows for packets larger than itself.
+    """
+
+    def __init__(
+            self,
+            sock: socket,
+            buffer_size: int = 1 << 16,
+            max_packet_size: int = MAX_PACKET_SIZE,
+    ):
+        """Args:
+            sock:
+                the socket to read.
+            buffer_size:
+                the initial size of the receive buffer.
+            max_packet_size:
+                the size of the largest packet accepted, header included.
+        """
+
+        self._sock: socket = sock
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._max_packet_size: int = max_packet_size
+
+        self._start: int = 0
+        self._end: int = 0
+
+    def __iter__(self) -> Iterator[memoryview]:
+        """Yields the serialized packets received on the socket.
+
+        Raises:
+            socket.error:
+                the connection has been closed, or the peer sent a packet larger than
+                the maximum packet size.
+        """
+
+        while True:
+            yield from self._buffered_packets()
+
+            self._fill()
+
+    def _buffered_packets(self) -> Iterator[memoryview]:
+        while (available := self._end - self._start) >= _HEADER_SIZE:
+            size: int = _HEADER_SIZE + _LENGTH.unpack_from(self._buffer, self._start + 2)[0]
+
+            if size > self._max_packet_size:
+                raise socket_error(f'packet too large ({size} bytes)')
+
+            if available < size:
+                self._reserve(size)
+
+                return
+
+            packet: memoryview = self._view[self._start:self._start + size]
+            self._start += size
+
+            yield packet
+
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def _fill(self) -> None:
+        if self._end == len(self._buffer):
+            self._compact()
+
+        if not (received := self._sock.recv_into(self._view[self._end:])):
+            raise socket_error('connection closed')
+
+        self._end += received
+
+    def _reserve(self, size: int) -> None:
+        """Makes room for a packet of the given size starting at the first buffered byte."""
+
+        if size > len(self._buffer):
+            buffer = bytearray(size)
+            buffer[:self._end - self._start] = self._view[self._start:self._end]
+
+            self._view.release()
+            self._buffer, self._view = buffer, memoryview(buffer)
+            self._end -= self._start
+            self._start = 0
+        elif self._start + size > len(self._buffer):
+            self._compact()
+
+    def _compact(self) -> None:
+        buffered: int = self._end - self._start
+
+        self._view[:buffered] = self._view[self._start:self._end]
+        self._start, self._end = 0, buffered
@@ -0,0 +1,392 @@
+"""Contains the logic used to run the game server on multiple processes.
+
+Each worker process hosts the rooms whose identifier modulo the number of workers
+equals its index. Connections are routed to the worker owning the room they ask for
+by passing their file descriptor over a UNIX socket, so this module only works on
+POSIX systems.
+"""
+
+# Copyright (C) 2025  Stefano Cuizza
+
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+from dataclasses import dataclass, field
+import logging
+import multiprocessing
+from multiprocessing.process import BaseProcess
+from os import cpu_count
+from selectors import DefaultSelector, EVENT_READ
+from socket import (
+    AF_INET, AF_UNIX, error as socket_error, MSG_PEEK, recv_fds, send_fds, SO_REUSEADDR,
+    SO_REUSEPORT, SOCK_SEQPACKET, SOCK_STREAM, socket, socketpair, SOL_SOCKET,
+)
+import struct
+from threading import Thread
+from time import monotonic
+from typing import Any, Optional
+
+from .packet import PacketType
+from .server import AsyncTCPServer, HANDSHAKE_TIMEOUT
+from ...modules import log
+
+
+logger = logging.getLogger(__name__)
+
+# a connection is handed over with its room and the seconds left of its handshake.
+_HANDOVER: struct.Struct = struct.Struct('>Id')
+
+
+def peek_room(sock: socket) -> Optional[int]:
+    """Reads the room a client asked for without consuming its room or hello packet.
+
+    Args:
+        sock:
+            the client socket.
+
+    Returns:
+        the room identifier, 0 if the client sent neither packet, or None
+        if the packet has not been fully received yet.
+
+    Raises:
+        socket.error:
+            the connection has been closed.
+    """
+
+    if not (blob := sock.recv(10, MSG_PEEK)):
+        raise socket_error('connection closed')
+
+    if len(blob) < 2:
+        return None
+
+    # the room is at the same offset in both packets.
+    if int.from_bytes(blob[:2], byteorder='big') not in (PacketType.ROOM, PacketType.HELLO):
+        return 0
+
+    if len(blob) < 10:
+        return None
+
+    return struct.unpack('>I', blob[6:10])[0]
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def _run_worker(
+        index: int,
+        workers: int,
+        control: socket,
+        reuse_port: bool,
+        address: tuple[str, int],
+        options: dict[str, Any],
+        log_level: int,
+) -> None:
+    log.init()
+    log.set_root_logger_level(log_level)
+
+    server = WorkerServer(
+        address,
+        control=control,
+        index=index,
+        workers=workers,
+        reuse_port=reuse_port,
+        **options,
+    )
+
+    asyncio.run(server._handle_server())
+
+
+@dataclass
+class WorkerServer(AsyncTCPServer):
+    """Game server hosting the rooms owned by one of the workers of a supervisor.
+
+    The worker adopts the connections handed over by the supervisor. When using
+    SO_REUSEPORT it also accepts connections on its own, and hands the ones asking
+    for a room it does not own back to the supervisor.
+    """
+
+    control: Optional[socket] = None
+    index: int = 0
+    workers: int = 1
+    reuse_port: bool = False
+
+    def _owns(self, room: int) -> bool:
+        return room % self.workers == self.index
+
+    async def _handle_server(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopped: asyncio.Future = loop.create_future()
+
+        self.control.setblocking(False)
+        loop.add_reader(self.control.fileno(), self._receive_connection, stopped)
+
+        logger.info('worker %d started.', self.index)
+
+        try:
+            if self.reuse_port:
+                with socket(AF_INET, SOCK_STREAM) as s:
+                    s.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+                    s.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+                    s.bind(self.address)
+                    s.listen(self._backlog)
+                    s.setblocking(False)
+
+                    accept = asyncio.create_task(self._handle_accept(s))
+                    await stopped
+                    accept.cancel()
+            else:
+                await stopped
+        finally:
+            logger.info('worker %d down.', self.index)
+
+    async def _handle_accept(self, listener: socket) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            sock, _ = await loop.sock_accept(listener)
+            self._spawn(self._route_connection(sock))
+
+    async def _route_connection(self, sock: socket) -> None:
+        loop = asyncio.get_running_loop()
+        deadline: float = loop.time() + HANDSHAKE_TIMEOUT
+
+        try:
+            room: int = await self._peek_room(sock, deadline)
+        except socket_error:
+            sock.close()
+
+            return
+
+        if self._owns(room):
+            await self._adopt_connection(sock, max(0.0, deadline - loop.time()))
+        else:
+            handover: bytes = _HANDOVER.pack(room, max(0.0, deadline - loop.time()))
+
+            send_fds(self.control, [handover], [sock.fileno()])
+            sock.close()
+
+    @staticmethod
+    async def _peek_room(sock: socket, deadline: float) -> int:
+        loop = asyncio.get_running_loop()
+
+        sock.setblocking(False)
+
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                if (room := peek_room(sock)) is not None:
+                    return room
+            except BlockingIOError:
+                pass
+
+            readable: asyncio.Future = loop.create_future()
+            loop.add_reader(sock.fileno(), _resolve, readable)
+
+            try:
+                await asyncio.wait_for(readable, remaining)
+            except TimeoutError:
+                pass
+            finally:
+                loop.remove_reader(sock.fileno())
+
+        return 0
+
+    def _receive_connection(self, stopped: asyncio.Future) -> None:
+        try:
+            handover, fds, _, _ = recv_fds(self.control, _HANDOVER.size, 1)
+        except BlockingIOError:
+            return
+
+        if not fds:
+            logger.warning('worker %d lost its supervisor.', self.index)
+
+            asyncio.get_running_loop().remove_reader(self.control.fileno())
+            _resolve(stopped)
+
+            return
+
+        _, timeout = _HANDOVER.unpack(handover)
+
+        self._spawn(self._adopt_connection(socket(fileno=fds[0]), timeout))
+
+    async def _adopt_connection(self, sock: socket, timeout: float) -> None:
+        """Serves a connection whose room has been read, with what is left of its handshake."""
+
+        sock.setblocking(False)
+
+        reader, writer = await asyncio.open_connection(sock=sock)
+        await self._handle_client(reader, writer, timeout)
+
+    def _spawn(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+@dataclass
+class Supervisor:
+    """Runs the game server on multiple worker processes.
+
+    Without SO_REUSEPORT the supervisor accepts every connection and routes it to the
+    worker owning the requested room. With SO_REUSEPORT the workers accept connections
+    on the shared port themselves, and the supervisor only forwards the connections
+    that landed on the wrong worker. Crashed workers are restarted.
+    """
+
+    _controls: list[Optional[socket]] = field(default_factory=lambda: [], init=False)
+    _processes: list[Optional[BaseProcess]] = field(default_factory=lambda: [], init=False)
+    _selector: DefaultSelector = field(default_factory=DefaultSelector, init=False)
+    address: (str, int)
+    workers: int = field(default_factory=lambda: cpu_count() or 1)
+    reuse_port: bool = False
+    options: dict[str, Any] = field(default_factory=lambda: {})
+
+    def start(self) -> None:
+        """Starts the supervisor and its workers."""
+
+        thread = Thread(target=Supervisor._handle_supervisor, args=(self,))
+        thread.start()
+
+    def _start_worker(self, index: int) -> None:
+        parent, child = socketpair(AF_UNIX, SOCK_SEQPACKET)
+
+        process = multiprocessing.get_context('spawn').Process(
+            target=_run_worker,
+            args=(
+                index, self.workers, child, self.reuse_port,
+                self.address, self.options, logging.getLogger().level,
+            ),
+            daemon=True,
+        )
+        process.start()
+        child.close()
+
+        self._controls[index] = parent
+        self._processes[index] = process
+        self._selector.register(parent, EVENT_READ, index)
+
+        logger.info('started worker %d (pid %d).', index, process.pid)
+
+    def _restart_crashed_workers(self) -> None:
+        for index, process in enumerate(self._processes):
+            if process.is_alive():
+                continue
+
+            logger.warning('worker %d exited (%s), restarting it.', index, process.exitcode)
+
+            self._selector.unregister(self._controls[index])
+            self._controls[index].close()
+
+            self._start_worker(index)
+
+    def _route_connection(self, room: int, sock: socket, timeout: float = 0.0) -> None:
+        """Hands a connection over to the worker owning its room.
+
+        Args:
+            room:
+                the room the client asked for.
+            sock:
+                the client socket, closed once handed over.
+            timeout:
+                how many seconds are left for the client to send its first packet.
+        """
+
+        index: int = room % self.workers
+
+        try:
+            send_fds(self._controls[index], [_HANDOVER.pack(room, timeout)], [sock.fileno()])
+        except socket_error:
+            logger.warning('could not hand a connection over to worker %d.', index)
+        finally:
+            sock.close()
+
+    def _handle_supervisor(self) -> None:
+        self._controls = [None] * self.workers
+        self._processes = [None] * self.workers
+
+        for index in range(self.workers):
+            self._start_worker(index)
+
+        listener: Optional[socket] = None
+        if not self.reuse_port:
+            listener = socket(AF_INET, SOCK_STREAM)
+            listener.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+            listener.bind(self.address)
+            listener.listen(16)
+            listener.setblocking(False)
+
+            self._selector.register(listener, EVENT_READ, 'listener')
+
+        logger.info(
+            'supervising %d workers on address %s%s.',
+            self.workers, '{}:{}'.format(*self.address),
+            ' (SO_REUSEPORT)' if self.reuse_port else '',
+        )
+
+        handshakes: dict[socket, float] = {}
+
+        try:
+            while True:
+                for key, _ in self._selector.select(timeout=0.5):
+                    match key.data:
+                        case 'listener':
+                            sock, _ = listener.accept()
+                            sock.setblocking(False)
+
+                            handshakes[sock] = monotonic() + HANDSHAKE_TIMEOUT
+                            self._selector.register(sock, EVENT_READ, 'handshake')
+                        case 'handshake':
+                            sock: socket = key.fileobj
+
+                            try:
+                                if (room := peek_room(sock)) is None:
+                                    continue
+                            except socket_error:
+                                room = None
+
+                            self._selector.unregister(sock)
+                            timeout: float = max(0.0, handshakes.pop(sock) - monotonic())
+
+                            if room is None:
+                                sock.close()
+                            else:
+                                self._route_connection(room, sock, timeout)
+                        case _:
+                            try:
+                                handover, fds, _, _ = recv_fds(key.fileobj, _HANDOVER.size, 1)
+                            except socket_error:
+                                continue
+
+                            if fds:
+                                room, timeout = _HANDOVER.unpack(handover)
+
+                                self._route_connection(room, socket(fileno=fds[0]), timeout)
+
+                now: float = monotonic()
+                for sock, deadline in list(handshakes.items()):
+                    if deadline < now:
+                        self._selector.unregister(sock)
+                        del handshakes[sock]
+
+                        self._route_connection(0, sock)
+
+                self._restart_crashed_workers()
+        finally:
+            if listener is not None:
+                listener.close()
+
+            logger.info('supervisor down.')
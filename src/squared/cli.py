@@ -17,16 +17,22 @@
 
 
 from argparse import Namespace
+from importlib import import_module
 import logging
 
 from .app.net.client import TCPClient
-from .app.net.server import TCPServer
+from .app.net.server import AsyncTCPServer, BaseServer, TCPServer
 from .app.game import main as game
 from .token import stoken_encode
 
 
 logger = logging.getLogger(__name__)
 
+SERVER_BACKENDS: dict[str, type[BaseServer]] = {
+    'asyncio': AsyncTCPServer,
+    'threading': TCPServer,
+}
+
 
 def main(namespace: Namespace) -> None:
     """Main CLI function.
@@ -40,18 +46,39 @@ def main(namespace: Namespace) -> None:
     if namespace.connect:
         server_address = str(namespace.connect[0]), namespace.connect[1]
 
-        game_client = TCPClient(server_address)
-        game.run(game_client)
+        game_client = TCPClient(server_address, room=namespace.room, send_rate=namespace.send_rate)
+        game.run(game_client, namespace.interpolation_delay / 1000)
 
     if namespace.host:
         print(f'SERVER TOKEN: {stoken_encode(namespace.host[0], namespace.host[1], default_port=7173)}.')
 
         server_address = str(namespace.host[0]), namespace.host[1]
 
-        game_server = TCPServer(server_address)
+        options = {
+            'tick_rate': namespace.tick_rate,
+            'interest_radius': namespace.interest_radius,
+            'max_rooms': namespace.max_rooms,
+            'delta_snapshots': namespace.delta_snapshots,
+            'compress_world': namespace.compress_world,
+            'udp': namespace.udp,
+        }
+
+        if namespace.workers > 1:
+            # the supervisor relies on Unix sockets, so it only gets imported where it runs.
+            supervisor = import_module('.app.net.supervisor', __package__)
+
+            game_server = supervisor.Supervisor(
+                server_address,
+                workers=namespace.workers,
+                reuse_port=namespace.reuse_port,
+                options=options,
+            )
+        else:
+            game_server = SERVER_BACKENDS[namespace.backend](server_address, **options)
+
         game_server.start()
     elif namespace.connect:
         server_address = str(namespace.connect[0]), namespace.connect[1]
 
-    game_client = TCPClient(server_address)
-    game.run(game_client)
+    game_client = TCPClient(server_address, room=namespace.room, send_rate=namespace.send_rate)
+    game.run(game_client, namespace.interpolation_delay / 1000)
@@ -21,6 +21,7 @@ from argparse import (
 )
 from collections.abc import Sequence
 import logging
+import socket
 from typing import Optional, override
 
 from ..modules import metadata
@@ -30,6 +31,11 @@ from . import types
 
 logger = logging.getLogger(__name__)
 
+_WORKERS_SUPPORTED: bool = all(
+    hasattr(socket, name) for name in ('AF_UNIX', 'SOCK_SEQPACKET', 'send_fds', 'recv_fds')
+)
+_REUSE_PORT_SUPPORTED: bool = hasattr(socket, 'SO_REUSEPORT')
+
 
 def _construct() -> ArgumentParser:
     """Returns an instance of the module's argument parser.
@@ -81,6 +87,92 @@ class MainArgumentParser(MainArgumentParserTemplate):
             type=lambda a: types.connection_address(a, default_port),
         )
 
+        self.add_argument(
+            '-r', '--room',
+            default=0,
+            help='room to join on the game server (default=0)',
+            metavar='id',
+            type=types.room_identifier,
+        )
+
+        self.add_argument(
+            '-s', '--send-rate',
+            default=30,
+            help='how many times per second the client sends its updates (default=30)',
+            metavar='hz',
+            type=types.positive_integer,
+        )
+
+        self.add_argument(
+            '--interpolation-delay',
+            default=100,
+            help='how far in the past remote players are rendered (default=100)',
+            metavar='ms',
+            type=types.positive_integer,
+        )
+
+        self.add_argument(
+            '--max-rooms',
+            default=64,
+            help='maximum number of rooms hosted at the same time (default=64)',
+            metavar='n',
+            type=types.positive_integer,
+        )
+
+        self.add_argument(
+            '-b', '--backend',
+            choices=('asyncio', 'threading'),
+            default='asyncio',
+            help='server implementation used when hosting a game (default=asyncio)',
+        )
+
+        self.add_argument(
+            '-w', '--workers',
+            default=1,
+            help='number of processes the hosted rooms are sharded across (default=1)',
+            metavar='n',
+            type=types.positive_integer,
+        )
+
+        self.add_argument(
+            '--reuse-port',
+            action='store_true',
+            help='let every worker accept connections on the same port with SO_REUSEPORT',
+        )
+
+        self.add_argument(
+            '-t', '--tick-rate',
+            default=30,
+            help='how many times per second the server broadcasts player updates (default=30)',
+            metavar='hz',
+            type=types.positive_integer,
+        )
+
+        self.add_argument(
+            '--interest-radius',
+            help='only send players the updates of players within this distance (default=none)',
+            metavar='px',
+            type=types.positive_integer,
+        )
+
+        self.add_argument(
+            '--delta-snapshots',
+            action='store_true',
+            help='send players snapshots of the room as deltas from their last acknowledged one',
+        )
+
+        self.add_argument(
+            '--compress-world',
+            action='store_true',
+            help='compress the state of the room sent to joining players with zlib',
+        )
+
+        self.add_argument(
+            '--udp',
+            action='store_true',
+            help='also send position updates over UDP, on the same port (single worker only)',
+        )
+
     def _extend_subparsers(self) -> None:
         pass
 
@@ -96,4 +188,13 @@ class MainArgumentParser(MainArgumentParserTemplate):
         if namespace.connect and namespace.host:
             namespace.host = None
 
+        if namespace.workers > 1 and not _WORKERS_SUPPORTED:
+            self.error('--workers is not supported on this platform')
+
+        if namespace.reuse_port and not _REUSE_PORT_SUPPORTED:
+            self.error('--reuse-port is not supported on this platform')
+
+        if namespace.udp and namespace.workers > 1:
+            self.error('--udp cannot be used with more than one worker')
+
         return namespace
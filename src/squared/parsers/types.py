@@ -33,6 +33,24 @@ def network_port(argument: str) -> int:
     raise ValueError(f'{port!r} is not in range (0, 65535]')
 
 
+def positive_integer(argument: str) -> int:
+    """Checks whether the provided argument is a positive integer."""
+
+    if (value := int(argument)) > 0:
+        return value
+
+    raise ValueError(f'{value!r} is not a positive integer')
+
+
+def room_identifier(argument: str) -> int:
+    """Checks whether the provided argument is a valid room identifier."""
+
+    if 0 <= (room := int(argument)) <= 0xFFFFFFFF:
+        return room
+
+    raise ValueError(f'{room!r} is not in range [0, 4294967295]')
+
+
 def network_ip(argument: str) -> IPv4Address | IPv6Address:
     """Checks whether the provided argument is a valid IP address.
 
@@ -0,0 +1,130 @@
+from threading import Thread
+from uuid import uuid4
+
+from squared.app.net.callbacks import on_player_join, on_player_move
+from squared.app.net.client import TCPClient
+from squared.app.net.packet import (
+    ALL_CAPABILITIES, WORLD_SESSION, BatchPacket, Capability, LeavePacket, Packet, PacketType,
+    PositionPacket, SessionPacket, SnapshotPacket,
+)
+
+
+class _RecordingSocket:
+    def __init__(self):
+        self.sent: list[bytes] = []
+
+    def sendall(self, data: bytes) -> None:
+        self.sent.append(data)
+
+
+def test_outbound_positions_are_coalesced() -> None:
+    """Verifies that only the latest position update gets sent, and other packets keep their order.
+    """
+
+    client = TCPClient(('127.0.0.1', 0), capabilities=ALL_CAPABILITIES & ~Capability.PREDICTION)
+    sock = _RecordingSocket()
+
+    for i in range(100):
+        client.update_position(i, i)
+
+    client.send_packet(LeavePacket.new())
+    client.update_position(500, 500)
+
+    writer = Thread(target=client._handle_outbound_packets, args=(sock,))
+    writer.start()
+
+    while not sock.sent:
+        pass
+
+    client._outbound_packets_queue.close()
+    writer.join()
+
+    assert sock.sent == [
+        PositionPacket.from_coordinates(500, 500).to_bytes() + LeavePacket.new().to_bytes()
+    ]
+
+
+def test_clients_do_not_share_their_outbound_queue() -> None:
+    """Verifies that every client has its own outbound queue."""
+
+    first, second = TCPClient(('127.0.0.1', 0)), TCPClient(('127.0.0.1', 0))
+    first.update_position(1, 1)
+
+    assert first._outbound_packets_queue.depth == 1
+    assert second._outbound_packets_queue.depth == 0
+
+
+def _batch(*records: tuple[int, Packet]) -> BatchPacket:
+    return BatchPacket.from_bytes(
+        BatchPacket.frame_records([
+            BatchPacket.record(session, packet) for session, packet in records
+        ])
+    ).parse()
+
+
+def test_callbacks_are_dispatched_by_packet_type() -> None:
+    """Verifies that typed callbacks only get their packet type, and untyped callbacks get every
+    packet.
+    """
+
+    client = TCPClient(('127.0.0.1', 0))
+    identity = uuid4()
+    joined, moved, seen = [], [], []
+
+    client.add_callback(on_player_join(lambda i, attributes: joined.append(i)))
+    client.add_callback(on_player_move(lambda i, position: moved.append(position)))
+    client.add_callback(lambda i, packet: seen.append(packet.type) or packet)
+
+    client._handle_batch(_batch(
+        (1, SessionPacket.from_identity(identity)),
+        (1, PositionPacket.from_coordinates(3, 4)),
+        (1, LeavePacket.new()),
+    ))
+
+    assert joined == []
+    assert moved == [(3, 4)]
+    assert seen == [PacketType.LEAVE]
+
+
+def test_snapshot_callback_gets_every_move_of_a_batch() -> None:
+    """Verifies that the snapshot callback gets the moves of a batch at once, without the players
+    that left.
+    """
+
+    client = TCPClient(('127.0.0.1', 0))
+    identities = [uuid4() for _ in range(3)]
+    moved, snapshots = [], []
+
+    client.add_callback(on_player_move(lambda i, position: moved.append(position)))
+    client.snapshot_callback = snapshots.append
+
+    client._handle_batch(_batch(
+        *(
+            (session, SessionPacket.from_identity(identity))
+            for session, identity in enumerate(identities)
+        ),
+        *((session, PositionPacket.from_coordinates(session, session)) for session in range(3)),
+        (2, LeavePacket.new()),
+    ))
+
+    assert moved == []
+    assert snapshots == [{identities[0]: (0, 0), identities[1]: (1, 1)}]
+
+
+def test_announcing_a_player_does_not_change_the_snapshot_baselines() -> None:
+    """Verifies that a delta still applies when its baseline arrived before a player got announced.
+    """
+
+    client = TCPClient(('127.0.0.1', 0))
+    identity = uuid4()
+    moved = []
+
+    client.add_callback(on_player_move(lambda i, position: moved.append((i, position))))
+
+    # the snapshot came over the datagram channel, ahead of the session of the player.
+    client._handle_batch(_batch((WORLD_SESSION, SnapshotPacket.from_delta(1, {1: (64, 64)}))))
+    client._handle_batch(_batch((1, SessionPacket.from_identity(identity))))
+    delta = SnapshotPacket.from_delta(2, {1: (128, 64)}, 1, {1: (64, 64)})
+    client._handle_batch(_batch((WORLD_SESSION, delta)))
+
+    assert moved == [(identity, (2, 1))]
@@ -0,0 +1,37 @@
+from uuid import uuid4
+
+from squared.app.net.connection import Connection, OutboundQueue
+
+
+def test_full_queue_drops_the_oldest_latest_wins_packet() -> None:
+    """Verifies that a full queue makes room by dropping latest-wins packets, and refuses the
+    others.
+    """
+
+    queue = OutboundQueue(max_depth=3)
+
+    assert queue.put(b'a', key='a') and queue.put(b'b', key='b') and queue.put(b'1')
+    assert queue.put(b'2') and queue.put(b'b2', key='b')
+    assert queue.pop_all() == [b'b2', b'1', b'2']
+
+    assert queue.put(b'b', key='b') and queue.put(b'1') and queue.put(b'2') and queue.put(b'3')
+    assert not queue.put(b'4') and not queue.put(b'c', key='c')
+    assert queue.pop_all() == [b'1', b'2', b'3']
+
+
+def test_connection_gets_evicted_on_overflow() -> None:
+    """Verifies that a connection whose queue is full of packets that cannot be dropped gets
+    evicted.
+    """
+
+    closed = []
+    connection = Connection(uuid4(), lambda: closed.append(True), queue=OutboundQueue(max_depth=2))
+
+    for data in (b'1', b'2'):
+        connection.send(data)
+
+    assert not closed
+
+    connection.send(b'3')
+
+    assert closed and connection.queue.closed
@@ -0,0 +1,49 @@
+from squared.app.net.datagram import DatagramChannel, MAX_DATAGRAM_SIZE, is_newer
+from squared.app.net.packet import BatchPacket, DatagramPacket, Packet, PositionPacket
+
+
+def test_stale_datagrams_are_dropped() -> None:
+    """Verifies that a channel only accepts datagrams newer than every one before, across wrap-
+    around.
+    """
+
+    channel = DatagramChannel(lambda data, address: None)
+
+    assert channel.receive(0xFFFFFFFF, ('127.0.0.1', 1))
+    assert channel.receive(2, ('127.0.0.1', 2))
+    assert not channel.receive(1, ('127.0.0.1', 3))
+    assert not channel.receive(2, ('127.0.0.1', 3))
+
+    assert channel.address == ('127.0.0.1', 2)
+    assert is_newer(0, 0xFFFFFFFF) and not is_newer(0xFFFFFFFF, 0)
+
+
+def test_records_are_split_across_datagrams() -> None:
+    """Verifies that records get packed into datagrams that fit, and oversized ones are handed
+    back.
+    """
+
+    sent = []
+    channel = DatagramChannel(lambda data, address: sent.append(data))
+    records = [
+        BatchPacket.record(session, PositionPacket.from_coordinates(session, session))
+        for session in range(300)
+    ]
+    oversized = bytes(MAX_DATAGRAM_SIZE)
+
+    assert channel.send(records) == records
+
+    channel.receive(0, ('127.0.0.1', 1))
+    assert channel.send([*records, oversized]) == [oversized]
+
+    datagrams = [Packet.from_bytes(data).parse() for data in sent]
+    received = [
+        bytes(BatchPacket.record(session, record))
+        for datagram in datagrams
+        for session, record in datagram.embed.parse().records()
+    ]
+
+    assert all(len(data) <= MAX_DATAGRAM_SIZE for data in sent)
+    assert all(isinstance(datagram, DatagramPacket) for datagram in datagrams)
+    assert {datagram.sequence for datagram in datagrams} == {1}
+    assert len(datagrams) > 1 and received == records
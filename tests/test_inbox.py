@@ -0,0 +1,37 @@
+from uuid import uuid4
+
+from squared.app.game.inbox import Inbox
+
+
+def test_inbox_coalesces_moves_and_keeps_events_in_order() -> None:
+    """Verifies that every player moves once per drain, after the joins and leaves received in
+    order.
+    """
+
+    inbox = Inbox()
+    first, second, third = uuid4(), uuid4(), uuid4()
+    actions = []
+
+    inbox.move(second, (1, 1))
+    inbox.join(first, {'color': (0, 0, 0), 'position': (0, 0), 'size': (32, 32)})
+
+    for i in range(10):
+        inbox.move(first, (i, i))
+
+    inbox.move_all({second: (2, 2), third: (3, 3)})
+    inbox.leave(third)
+
+    inbox.drain(
+        lambda identity, attributes: actions.append(('join', identity)),
+        lambda identity: actions.append(('leave', identity)),
+        lambda identity, position, time: actions.append(('move', identity, position)),
+    )
+
+    assert actions == [
+        ('join', first), ('leave', third), ('move', second, (2, 2)), ('move', first, (9, 9)),
+    ]
+
+    actions.clear()
+    inbox.drain(actions.append, actions.append, actions.append)
+
+    assert actions == []
@@ -0,0 +1,39 @@
+from pytest import approx
+
+from squared.app.game.interpolation import PositionBuffer
+
+
+def test_buffer_interpolates_between_samples() -> None:
+    """Verifies that positions between two samples get interpolated, and the oldest samples get
+    overwritten.
+    """
+
+    buffer = PositionBuffer(capacity=4)
+
+    assert buffer.sample(0) is None
+
+    for i in range(6):
+        buffer.push(i, (10 * i, -10 * i))
+
+    assert len(buffer) == 4
+    assert buffer.sample(2.5) == approx((25, -25))
+    assert buffer.sample(4) == approx((40, -40))
+    assert buffer.sample(0) == approx((20, -20))
+
+
+def test_buffer_extrapolates_for_a_bounded_time() -> None:
+    """Verifies that positions after the newest sample follow the last velocity for a bounded time,
+    then settle.
+    """
+
+    buffer = PositionBuffer(max_extrapolation=0.5)
+    buffer.push(0, (0, 0))
+
+    assert buffer.sample(1) == approx((0, 0))
+
+    buffer.push(1, (10, 20))
+
+    assert buffer.sample(1.25) == approx((12.5, 25))
+    assert buffer.sample(1.5) == approx((15, 30))
+    assert buffer.sample(1.75) == approx((12.5, 25))
+    assert buffer.sample(10) == approx((10, 20))
@@ -0,0 +1,268 @@
+from random import Random
+from uuid import uuid4
+
+import pytest
+
+from squared.app.game.main import BOUNDS
+from squared.app.net.packet import (
+    AckPacket, BatchPacket, Capability, ChannelPacket, DatagramPacket, EmbeddedPacket, FixedPoint,
+    HelloPacket, POSITION_ENCODING, JoinPacket, LeavePacket, LegacyJoinPacket,
+    LegacyPositionPacket, MoveAckPacket, MovePacket, Packet, PacketType, PositionPacket,
+    RejectPacket, RoomPacket, SessionPacket, SnapshotPacket, WelcomePacket, WorldPacket,
+)
+
+
+def test_parse_decodes_in_place() -> None:
+    """Verifies that parsing turns a received packet into its specific type without copying it."""
+
+    record = BatchPacket.record(7, PositionPacket.from_coordinates(1.5, 2))
+    buffer = bytearray(BatchPacket.frame_records([record]))
+
+    packet = Packet.from_bytes(memoryview(buffer))
+    parsed = packet.parse()
+
+    assert parsed is packet and isinstance(parsed, BatchPacket)
+
+    (session, record), = parsed.records()
+    assert session == 7
+
+    position = record.parse()
+    assert isinstance(position, PositionPacket)
+    assert (position.x, position.y) == (1.5, 2)
+    assert position.data.obj is buffer
+
+
+def test_detached_packets_outlive_their_buffer() -> None:
+    """Verifies that a detached packet keeps its data when the receive buffer gets reused."""
+
+    blob = BatchPacket.frame_records(
+        [BatchPacket.record(7, PositionPacket.from_coordinates(3, 4))]
+    )
+    buffer = bytearray(blob)
+
+    packet = Packet.from_bytes(memoryview(buffer)).parse()
+    (_, record), = packet.records()
+    record.detach()
+    packet.detach()
+
+    buffer[:] = bytes(len(buffer))
+
+    assert (record.parse().x, record.parse().y) == (3, 4)
+    assert [session for session, _ in packet.records()] == [7]
+    assert packet.to_bytes() == blob
+
+
+def test_parse_rejects_malformed_packets() -> None:
+    """Verifies that parsing fails right away on data that does not fit the packet type."""
+
+    packet = Packet.from_bytes(b'\x00\x04\x00\x00\x00\x02ab')
+
+    with pytest.raises(ValueError):
+        packet.parse()
+
+    assert type(packet) is Packet
+
+
+def test_every_packet_type_round_trips() -> None:
+    """Verifies that every packet type parses back into its registered class with the same fields.
+    """
+
+    packets = [
+        EmbeddedPacket.from_packet(uuid4(), LeavePacket.new()),
+        JoinPacket.from_attributes({'color': (1, 2, 3), 'position': (4.5, 6.0), 'size': (32, 32)}),
+        LeavePacket.new(),
+        PositionPacket.from_coordinates(1.25, 8),
+        RejectPacket.from_reason('room full'),
+        RoomPacket.from_room(0xFFFFFFFF),
+        Packet.from_bytes(
+            BatchPacket.frame_records([BatchPacket.record(7, LeavePacket.new())])
+        ).parse(),
+        SessionPacket.from_identity(uuid4()),
+        SnapshotPacket.from_delta(1, {0: (1, 2)}),
+        AckPacket.from_sequence(1),
+        next(WorldPacket.pages([
+            (0, uuid4(), {'color': (1, 2, 3), 'position': (4, 5), 'size': (32, 32)}),
+        ])),
+        ChannelPacket.from_token(0xFFFFFFFFFFFFFFFF),
+        DatagramPacket.from_packet(1, 2, PositionPacket.from_coordinates(3, 4)),
+        HelloPacket.from_capabilities(7, Capability.DATAGRAMS),
+        WelcomePacket.from_capabilities(Capability.WORLD_PAGES),
+        MovePacket.from_coordinates(0xFFFFFFFF, 1.25, 8),
+        MoveAckPacket.from_coordinates(3, 4, 5.5),
+    ]
+
+    assert {packet.type for packet in packets} == set(PacketType)
+
+    for packet in packets:
+        parsed = Packet.from_bytes(packet.to_bytes()).parse()
+
+        assert type(parsed) is type(packet)
+        assert parsed.to_bytes() == packet.to_bytes()
+
+    assert Packet.from_bytes(packets[1].to_bytes()).parse().attributes == packets[1].attributes
+    assert Packet.from_bytes(packets[5].to_bytes()).parse().room == 0xFFFFFFFF
+
+
+def test_batch_records_round_trip() -> None:
+    """Verifies that batch records come out in order, split over as many batches as needed."""
+
+    max_records, BatchPacket.MAX_RECORDS = BatchPacket.MAX_RECORDS, 3
+
+    try:
+        updates = [
+            (session, PositionPacket.from_coordinates(session, session)) for session in range(7)
+        ]
+        updates.append((0xFFFF, LeavePacket.new()))
+
+        blob = BatchPacket.frame_records([
+            BatchPacket.record(session, packet) for session, packet in updates
+        ])
+    finally:
+        BatchPacket.MAX_RECORDS = max_records
+
+    received = []
+    view = memoryview(blob)
+    while view:
+        batch = Packet.from_bytes(view[:6 + int.from_bytes(view[2:6])]).parse()
+        view = view[6 + batch.length:]
+
+        assert isinstance(batch, BatchPacket)
+        received.extend(
+            (session, packet.parse().to_bytes()) for session, packet in batch.records()
+        )
+
+    assert received == [(session, packet.to_bytes()) for session, packet in updates]
+    assert len(blob) == 3 * 8 + sum(5 + packet.length for _, packet in updates)
+
+
+def test_positions_round_trip_within_precision() -> None:
+    """Verifies that every position in the world survives encoding within half a step."""
+
+    rng = Random(0)
+    tolerance = 0.5 / POSITION_ENCODING.scale
+
+    assert POSITION_ENCODING.max_value >= max(BOUNDS)
+
+    for _ in range(10_000):
+        x, y = rng.uniform(0, BOUNDS[0]), rng.uniform(0, BOUNDS[1])
+
+        packet = Packet.from_bytes(PositionPacket.from_coordinates(x, y).to_bytes()).parse()
+        assert abs(packet.x - x) <= tolerance and abs(packet.y - y) <= tolerance
+
+        attributes = {'color': (1, 2, 3), 'position': (x, y), 'size': (32, 32)}
+        join = Packet.from_bytes(JoinPacket.from_attributes(attributes).to_bytes()).parse()
+        assert join.attributes['position'] == (packet.x, packet.y)
+
+    expected = (0).to_bytes(2) + (480 * 64).to_bytes(2)
+    assert bytes(PositionPacket.from_coordinates(0, 480).data) == expected
+
+
+def test_legacy_packets_keep_float_coordinates() -> None:
+    """Verifies that legacy packets are parsed with the float encoding, and convert both ways."""
+
+    attributes = {'color': (1, 2, 3), 'position': (10.3, 20.7), 'size': (32, 32)}
+    frame = LegacyJoinPacket.from_attributes(attributes).to_bytes()
+
+    assert len(frame) == 6 + 3 + 2 * 4 + 2
+    with pytest.raises(ValueError):
+        Packet.from_bytes(frame).parse()
+
+    join = Packet.from_bytes(frame).parse(legacy=True)
+    assert isinstance(join, JoinPacket)
+    assert join.attributes['position'] == pytest.approx((10.3, 20.7))
+
+    # parsing an already parsed packet keeps its encoding.
+    assert join.parse() is join and isinstance(join, LegacyJoinPacket)
+
+    compact = join.for_encoding(legacy=False)
+    assert type(compact) is JoinPacket and compact.for_encoding(legacy=False) is compact
+    assert compact.attributes['position'] == (10.296875, 20.703125)
+
+    position = Packet.from_bytes(PositionPacket.from_coordinates(10.3, 20.7).to_bytes()).parse()
+    legacy = Packet.from_bytes(position.for_encoding(legacy=True).to_bytes()).parse(legacy=True)
+    assert type(legacy) is LegacyPositionPacket
+    assert (legacy.x, legacy.y) == (position.x, position.y)
+
+    leave = LeavePacket.new()
+    assert leave.for_encoding(legacy=True) is leave
+
+
+def test_fixed_point_precision_and_clamping() -> None:
+    """Verifies the precision of the fixed-point encoding and that it clamps out of range values.
+    """
+
+    coarse, fine = FixedPoint(2), FixedPoint(8)
+
+    assert coarse.decode(coarse.encode(10.3)) == 10.25
+    assert fine.decode(fine.encode(10.3)) == 10.30078125
+    assert fine.max_value < 256 <= coarse.max_value
+
+    assert coarse.encode(-5) == 0
+    assert coarse.encode(1e9) == 0xFFFF
+
+
+def test_snapshots_only_carry_changes_from_their_baseline() -> None:
+    """Verifies that a delta snapshot only carries the changed fields, and rebuilds the whole
+    snapshot.
+    """
+
+    baseline = {0: (10, 20), 1: (30, 40), 2: (50, 60)}
+    snapshot = {0: (10, 20), 1: (31, 40), 2: (50, 61), 3: (70, 80)}
+
+    full = Packet.from_bytes(SnapshotPacket.from_delta(1, baseline).to_bytes()).parse()
+    delta = Packet.from_bytes(
+        SnapshotPacket.from_delta(2, snapshot, 1, baseline).to_bytes()
+    ).parse()
+
+    assert (full.sequence, full.baseline) == (1, None)
+    assert (delta.sequence, delta.baseline) == (2, 1)
+    assert full.apply() == baseline
+    assert delta.apply(full.apply()) == snapshot
+
+    # players 1 and 2 changed a single field, player 3 is new: 2 * (3 + 2) + (3 + 4) bytes.
+    assert delta.length == 10 + 17
+
+    with pytest.raises(ValueError):
+        delta.apply({})
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_world_pages_round_trip(compress: bool) -> None:
+    """Verifies that the players of a room come out of the world pages in order, with their
+    attributes.
+    """
+
+    rng = Random(0)
+    players = [
+        (session, uuid4(), {
+            'color': (rng.randint(64, 255), rng.randint(64, 255), rng.randint(64, 255)),
+            'position': (rng.randrange(BOUNDS[0]), rng.randrange(BOUNDS[1])),
+            'size': (32, 32),
+        })
+        for session in range(2500)
+    ]
+
+    pages = [
+        Packet.from_bytes(page.to_bytes()).parse()
+        for page in WorldPacket.pages(players, compress)
+    ]
+    received = [
+        (session, identity, join_packet.parse().attributes)
+        for page in pages
+        for session, identity, join_packet in page.players()
+    ]
+
+    assert len(pages) == 3
+    assert received == players
+
+
+def test_corrupted_world_pages_are_rejected() -> None:
+    """Verifies that a world page that does not decompress to its player count is rejected."""
+
+    attributes = {'color': (1, 2, 3), 'position': (4, 5), 'size': (32, 32)}
+    page = next(WorldPacket.pages([(0, uuid4(), attributes)], compress=True))
+    data = bytearray(page.data)
+    data[2] = 2
+
+    with pytest.raises(ValueError):
+        list(Packet(PacketType.WORLD, len(data), bytes(data)).parse().players())
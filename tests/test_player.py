@@ -0,0 +1,74 @@
+from time import monotonic
+from uuid import UUID, uuid4
+
+from squared.app.game.sprites.player import MainPlayer, PLAYERS, RemotePlayer
+
+
+class _PredictingClient:
+    def __init__(self):
+        self.moves: list[tuple[int, tuple[int, int]]] = []
+
+    def update_position(self, x: int, y: int) -> int:
+        self.moves.append((len(self.moves) + 1, (x, y)))
+
+        return len(self.moves)
+
+
+def test_rejected_moves_get_replayed_on_the_server_position() -> None:
+    """Verifies that the moves still in flight get replayed on top of the authoritative position
+    the server acknowledges, and that the player only gets corrected when none is left.
+    """
+
+    client = _PredictingClient()
+    player = MainPlayer(UUID(int=0), (0, 0, 720, 480), client)
+    player.set_attributes({'color': (1, 2, 3), 'position': (100, 100), 'size': (32, 32)})
+    player.set_velocity(x=10)
+
+    for _ in range(3):
+        player.update()
+
+    assert client.moves == [(1, (110, 100)), (2, (120, 100)), (3, (130, 100))]
+
+    player.reconcile(1, (110, 100))
+    assert (player.x, player.y) == (130, 100)
+
+    # the server rejected the second move, and the third one takes the player where predicted.
+    player.reconcile(2, (110, 100))
+    assert (player.x, player.y) == (130, 100)
+
+    player.reconcile(1, (100, 100))
+    assert (player.x, player.y) == (130, 100)
+
+    player.reconcile(3, (130, 100))
+    assert (player.x, player.y) == (130, 100)
+
+    # with no move left to replay, a rejected move puts the player back where the server has it.
+    player.update()
+    assert client.moves[-1] == (4, (140, 100))
+
+    player.reconcile(4, (130, 100))
+    assert (player.x, player.y) == (130, 100)
+
+    player.update()
+    assert client.moves[-1] == (5, (140, 100))
+
+
+def test_remote_positions_are_not_checked_against_delayed_players() -> None:
+    """Verifies that a remote player follows another one, however far in the past it is rendered.
+    """
+
+    now: float = monotonic()
+    leader = RemotePlayer(uuid4(), (0, 0, 720, 480), (1, 2, 3), (100, 100), (32, 32), delay=10)
+    follower = RemotePlayer(uuid4(), (0, 0, 720, 480), (1, 2, 3), (40, 100), (32, 32), delay=0)
+
+    PLAYERS.update({leader._identity: leader, follower._identity: follower})
+
+    try:
+        leader.update()
+        leader.set_position(140, 100, time=now)
+        follower.set_position(105, 100, time=now)
+        follower.update()
+
+        assert (follower.x, follower.y) == (105, 100)
+    finally:
+        PLAYERS.clear()
@@ -0,0 +1,285 @@
+from random import Random
+from threading import Thread
+from time import sleep
+from uuid import UUID, uuid4
+
+from squared.app.net.connection import Connection
+from squared.app.net.packet import (
+    ALL_CAPABILITIES, AckPacket, BatchPacket, Capability, EmbeddedPacket, LegacyJoinPacket,
+    LegacyPositionPacket, MoveAckPacket, MovePacket, Packet, PacketType, PositionPacket, Snapshot,
+    SnapshotPacket,
+)
+from squared.app.net.room import Room
+
+
+def _records[P: Packet](connection: Connection, packet_class: type[P] = Packet) -> list[P]:
+    """Returns the parsed batch records of a class queued for a client, emptying its queue."""
+
+    if not (records := connection.queue.pop_all()):
+        return []
+
+    batch = Packet.from_bytes(BatchPacket.frame_records(records)).parse()
+
+    return [
+        record for _, record in batch.records() if isinstance(record.parse(), packet_class)
+    ]
+
+
+def test_room_survives_concurrent_clients() -> None:
+    """Verifies that a room stays consistent while many threads join, move and leave at once."""
+
+    room = Room(0)
+    errors = []
+
+    def client(seed: int) -> None:
+        rng = Random(seed)
+
+        try:
+            for _ in range(20):
+                connection = Connection(uuid4(), lambda: None)
+                room.join(connection)
+
+                for _ in range(50):
+                    room.handle_packet(
+                        connection.identity,
+                        PositionPacket.from_coordinates(rng.uniform(0, 600), rng.uniform(0, 400)),
+                    )
+
+                room.leave(connection.identity)
+        except Exception as e:
+            errors.append(e)
+
+    def ticker() -> None:
+        try:
+            while not stopped:
+                room.tick()
+                room.queue_depths()
+        except Exception as e:
+            errors.append(e)
+
+    stopped = False
+    tick_thread = Thread(target=ticker)
+    tick_thread.start()
+
+    client_threads = [Thread(target=client, args=(seed,)) for seed in range(8)]
+    for thread in client_threads:
+        thread.start()
+    for thread in client_threads:
+        thread.join()
+
+    stopped = True
+    tick_thread.join()
+    room.tick()
+
+    assert not errors
+    assert room.players == 0
+    assert len(room._state) == 0 and len(room._state.grid) == 0
+
+
+def test_packets_are_applied_on_tick() -> None:
+    """Verifies that received packets only change the room state when the room ticks."""
+
+    room = Room(0)
+    connection = Connection(uuid4(), lambda: None)
+    room.join(connection)
+    connection.queue.pop_all()
+
+    room.handle_packet(connection.identity, PositionPacket.from_coordinates(100, 100))
+    assert room._state[connection.identity]['position'] != (100, 100)
+
+    room.tick()
+    assert room._state[connection.identity]['position'] == (100, 100)
+
+    # the player that moved is not sent its own position.
+    assert connection.queue.pop_all() == []
+
+
+def test_delta_snapshots_follow_acknowledgements() -> None:
+    """Verifies that clients get full snapshots until they acknowledge one, and deltas after that.
+    """
+
+    # no filters, so that no move gets rejected for colliding with a randomly placed player.
+    room = Room(0, filters=[], delta_snapshots=True)
+    connections = [
+        Connection(uuid4(), lambda: None, capabilities=ALL_CAPABILITIES) for _ in range(2)
+    ]
+
+    for connection in connections:
+        room.join(connection)
+
+    room.tick()
+    first, = _records(connections[0], SnapshotPacket)
+    assert first.baseline is None and len(first.apply()) == 2
+
+    room.handle_packet(connections[0].identity, AckPacket.from_sequence(first.sequence))
+    room.handle_packet(connections[1].identity, PositionPacket.from_coordinates(100, 100))
+    room.tick()
+
+    delta, = _records(connections[0], SnapshotPacket)
+    assert delta.baseline == first.sequence
+    moved = room._sessions[connections[1].identity]
+    assert delta.apply(first.apply()) == first.apply() | {moved: (6400, 6400)}
+
+    full, = _records(connections[1], SnapshotPacket)
+    assert full.baseline is None
+
+
+def test_clients_only_get_the_capabilities_they_negotiated() -> None:
+    """Verifies that legacy and negotiating clients in the same room each get the format they
+    support.
+    """
+
+    def embeds(connection: Connection) -> list[tuple[UUID, Packet]]:
+        packets = [Packet.from_bytes(data).parse() for data in connection.queue.pop_all()]
+
+        assert all(isinstance(packet, EmbeddedPacket) for packet in packets)
+
+        return [(packet.identity, packet.embed.parse(legacy=True)) for packet in packets]
+
+    room = Room(0, filters=[], delta_snapshots=True)
+    first = Connection(uuid4(), lambda: None)
+    room.join(first)
+
+    legacy = Connection(uuid4(), lambda: None)
+    capable = Connection(uuid4(), lambda: None, capabilities=ALL_CAPABILITIES)
+    room.join(legacy)
+    room.join(capable)
+
+    # the legacy client learns about its own join, the first player and the capable one.
+    joins = embeds(legacy)
+    assert [identity for identity, _ in joins] == [UUID(int=0), first.identity, capable.identity]
+    assert all(isinstance(packet, LegacyJoinPacket) for _, packet in joins)
+    assert [record.type for record in _records(capable)] == [
+        PacketType.SESSION, PacketType.JOIN, PacketType.WORLD,
+    ]
+
+    # legacy clients send float coordinates, and get them back embedded.
+    room.handle_packet(first.identity, LegacyPositionPacket.from_coordinates(100.5, 100.25))
+    room.tick()
+
+    (identity, position), = embeds(legacy)
+    assert identity == first.identity and isinstance(position, LegacyPositionPacket)
+    assert (position.x, position.y) == (100.5, 100.25)
+    assert [record.type for record in _records(capable)] == [PacketType.SNAPSHOT]
+
+
+def test_moves_are_acknowledged_with_the_authoritative_position() -> None:
+    """Verifies that the latest move of a player gets acknowledged once per tick, even when
+    filtered.
+    """
+
+    room = Room(0)
+    connection = Connection(uuid4(), lambda: None, capabilities=ALL_CAPABILITIES)
+    room.join(connection)
+    connection.queue.pop_all()
+
+    room.handle_packet(connection.identity, MovePacket.from_coordinates(1, 100, 100))
+    room.handle_packet(connection.identity, MovePacket.from_coordinates(2, 200, 200))
+    room.tick()
+
+    ack, = _records(connection, MoveAckPacket)
+    assert (ack.sequence, ack.x, ack.y) == (2, 200, 200)
+
+    room.handle_packet(connection.identity, MovePacket.from_coordinates(3, 1000, 1000))
+    room.tick()
+
+    ack, = _records(connection, MoveAckPacket)
+    assert (ack.sequence, ack.x, ack.y) == (3, 200, 200)
+
+    room.tick()
+    assert connection.queue.pop_all() == []
+
+
+def test_delta_snapshots_only_refer_to_what_each_client_was_sent() -> None:
+    """Verifies that clients rebuild every snapshot when interest management hides part of the
+    room.
+    """
+
+    def receive(connection: Connection, snapshots: dict[int, Snapshot]) -> Snapshot:
+        packet, = _records(connection, SnapshotPacket)
+
+        snapshots[packet.sequence] = snapshot = packet.apply(snapshots.get(packet.baseline))
+        room.handle_packet(connection.identity, AckPacket.from_sequence(packet.sequence))
+
+        return snapshot
+
+    room = Room(0, filters=[], delta_snapshots=True, interest_radius=100)
+    first, second = (
+        Connection(uuid4(), lambda: None, capabilities=ALL_CAPABILITIES) for _ in range(2)
+    )
+    snapshots: dict[int, Snapshot] = {}
+
+    for connection in (first, second):
+        room.join(connection)
+
+    room.handle_packet(first.identity, PositionPacket.from_coordinates(100, 100))
+    room.handle_packet(second.identity, PositionPacket.from_coordinates(400, 100))
+    room.tick()
+
+    assert room._sessions[second.identity] not in receive(first, snapshots)
+
+    room.tick()
+    receive(first, snapshots)
+
+    # the second player only moves horizontally into the area of the first one.
+    room.handle_packet(second.identity, PositionPacket.from_coordinates(150, 100))
+    room.tick()
+
+    assert receive(first, snapshots)[room._sessions[second.identity]] == (150 * 64, 100 * 64)
+
+
+def test_clients_that_stop_reading_get_evicted() -> None:
+    """Verifies that a client gets evicted when its queue is not drained, even though it never
+    fills up.
+    """
+
+    room = Room(0, evict_after=0.05)
+    closed = []
+    reading, stuck = (
+        Connection(uuid4(), lambda c=c: closed.append(c)) for c in ('reading', 'stuck')
+    )
+
+    for connection in (reading, stuck):
+        room.join(connection)
+
+    for i in range(5):
+        room.handle_packet(reading.identity, PositionPacket.from_coordinates(100 + i, 100))
+        room.tick()
+        reading.queue.pop_all()
+
+        assert stuck.queue.depth < 10
+
+        sleep(0.1)
+
+    assert closed == ['stuck']
+
+
+def test_players_are_only_sent_the_players_in_their_area() -> None:
+    """Verifies that players get announced when they enter an area, removed when they leave it, and
+    are not sent outside of it.
+    """
+
+    room = Room(0, filters=[], interest_radius=100)
+    first, second = (
+        Connection(uuid4(), lambda: None, capabilities=Capability.COMPACT_ENCODING)
+        for _ in range(2)
+    )
+
+    for connection in (first, second):
+        room.join(connection)
+
+    room.handle_packet(first.identity, PositionPacket.from_coordinates(100, 100))
+    room.handle_packet(second.identity, PositionPacket.from_coordinates(400, 100))
+    room.tick()
+    _records(first)
+
+    for x, expected in (
+            (150, [PacketType.SESSION, PacketType.JOIN]),
+            (160, [PacketType.POSITION]),
+            (500, [PacketType.LEAVE]),
+            (520, []),
+    ):
+        room.handle_packet(second.identity, PositionPacket.from_coordinates(x, 100))
+        room.tick()
+
+        assert [record.type for record in _records(first)] == expected
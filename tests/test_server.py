@@ -0,0 +1,152 @@
+import asyncio
+from socket import create_connection, socket
+from threading import Thread
+from time import monotonic, sleep
+from uuid import UUID
+
+import pytest
+
+from squared.app.net.packet import (
+    BatchPacket, Capability, EmbeddedPacket, HelloPacket, LegacyJoinPacket, LegacyPositionPacket,
+    Packet, PacketType, RejectPacket, RoomPacket,
+)
+from squared.app.net.server import AsyncTCPServer, BaseServer, HANDSHAKE_TIMEOUT, TCPServer
+from squared.app.net.stream import PacketReader
+
+
+def _serve(server_class: type[BaseServer], **options) -> tuple[BaseServer, int]:
+    with socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port: int = s.getsockname()[1]
+
+    server = server_class(('127.0.0.1', port), **options)
+
+    if isinstance(server, AsyncTCPServer):
+        Thread(target=asyncio.run, args=(server._handle_server(),), daemon=True).start()
+    else:
+        Thread(target=server._handle_server, daemon=True).start()
+
+    deadline: float = monotonic() + 5
+
+    while True:
+        try:
+            create_connection(('127.0.0.1', port)).close()
+
+            return server, port
+        except ConnectionRefusedError:
+            if monotonic() > deadline:
+                raise
+
+            sleep(0.01)
+
+
+def _wait_for(condition) -> None:
+    deadline: float = monotonic() + 5
+
+    while not condition():
+        assert monotonic() < deadline
+
+        sleep(0.01)
+
+
+def _receive(sock: socket) -> Packet:
+    sock.settimeout(5)
+
+    return Packet.from_bytes(bytes(next(iter(PacketReader(sock))))).parse()
+
+
+def _record_types(packet: Packet) -> list[PacketType]:
+    assert isinstance(packet, BatchPacket)
+
+    return [record.type for _, record in packet.records()]
+
+
+@pytest.mark.parametrize('server_class', [AsyncTCPServer, TCPServer])
+def test_rooms_are_opened_on_demand_and_closed_when_empty(server_class: type[BaseServer]) -> None:
+    """Verifies that rooms get created by their first player, and closed when the last one leaves.
+    """
+
+    server, port = _serve(server_class, max_rooms=1)
+
+    first = create_connection(('127.0.0.1', port))
+    first.sendall(HelloPacket.from_capabilities(1, 0).to_bytes())
+    _receive(first)
+
+    assert list(server._rooms) == [1]
+
+    # the server cannot host a second room.
+    with create_connection(('127.0.0.1', port)) as second:
+        second.sendall(HelloPacket.from_capabilities(2, 0).to_bytes())
+        reject = _receive(second)
+
+    assert isinstance(reject, RejectPacket) and reject.reason == 'server full'
+
+    room = server._rooms[1]
+    first.close()
+    _wait_for(lambda: not server._rooms)
+
+    assert room.closed
+
+
+@pytest.mark.parametrize('server_class', [AsyncTCPServer, TCPServer])
+def test_silent_clients_join_room_zero(server_class: type[BaseServer]) -> None:
+    """Verifies that a client sending nothing joins room 0 once the handshake times out."""
+
+    server, port = _serve(server_class)
+
+    with create_connection(('127.0.0.1', port)) as sock:
+        start: float = monotonic()
+        packet = _receive(sock)
+
+        assert monotonic() - start >= HANDSHAKE_TIMEOUT * 0.9
+        assert isinstance(packet, EmbeddedPacket) and packet.identity == UUID(int=0)
+        assert list(server._rooms) == [0]
+
+    _wait_for(lambda: not server._rooms)
+
+
+@pytest.mark.parametrize('server_class', [AsyncTCPServer, TCPServer])
+def test_legacy_clients_keep_the_float_encoding(server_class: type[BaseServer]) -> None:
+    """Verifies that clients that do not shake hands get and send packets in the legacy encoding.
+    """
+
+    server, port = _serve(server_class, filters=[])
+
+    with create_connection(('127.0.0.1', port)) as sock:
+        sock.sendall(RoomPacket.from_room(0).to_bytes())
+        join = _receive(sock)
+
+        assert isinstance(join, EmbeddedPacket) and join.identity == UUID(int=0)
+        assert isinstance(join.embed.parse(legacy=True), LegacyJoinPacket)
+
+        sock.sendall(LegacyPositionPacket.from_coordinates(100.5, 200.25).to_bytes())
+        state = server._rooms[0]._state
+
+        _wait_for(lambda: [p['position'] for p in state.values()] == [(100.5, 200.25)])
+
+
+def test_async_server_welcomes_players_and_announces_their_leave() -> None:
+    """Verifies the whole life of a connection to the asyncio server, from the handshake to the
+    leave.
+    """
+
+    _, port = _serve(AsyncTCPServer)
+
+    with create_connection(('127.0.0.1', port)) as first:
+        first.sendall(HelloPacket.from_capabilities(0, Capability.COMPACT_ENCODING).to_bytes())
+
+        assert _record_types(_receive(first)) == [
+            PacketType.WELCOME, PacketType.SESSION, PacketType.JOIN,
+        ]
+
+        with create_connection(('127.0.0.1', port)) as second:
+            second.sendall(
+                HelloPacket.from_capabilities(0, Capability.COMPACT_ENCODING).to_bytes()
+            )
+
+            assert _record_types(_receive(second))[:3] == [
+                PacketType.WELCOME, PacketType.SESSION, PacketType.JOIN,
+            ]
+            assert _record_types(_receive(first)) == [PacketType.SESSION, PacketType.JOIN]
+
+        assert _record_types(_receive(first)) == [PacketType.LEAVE]
@@ -0,0 +1,86 @@
+from random import Random
+from uuid import uuid4
+
+from pygame import Rect
+
+from squared.app.game.sprites.player import PLAYER_SIZE
+from squared.app.net.filters import player_collision_filter
+from squared.app.net.packet import PositionPacket
+from squared.app.net.spatial import SpatialGrid
+from squared.app.net.state import WorldState
+
+
+def _random_rect(rng: Random) -> Rect:
+    return Rect(
+        rng.uniform(-50, 700), rng.uniform(-50, 450), rng.randint(1, 80), rng.randint(1, 80)
+    )
+
+
+def test_grid_query_finds_every_collision() -> None:
+    """Verifies that a grid query returns every rectangle colliding with the queried area."""
+
+    rng = Random(0)
+    grid = SpatialGrid(32)
+    rects = {}
+
+    for key in range(200):
+        rects[key] = _random_rect(rng)
+        grid.insert(key, rects[key])
+
+    for key in range(0, 200, 2):
+        rects[key] = Rect(rng.uniform(-50, 700), rng.uniform(-50, 450), *PLAYER_SIZE)
+        grid.insert(key, rects[key])
+
+    for _ in range(500):
+        area = _random_rect(rng)
+        expected = {key for key, rect in rects.items() if area.colliderect(rect)}
+
+        assert set(grid.colliding(area)) == expected
+
+
+def test_collision_filter_matches_linear_scan() -> None:
+    """Verifies that the collision filter gives the same results with and without the spatial
+    index.
+    """
+
+    rng = Random(1)
+    packet_filter = player_collision_filter()
+    indexed_state = WorldState()
+    plain_state = {}
+
+    for _ in range(100):
+        identity = uuid4()
+        attributes = {
+            'color': (255, 255, 255),
+            'position': (rng.uniform(0, 688), rng.uniform(0, 448)),
+            'size': PLAYER_SIZE,
+        }
+
+        indexed_state[identity] = attributes
+        plain_state[identity] = dict(attributes)
+
+    identities = list(plain_state)
+    for _ in range(2000):
+        identity = rng.choice(identities)
+        packet = PositionPacket.from_coordinates(rng.uniform(0, 688), rng.uniform(0, 448))
+
+        result = packet_filter(identity, packet, indexed_state)
+        assert result == packet_filter(identity, packet, plain_state)
+
+        if result:
+            indexed_state.move(identity, (packet.x, packet.y))
+            plain_state[identity]['position'] = (packet.x, packet.y)
+
+
+def test_free_position_fills_the_world() -> None:
+    """Verifies that spawn placement never overlaps players and stops once the world is full."""
+
+    rng = Random(2)
+    state = WorldState()
+
+    while (position := state.free_position(PLAYER_SIZE, (720, 480), rng=rng)) is not None:
+        assert next(state.colliding(Rect(*position, *PLAYER_SIZE)), None) is None
+
+        state[uuid4()] = {'color': (255, 255, 255), 'position': position, 'size': PLAYER_SIZE}
+
+    assert len(state) >= (720 // PLAYER_SIZE[0]) * (480 // PLAYER_SIZE[1]) // 4
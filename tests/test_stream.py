@@ -0,0 +1,88 @@
+import asyncio
+from random import Random
+from socket import error as socket_error, socketpair
+import struct
+from threading import Thread
+
+import pytest
+
+from squared.app.net.packet import Packet, PositionPacket, RejectPacket
+from squared.app.net.stream import PacketReader
+
+
+def test_reader_reassembles_fragmented_packets() -> None:
+    """Verifies that packets come out whole, however the stream gets split."""
+
+    rng = Random(0)
+    packets = [
+        RejectPacket.from_reason('x' * rng.randint(0, 300)) if i % 3 else
+        PositionPacket.from_coordinates(i, -i)
+        for i in range(500)
+    ]
+    stream = b''.join(packet.to_bytes() for packet in packets)
+
+    def send() -> None:
+        with writer:
+            position = 0
+            while position < len(stream):
+                size = rng.choice((1, 2, 5, 7, 64, 1000))
+                writer.sendall(stream[position:position + size])
+                position += size
+
+    reader_sock, writer = socketpair()
+    thread = Thread(target=send)
+    thread.start()
+
+    received = []
+    with reader_sock, pytest.raises(socket_error):
+        for blob in PacketReader(reader_sock, buffer_size=64):
+            received.append(Packet.from_bytes(blob).parse().detach())
+
+    thread.join()
+
+    assert [packet.to_bytes() for packet in received] == [packet.to_bytes() for packet in packets]
+
+
+def test_reader_rejects_oversized_packets() -> None:
+    """Verifies that a packet larger than the maximum packet size drops the connection."""
+
+    reader_sock, writer = socketpair()
+
+    with reader_sock, writer:
+        writer.sendall(RejectPacket.from_reason('x' * 100).to_bytes())
+
+        with pytest.raises(socket_error):
+            next(iter(PacketReader(reader_sock, max_packet_size=64)))
+
+
+def test_stream_reads_reject_oversized_packets_before_reading_them() -> None:
+    """Verifies that reading an asyncio stream fails on the header of a packet larger than the
+    maximum packet size, without waiting for its data.
+    """
+
+    async def read() -> None:
+        stream = asyncio.StreamReader()
+        stream.feed_data(struct.pack('>HI', PositionPacket._packet_type, 0xFFFFFFFF))
+
+        await Packet.from_stream(stream, timeout=1)
+
+    with pytest.raises(socket_error, match='too large'):
+        asyncio.run(read())
+
+
+def test_stream_reads_time_out_on_the_whole_packet() -> None:
+    """Verifies that the timeout of a stream read covers the data of the packet, not only its
+    header, and that a packet that never starts arriving leaves the stream untouched.
+    """
+
+    async def read(data: bytes) -> None:
+        stream = asyncio.StreamReader()
+        stream.feed_data(data)
+
+        await Packet.from_stream(stream, timeout=0.05)
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(read(b''))
+
+    with pytest.raises(socket_error, match='timed out'):
+        asyncio.run(read(RejectPacket.from_reason('x' * 100).to_bytes()[:50]))
@@ -0,0 +1,101 @@
+import asyncio
+import socket
+import struct
+
+import pytest
+
+from squared.app.net.packet import HelloPacket, PositionPacket, RoomPacket
+from squared.app.net.server import HANDSHAKE_TIMEOUT
+
+supervisor = pytest.importorskip('squared.app.net.supervisor')
+
+
+def test_peek_room_reads_the_room_without_consuming_it() -> None:
+    """Verifies that the room of a client is read from its first packet, which stays in the socket.
+    """
+
+    hello: bytes = HelloPacket.from_capabilities(42, 0).to_bytes()
+
+    client, server = socket.socketpair()
+
+    with client, server:
+        client.sendall(hello[:5])
+        assert supervisor.peek_room(server) is None
+
+        client.sendall(hello[5:])
+        assert supervisor.peek_room(server) == 42
+        assert server.recv(len(hello)) == hello
+
+        client.sendall(RoomPacket.from_room(7).to_bytes())
+        assert supervisor.peek_room(server) == 7
+        server.recv(64)
+
+        # clients that start with any other packet join room 0.
+        client.sendall(PositionPacket.from_coordinates(1, 2).to_bytes())
+        assert supervisor.peek_room(server) == 0
+
+        server.recv(64)
+        client.close()
+
+        with pytest.raises(OSError):
+            supervisor.peek_room(server)
+
+
+def test_connections_are_routed_to_the_worker_owning_their_room() -> None:
+    """Verifies that the supervisor hands every connection over to the worker owning its room."""
+
+    pairs = [socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET) for _ in range(3)]
+    server = supervisor.Supervisor(('127.0.0.1', 0), workers=3)
+    server._controls = [parent for parent, _ in pairs]
+
+    client, connection = socket.socketpair()
+
+    try:
+        server._route_connection(5, connection, 0.25)
+
+        payload, fds, _, _ = socket.recv_fds(pairs[2][1], 64, 1)
+        assert struct.unpack('>Id', payload) == (5, 0.25) and len(fds) == 1
+
+        # the worker gets the same connection.
+        with socket.socket(fileno=fds[0]) as adopted:
+            client.sendall(b'ping')
+            assert adopted.recv(4) == b'ping'
+
+        assert connection.fileno() == -1
+        assert [
+            supervisor.WorkerServer(('127.0.0.1', 0), index=index, workers=3)._owns(5)
+            for index in range(3)
+        ] == [False, False, True]
+    finally:
+        client.close()
+
+        for parent, child in pairs:
+            parent.close()
+            child.close()
+
+
+def test_adopted_connections_only_get_what_is_left_of_their_handshake() -> None:
+    """Verifies that a worker does not restart the handshake timeout of a connection it adopts."""
+
+    async def adopt(connection: socket.socket) -> float:
+        server = supervisor.WorkerServer(('127.0.0.1', 0))
+        loop = asyncio.get_running_loop()
+        started: float = loop.time()
+        adoption = asyncio.create_task(server._adopt_connection(connection, 0.0))
+
+        while 0 not in server._rooms:
+            await asyncio.sleep(0.01)
+
+        elapsed: float = loop.time() - started
+
+        client.close()
+        await adoption
+
+        return elapsed
+
+    with socket.create_server(('127.0.0.1', 0)) as listener:
+        client = socket.create_connection(listener.getsockname())
+        connection, _ = listener.accept()
+
+    # the silent client had no time left, so it joins room 0 right away.
+    assert asyncio.run(asyncio.wait_for(adopt(connection), 5)) < HANDSHAKE_TIMEOUT / 2